@@ -0,0 +1,98 @@
+import base64
+import os
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+
+
+# Header byte that prefixes every versioned ciphertext
+VERSION_FERNET = 0x01
+VERSION_AESGCM = 0x02
+VERSION_CHACHA20 = 0x03
+
+ENGINES = {
+    'fernet': VERSION_FERNET,
+    'aesgcm': VERSION_AESGCM,
+    'chacha20': VERSION_CHACHA20,
+}
+
+NONCE_SIZE = 12
+
+
+def get_version(stored):
+    """Return the header version of a stored ciphertext, or None for legacy rows"""
+    if not stored:
+        return None
+    version = stored[0]
+    if isinstance(version, str):
+        return None
+    return version if version in ENGINES.values() else None
+
+
+def to_bytes(stored):
+    """Normalize a stored ciphertext (bytes, memoryview or legacy text) to bytes"""
+    if isinstance(stored, memoryview):
+        return stored.tobytes()
+    if isinstance(stored, str):
+        return stored.encode()
+    return stored
+
+
+class CipherSet:
+    """
+    Cipher objects for one 32-byte key, built lazily per engine.
+
+    Ciphertexts are laid out as a single version byte followed by the
+    engine payload: the raw Fernet token, or a 12-byte nonce plus the AEAD
+    ciphertext and tag. Legacy rows (base64 text wrapping a Fernet token)
+    carry no header and are still decrypted transparently.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self._ciphers = {}
+
+    def get(self, version):
+        """Return the cipher object for a format version"""
+        cipher = self._ciphers.get(version)
+        if cipher is None:
+            if version == VERSION_FERNET:
+                cipher = Fernet(base64.urlsafe_b64encode(self.key))
+            elif version == VERSION_AESGCM:
+                cipher = AESGCM(self.key)
+            elif version == VERSION_CHACHA20:
+                cipher = ChaCha20Poly1305(self.key)
+            else:
+                raise ValueError(f"Unknown ciphertext version: {version}")
+            self._ciphers[version] = cipher
+        return cipher
+
+    def encrypt(self, plaintext, engine='aesgcm'):
+        """Encrypt a string and return the versioned ciphertext bytes"""
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown encryption engine: {engine}")
+        version = ENGINES[engine]
+        header = bytes([version])
+        cipher = self.get(version)
+
+        if version == VERSION_FERNET:
+            return header + cipher.encrypt(plaintext.encode())
+
+        nonce = os.urandom(NONCE_SIZE)
+        return header + nonce + cipher.encrypt(nonce, plaintext.encode(), header)
+
+    def decrypt(self, stored):
+        """Decrypt a versioned or legacy ciphertext and return the string"""
+        stored = to_bytes(stored)
+        version = get_version(stored)
+
+        if version is None:
+            # Legacy row: base64 text wrapping a Fernet token
+            token = base64.b64decode(stored)
+            return self.get(VERSION_FERNET).decrypt(token).decode()
+
+        cipher = self.get(version)
+        if version == VERSION_FERNET:
+            return cipher.decrypt(stored[1:]).decode()
+
+        nonce = stored[1:1 + NONCE_SIZE]
+        return cipher.decrypt(nonce, stored[1 + NONCE_SIZE:], stored[:1]).decode()
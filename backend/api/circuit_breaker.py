@@ -0,0 +1,102 @@
+import threading
+import time
+import requests
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of contacting a host whose circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker for outbound requests.
+
+    A host's circuit opens after `failure_threshold` consecutive failures, and
+    requests to it then fail immediately. After `reset_timeout` seconds the
+    circuit half-opens and lets a single trial request through: success
+    closes it again, failure re-opens it for another `reset_timeout`.
+
+    Only hosts with recent failures are tracked: a success forgets the host,
+    and at most `max_entries` hosts are kept.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=60, max_entries=4096):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_entries = max_entries
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, host):
+        if host not in self._hosts and len(self._hosts) >= self.max_entries:
+            # Evict hosts whose circuit is still closed first, then everything
+            self._hosts = {h: e for h, e in self._hosts.items() if e['state'] != self.CLOSED}
+            if len(self._hosts) >= self.max_entries:
+                self._hosts.clear()
+        return self._hosts.setdefault(host, {
+            'state': self.CLOSED, 'failures': 0, 'opened_at': None, 'rejected': 0, 'trial': False,
+        })
+
+    def before_request(self, host):
+        """Raise CircuitOpenError unless a request to `host` may go ahead"""
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None or entry['state'] == self.CLOSED:
+                return
+            if entry['state'] == self.OPEN and time.monotonic() - entry['opened_at'] >= self.reset_timeout:
+                entry['state'] = self.HALF_OPEN
+                entry['trial'] = False
+            if entry['state'] == self.HALF_OPEN and not entry['trial']:
+                entry['trial'] = True
+                return
+            entry['rejected'] += 1
+        raise CircuitOpenError(f"Circuit open for {host}")
+
+    def record_success(self, host):
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def release(self, host):
+        """End a request that neither succeeded nor failed, freeing a half-open trial"""
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is not None:
+                entry['trial'] = False
+
+    def record_failure(self, host):
+        with self._lock:
+            entry = self._entry(host)
+            entry['failures'] += 1
+            entry['trial'] = False
+            if entry['state'] == self.HALF_OPEN or entry['failures'] >= self.failure_threshold:
+                entry['state'] = self.OPEN
+                entry['opened_at'] = time.monotonic()
+
+    def reset(self, host=None):
+        """Close one host's circuit, or forget every host"""
+        with self._lock:
+            if host is None:
+                self._hosts.clear()
+            else:
+                self._hosts.pop(host, None)
+
+    def stats(self):
+        """Return the state of every host that has failed since its last success"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                host: {
+                    'state': entry['state'],
+                    'failures': entry['failures'],
+                    'rejected': entry['rejected'],
+                    'retry_in': (
+                        max(round(self.reset_timeout - (now - entry['opened_at']), 1), 0)
+                        if entry['state'] == self.OPEN else None
+                    ),
+                }
+                for host, entry in self._hosts.items()
+            }
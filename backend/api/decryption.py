@@ -0,0 +1,111 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.conf import settings
+from .ciphers import CipherSet, to_bytes
+from .keyring import keyring
+
+
+# Rows per task handed to a pool worker
+CHUNK_SIZE = 64
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _decrypt_chunk_with_key(key, tokens):
+    """Decrypt a chunk of tokens sharing one key; runs inside pool workers"""
+    return _decrypt_chunk(CipherSet(key), tokens)
+
+
+def _decrypt_chunk(cipher_set, tokens):
+    """Decrypt a chunk of tokens with one author's CipherSet, None for rows that fail"""
+    results = []
+    for token in tokens:
+        try:
+            results.append(cipher_set.decrypt(token))
+        except Exception:
+            results.append(None)
+    return results
+
+
+def _get_workers():
+    return getattr(settings, 'ACCOUNT_DECRYPT_WORKERS', None) or os.cpu_count() or 1
+
+
+def _get_executor(kind):
+    """Return the shared pool for the given executor kind, creating it lazily"""
+    with _executors_lock:
+        executor = _executors.get(kind)
+        if executor is None:
+            if kind == 'process':
+                executor = ProcessPoolExecutor(max_workers=_get_workers())
+            else:
+                executor = ThreadPoolExecutor(max_workers=_get_workers(), thread_name_prefix='decrypt')
+            _executors[kind] = executor
+        return executor
+
+
+def decrypt_passwords(accounts):
+    """
+    Decrypt the passwords of many accounts in one batch.
+
+    Returns a dict mapping account pk to the plaintext password, or to None
+    when that row could not be decrypted. Rows are decrypted inline by
+    default: one AES-GCM decrypt takes a few microseconds, less than handing
+    it to a pool costs. When ACCOUNT_DECRYPT_EXECUTOR is "thread" or
+    "process", batches at or above ACCOUNT_DECRYPT_BATCH_THRESHOLD are
+    spread over that pool instead.
+    """
+    results = {}
+    by_author = {}
+    for account in accounts:
+        if not account.password:
+            results[account.pk] = ""
+            continue
+        by_author.setdefault(account.author_id, []).append(account)
+
+    pending = sum(len(author_accounts) for author_accounts in by_author.values())
+    threshold = getattr(settings, 'ACCOUNT_DECRYPT_BATCH_THRESHOLD', 200)
+    kind = getattr(settings, 'ACCOUNT_DECRYPT_EXECUTOR', None)
+
+    ciphers = {}
+    for author_id, author_accounts in list(by_author.items()):
+        try:
+            ciphers[author_id] = keyring.get_cipher(author_id)
+        except Exception:
+            # A key that cannot be loaded or unwrapped fails that author's rows,
+            # like a row that fails to decrypt, rather than the whole batch
+            results.update((a.pk, None) for a in by_author.pop(author_id))
+
+    if kind not in ('thread', 'process') or pending < threshold:
+        for author_id, author_accounts in by_author.items():
+            plaintexts = _decrypt_chunk(ciphers[author_id], [a.password for a in author_accounts])
+            results.update(zip((a.pk for a in author_accounts), plaintexts))
+        return results
+
+    # Split so every worker gets a share, but keep tasks small enough to balance
+    chunk_size = max(1, min(CHUNK_SIZE, -(-pending // _get_workers())))
+    executor = _get_executor(kind)
+    futures = []
+    for author_id, author_accounts in by_author.items():
+        # Keys were resolved above on the request thread: a keyring miss queries
+        # the database, which pool workers must not do on connections nobody closes
+        cipher_set = ciphers[author_id]
+        for start in range(0, len(author_accounts), chunk_size):
+            chunk = author_accounts[start:start + chunk_size]
+            tokens = [to_bytes(a.password) for a in chunk]
+            if kind == 'process':
+                # Worker processes have their own keyring; ship them the data key
+                future = executor.submit(_decrypt_chunk_with_key, cipher_set.key, tokens)
+            else:
+                future = executor.submit(_decrypt_chunk, cipher_set, tokens)
+            futures.append((chunk, future))
+
+    for chunk, future in futures:
+        try:
+            plaintexts = future.result()
+        except Exception:
+            plaintexts = [None] * len(chunk)
+        results.update(zip((a.pk for a in chunk), plaintexts))
+    return results
@@ -0,0 +1,176 @@
+import socket
+import sys
+import threading
+import time
+from functools import partial
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NameResolutionError, NewConnectionError
+from urllib3.util.connection import _set_socket_options, allowed_gai_family
+from urllib3.util.timeout import _DEFAULT_TIMEOUT
+from .favicon_metrics import metrics
+
+
+class DnsCache:
+    """
+    Thread-safe cache of getaddrinfo() results.
+
+    The system resolver does not expose record TTLs, so answers are kept for a
+    fixed `ttl`; lookups that fail are remembered for `negative_ttl` so a dead
+    domain is not resolved again on every probe.
+    """
+
+    def __init__(self, ttl=300, negative_ttl=30, max_entries=4096):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, host, port, family=socket.AF_UNSPEC):
+        """Return getaddrinfo() results for a TCP connection, from cache when fresh"""
+        key = (host, port, family)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            cached = entry is not None and entry[0] > now
+            if cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if cached:
+            metrics.record('dns', 0.0, 'cached', host=host)
+            if isinstance(entry[1], Exception):
+                raise entry[1]
+            return entry[1]
+
+        try:
+            with metrics.stage('dns', host):
+                result = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            self._store(key, e, now + self.negative_ttl)
+            raise
+        self._store(key, result, now + self.ttl)
+        return result
+
+    def _store(self, key, value, expires):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                now = time.monotonic()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[key] = (expires, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return cache counters and the hosts currently cached"""
+        now = time.monotonic()
+        with self._lock:
+            hosts = sorted({
+                key[0] for key, (expires, value) in self._entries.items()
+                if expires > now and not isinstance(value, Exception)
+            })
+            failed = sorted({
+                key[0] for key, (expires, value) in self._entries.items()
+                if expires > now and isinstance(value, Exception)
+            })
+            return {'hits': self.hits, 'misses': self.misses, 'hosts': hosts, 'failed': failed}
+
+
+def create_connection(dns_cache, address, timeout, source_address=None, socket_options=None):
+    """urllib3's create_connection, resolving the host through a DnsCache"""
+    host, port = address
+    if host.startswith('['):
+        host = host.strip('[]')
+
+    addresses = dns_cache.resolve(host, port, allowed_gai_family())
+    with metrics.stage('connect', host):
+        return _connect_first(addresses, timeout, source_address, socket_options)
+
+
+def _connect_first(addresses, timeout, source_address, socket_options):
+    """Connect to the first reachable address, like socket.create_connection"""
+    err = None
+    for af, socktype, proto, _, sa in addresses:
+        sock = None
+        try:
+            sock = socket.socket(af, socktype, proto)
+            _set_socket_options(sock, socket_options)
+            if timeout is not _DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sa)
+            return sock
+        except OSError as e:
+            err = e
+            if sock is not None:
+                sock.close()
+
+    if err is not None:
+        raise err
+    raise OSError('getaddrinfo returns an empty list')
+
+
+class CachedDnsConnectionMixin:
+    """Open sockets with addresses from a DnsCache instead of resolving every time"""
+
+    def __init__(self, *args, dns_cache=None, **kwargs):
+        self.dns_cache = dns_cache
+        super().__init__(*args, **kwargs)
+
+    def _new_conn(self):
+        if self.dns_cache is None:
+            return super()._new_conn()
+        try:
+            sock = create_connection(
+                self.dns_cache,
+                (self._dns_host, self.port),
+                self.timeout,
+                source_address=self.source_address,
+                socket_options=self.socket_options,
+            )
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        except socket.timeout as e:
+            raise ConnectTimeoutError(
+                self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})"
+            ) from e
+        except OSError as e:
+            raise NewConnectionError(self, f"Failed to establish a new connection: {e}") from e
+
+        sys.audit('http.client.connect', self, self.host, self.port)
+        return sock
+
+
+class CachedDnsHTTPConnection(CachedDnsConnectionMixin, HTTPConnection):
+    pass
+
+
+class CachedDnsHTTPSConnection(CachedDnsConnectionMixin, HTTPSConnection):
+    pass
+
+
+class CachedDnsHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CachedDnsHTTPConnection
+
+
+class CachedDnsHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CachedDnsHTTPSConnection
+
+
+def pool_classes(dns_cache):
+    """Return a PoolManager pool_classes_by_scheme mapping whose connections use `dns_cache`"""
+    return {
+        'http': partial(CachedDnsHTTPConnectionPool, dns_cache=dns_cache),
+        'https': partial(CachedDnsHTTPSConnectionPool, dns_cache=dns_cache),
+    }
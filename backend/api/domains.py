@@ -0,0 +1,15 @@
+from urllib.parse import urlparse
+
+
+def normalize_domain(url):
+    """Return the lowercased host of a URL without a leading www., or None if it has none"""
+    if not url:
+        return None
+    try:
+        parsed_url = urlparse(url if '://' in url else 'https://' + url)
+        domain = (parsed_url.hostname or '').lower().rstrip('.')
+    except ValueError:
+        return None
+    if domain.startswith('www.'):
+        domain = domain[4:]
+    return domain or None
@@ -0,0 +1,144 @@
+import codecs
+import json
+import re
+from collections import namedtuple
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+
+IconCandidate = namedtuple('IconCandidate', ['url', 'rel', 'sizes', 'type', 'source'])
+
+ICON_RELS = ('icon', 'shortcut icon', 'apple-touch-icon', 'apple-touch-icon-precomposed')
+
+# Lower rank wins when two candidates are otherwise equally good
+REL_RANK = {rel: rank for rank, rel in enumerate(ICON_RELS)}
+
+# Formats Pillow can decode; SVG and unknown types are only tried last
+DECODABLE_TYPES = ('image/png', 'image/x-icon', 'image/vnd.microsoft.icon', 'image/gif', 'image/jpeg', 'image/webp')
+
+
+class IconLinkParser(HTMLParser):
+    """Incremental parser that collects icon <link> tags and stops at the end of <head>"""
+
+    def __init__(self, page_url):
+        super().__init__(convert_charrefs=True)
+        self.page_url = page_url
+        self.base_url = page_url
+        self.links = []
+        self.manifest_url = None
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == 'body':
+            self.done = True
+            return
+
+        attrs = {name: (value or '') for name, value in attrs}
+        if tag == 'base' and attrs.get('href'):
+            self.base_url = urljoin(self.page_url, attrs['href'].strip())
+        elif tag == 'link' and attrs.get('href'):
+            rel = ' '.join(attrs.get('rel', '').lower().split())
+            href = attrs['href'].strip()
+            if rel == 'manifest':
+                self.manifest_url = urljoin(self.base_url, href)
+            elif rel in ICON_RELS:
+                self.links.append(IconCandidate(
+                    url=urljoin(self.base_url, href),
+                    rel=rel,
+                    sizes=attrs.get('sizes', '').lower(),
+                    type=attrs.get('type', '').lower(),
+                    source='link',
+                ))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            self.done = True
+
+
+def parse_icon_links(response, max_bytes, chunk_size=2048):
+    """
+    Stream an HTML response into IconLinkParser until </head>, <body> or max_bytes.
+
+    Returns (parser, bytes_read). Only the document head is downloaded; the
+    rest of the body is never read off the socket.
+    """
+    parser = IconLinkParser(response.url)
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    bytes_read = 0
+
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        bytes_read += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        if parser.done or bytes_read >= max_bytes:
+            break
+    return parser, bytes_read
+
+
+def parse_manifest_icons(manifest_text, manifest_url):
+    """Return icon candidates declared in a web app manifest"""
+    try:
+        icons = json.loads(manifest_text).get('icons') or []
+    except (ValueError, AttributeError):
+        return []
+
+    candidates = []
+    for icon in icons:
+        if not isinstance(icon, dict) or not icon.get('src'):
+            continue
+        candidates.append(IconCandidate(
+            url=urljoin(manifest_url, icon['src']),
+            rel='manifest',
+            sizes=str(icon.get('sizes', '')).lower(),
+            type=str(icon.get('type', '')).lower(),
+            source='manifest',
+        ))
+    return candidates
+
+
+def _largest_size(sizes):
+    """Return the largest edge declared in a sizes attribute, 0 if unknown"""
+    if sizes == 'any':
+        return 0
+    edges = [int(width) for width, _ in re.findall(r'(\d+)x(\d+)', sizes)]
+    return max(edges) if edges else 0
+
+
+def _is_decodable(candidate):
+    if candidate.type:
+        return candidate.type in DECODABLE_TYPES
+    return not candidate.url.split('?', 1)[0].lower().endswith('.svg')
+
+
+def rank_candidates(candidates, target_size):
+    """
+    Order icon candidates from best to worst for a target edge size.
+
+    Decodable formats come before SVG ones. Then come icons at least as big as
+    the target (smallest first), icons without declared sizes, and smaller
+    icons (biggest first). Ties go by rel type, with <link> tags ahead of
+    manifest icons.
+    """
+    def sort_key(indexed):
+        index, candidate = indexed
+        size = _largest_size(candidate.sizes)
+        if size >= target_size:
+            size_rank = (0, size)
+        elif not size:
+            size_rank = (1, 0)
+        else:
+            size_rank = (2, -size)
+        rel_rank = REL_RANK.get(candidate.rel, len(REL_RANK))
+        return (not _is_decodable(candidate), size_rank, rel_rank, index)
+
+    seen = set()
+    ranked = []
+    for _, candidate in sorted(enumerate(candidates), key=sort_key):
+        if candidate.url not in seen:
+            seen.add(candidate.url)
+            ranked.append(candidate)
+    return ranked
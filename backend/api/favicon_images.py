@@ -0,0 +1,80 @@
+from io import BytesIO
+from PIL import Image
+from .favicon_metrics import metrics
+
+
+# Edge sizes stored for every favicon: 32 px is the default, 64 px serves HiDPI screens
+VARIANT_SIZES = (32, 64)
+
+# Refuse images whose header declares more pixels than this (decompression bombs)
+MAX_IMAGE_PIXELS = 4096 * 4096
+
+
+def _pick_ico_frame(image, target):
+    """Select the smallest embedded ICO frame that still covers the target size"""
+    sizes = sorted(image.info.get('sizes') or [], key=lambda size: size[0] * size[1])
+    if not sizes:
+        return
+    covering = [size for size in sizes if min(size) >= target]
+    image.size = covering[0] if covering else sizes[-1]
+
+
+def decode_favicon(image_data, target):
+    """
+    Decode favicon bytes as cheaply as the format allows for a target edge size.
+
+    Only the header is parsed before the pixel-count guard runs. ICO files
+    decode just the best embedded frame, and JPEGs use draft mode to decode
+    at a reduced scale.
+    """
+    image = Image.open(BytesIO(image_data))
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ValueError(f"Image too large: {width}x{height} pixels")
+
+    if image.format == 'ICO':
+        _pick_ico_frame(image, target)
+    elif image.format == 'JPEG':
+        image.draft('RGB', (target, target))
+
+    image.load()
+
+    if image.mode in ('RGBA', 'LA'):
+        pass
+    elif image.mode == 'P':
+        image = image.convert('RGBA')
+    else:
+        image = image.convert('RGB')
+    return image
+
+
+def process_favicon_variants(image_data, sizes=VARIANT_SIZES):
+    """
+    Decode an image once at the cheapest scale and return {size: PNG bytes}.
+
+    Variants are resized largest first, each smaller one from the previous
+    result, and large sources are pre-shrunk with reducing_gap so LANCZOS
+    only runs on a small image.
+    """
+    sizes = sorted(set(sizes), reverse=True)
+    with metrics.stage('decode') as record:
+        record.bytes = len(image_data)
+        image = decode_favicon(image_data, sizes[0])
+
+    variants = {}
+    for size in sizes:
+        if image.size != (size, size):
+            with metrics.stage('resize'):
+                image = image.resize((size, size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        with metrics.stage('encode') as record:
+            output = BytesIO()
+            image.save(output, format='PNG')
+            record.bytes = output.tell()
+        variants[size] = output.getvalue()
+    return variants
+
+
+def process_favicon(image_data, size=32):
+    """Decode an image at the cheapest scale and return it as a size x size PNG"""
+    return process_favicon_variants(image_data, (size,))[size]
@@ -0,0 +1,136 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .favicon_service import FaviconService
+from .models import Account, FaviconJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_favicon_job(url, author, account=None):
+    """Queue a favicon fetch, reusing an identical job that is still pending or running"""
+    existing = FaviconJob.objects.filter(
+        url=url,
+        author=author,
+        account=account,
+        status__in=FaviconJob.ACTIVE_STATUSES,
+    ).first()
+    if existing:
+        return existing
+    return FaviconJob.objects.create(url=url, author=author, account=account)
+
+
+def claim_jobs(batch_size, lease_seconds=None):
+    """
+    Atomically claim up to `batch_size` runnable jobs for this worker.
+
+    Pending jobs whose run_after has passed are claimable, and so are running
+    jobs whose lease expired (their worker died). Postgres uses SKIP LOCKED so
+    workers never wait on each other; every backend then flips the status with
+    a conditional UPDATE, so two workers can never claim the same job.
+    """
+    if lease_seconds is None:
+        lease_seconds = getattr(settings, 'FAVICON_JOB_LEASE_SECONDS', 120)
+    now = timezone.now()
+    runnable = (
+        Q(status=FaviconJob.STATUS_PENDING, run_after__lte=now) |
+        Q(status=FaviconJob.STATUS_RUNNING, locked_until__lt=now)
+    )
+
+    with transaction.atomic():
+        candidates = FaviconJob.objects.filter(runnable).order_by('run_after', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        candidate_ids = list(candidates.values_list('id', flat=True)[:batch_size])
+
+        claimed_ids = []
+        for job_id in candidate_ids:
+            updated = FaviconJob.objects.filter(runnable, id=job_id).update(
+                status=FaviconJob.STATUS_RUNNING,
+                locked_until=now + timedelta(seconds=lease_seconds),
+                updated_at=now,
+            )
+            if updated:
+                claimed_ids.append(job_id)
+
+    # The worker only writes the account's favicon, so skip loading the old bytes
+    return list(FaviconJob.objects.filter(id__in=claimed_ids).select_related('account').defer('account__favicon'))
+
+
+def run_job(job):
+    """
+    Run one claimed job and record its outcome, scheduling a retry on failure.
+
+    Returns None when the job no longer exists: deleting an account while
+    its favicon is being fetched cascades to the job.
+    """
+    job.attempts += 1
+    try:
+        # Retries bypass the cache so a stale negative entry cannot fail them again
+        favicon_data, content_type = FaviconService.fetch_and_process_favicon(job.url, refresh=job.attempts > 1)
+        if not favicon_data:
+            raise ValueError('Could not fetch favicon for the given URL.')
+
+        if job.account_id:
+            job.account.set_favicon(favicon_data, content_type)
+            try:
+                # Savepoint, so a failed save leaves any outer transaction usable
+                with transaction.atomic():
+                    job.account.save(update_fields=job.account.FAVICON_FIELDS)
+            except DatabaseError:
+                if Account.objects.filter(pk=job.account_id).exists():
+                    raise
+                logger.info(f"Favicon job {job.pk} dropped: account {job.account_id} was deleted")
+                return None
+        else:
+            job.favicon = favicon_data
+            job.favicon_content_type = content_type
+
+        job.status = FaviconJob.STATUS_SUCCEEDED
+        job.last_error = ''
+    except Exception as e:
+        job.last_error = str(e)
+        max_attempts = getattr(settings, 'FAVICON_JOB_MAX_ATTEMPTS', 3)
+        if job.attempts >= max_attempts:
+            job.status = FaviconJob.STATUS_FAILED
+        else:
+            # Exponential backoff: base, 2 * base, 4 * base, ...
+            backoff = getattr(settings, 'FAVICON_JOB_RETRY_BACKOFF', 30) * 2 ** (job.attempts - 1)
+            job.status = FaviconJob.STATUS_PENDING
+            job.run_after = timezone.now() + timedelta(seconds=backoff)
+        logger.warning(f"Favicon job {job.pk} attempt {job.attempts} failed: {job.last_error}")
+
+    job.locked_until = None
+    try:
+        with transaction.atomic():
+            job.save(update_fields=[
+                'attempts', 'status', 'run_after', 'locked_until', 'last_error',
+                'favicon', 'favicon_content_type', 'updated_at',
+            ])
+    except DatabaseError:
+        if FaviconJob.objects.filter(pk=job.pk).exists():
+            raise
+        logger.info(f"Favicon job {job.pk} was deleted while running")
+        return None
+    return job
+
+
+def prune_jobs(retention=None, batch_size=1000):
+    """Delete succeeded and failed jobs last updated more than `retention` seconds ago"""
+    if retention is None:
+        retention = getattr(settings, 'FAVICON_JOB_RETENTION', 7 * 24 * 3600)
+    cutoff = timezone.now() - timedelta(seconds=retention)
+    finished = FaviconJob.objects.filter(
+        status__in=[FaviconJob.STATUS_SUCCEEDED, FaviconJob.STATUS_FAILED],
+        updated_at__lt=cutoff,
+    )
+    deleted = 0
+    # Small batches keep each delete short next to workers claiming jobs
+    while True:
+        ids = list(finished.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += FaviconJob.objects.filter(id__in=ids).delete()[0]
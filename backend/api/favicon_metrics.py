@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (milliseconds) of the histogram buckets; the last bucket is open-ended
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Hosts tracked per stage before the fastest ones are dropped from the report
+MAX_HOSTS = 200
+
+
+class Histogram:
+    """Fixed-bucket latency histogram with byte and outcome counters"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.bytes = 0
+        self.outcomes = {}
+
+    def add(self, duration_ms, outcome, size):
+        self.buckets[bisect_left(BUCKETS_MS, duration_ms)] += 1
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.bytes += size
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def percentile(self, fraction):
+        """Return the bucket bound below which `fraction` of samples fall"""
+        if not self.count:
+            return None
+        threshold = fraction * self.count
+        seen = 0
+        for index, hits in enumerate(self.buckets):
+            seen += hits
+            if seen >= threshold:
+                return BUCKETS_MS[index] if index < len(BUCKETS_MS) else round(self.max_ms, 1)
+        return round(self.max_ms, 1)
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 1) if self.count else None,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': round(self.max_ms, 1),
+            'bytes': self.bytes,
+            'outcomes': dict(self.outcomes),
+            'buckets': {
+                (f'<={bound}' if index < len(BUCKETS_MS) else f'>{BUCKETS_MS[-1]}'): hits
+                for index, (bound, hits) in enumerate(zip(BUCKETS_MS + (None,), self.buckets))
+                if hits
+            },
+        }
+
+
+class StageRecord:
+    """Mutable result of one timed stage; callers fill in bytes and outcome"""
+
+    __slots__ = ('bytes', 'outcome')
+
+    def __init__(self):
+        self.bytes = 0
+        self.outcome = 'ok'
+
+
+class StageMetrics:
+    """
+    In-process timing of favicon pipeline stages.
+
+    Every stage is emitted as a structured log record on this module's logger
+    and aggregated into a per-stage histogram and per-host totals.
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, host=None):
+        """Time the block as stage `name`; exceptions are recorded as outcome 'error' and re-raised"""
+        record = StageRecord()
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record.outcome = 'error'
+            raise
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000, record.outcome, record.bytes, host)
+
+    def record(self, name, duration_ms, outcome='ok', size=0, host=None):
+        with self._lock:
+            self._stages.setdefault(name, Histogram()).add(duration_ms, outcome, size)
+            if host:
+                hosts = self._hosts.setdefault(name, {})
+                totals = hosts.setdefault(host, [0, 0.0])
+                totals[0] += 1
+                totals[1] += duration_ms
+                if len(hosts) > MAX_HOSTS:
+                    del hosts[min(hosts, key=lambda h: hosts[h][1])]
+
+        logger.info('favicon stage', extra={
+            'stage': name,
+            'duration_ms': round(duration_ms, 2),
+            'outcome': outcome,
+            'bytes': size,
+            'host': host,
+        })
+
+    def snapshot(self, slowest=10):
+        """Return every stage's histogram and its slowest hosts by total time"""
+        with self._lock:
+            report = {}
+            for name, histogram in sorted(self._stages.items()):
+                entry = histogram.snapshot()
+                hosts = self._hosts.get(name, {})
+                entry['slowest_hosts'] = [
+                    {'host': host, 'count': count, 'total_ms': round(total, 1)}
+                    for host, (count, total) in sorted(hosts.items(), key=lambda item: -item[1][1])[:slowest]
+                ]
+                report[name] = entry
+            return report
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._hosts.clear()
+
+
+metrics = StageMetrics()
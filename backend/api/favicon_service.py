@@ -1,15 +1,30 @@
-import requests
 import hashlib
 import os
+import threading
+import time
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 from urllib.parse import urlparse, urljoin
-from PIL import Image
-from io import BytesIO
 from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.utils import timezone
 import logging
+from .domains import normalize_domain
+from .http_client import http_client
+from .favicon_html import parse_icon_links, parse_manifest_icons, rank_candidates
+from .favicon_images import process_favicon_variants
+from .favicon_metrics import metrics
+from .models import FaviconSource
+from .singleflight import SingleFlight, advisory_lock
 
 logger = logging.getLogger(__name__)
 
 
+class FaviconUnavailable(Exception):
+    """Discovery hit its deadline before every candidate was checked; the outcome is unknown, not negative"""
+
+
 class FaviconService:
     """Service for fetching, processing, and caching favicons from URLs"""
     
@@ -32,9 +47,59 @@ class FaviconService:
     # Favicon dimensions
     FAVICON_SIZE = (32, 32)
     
+    # Edge size of the variant served to HiDPI screens, see serve_favicon
+    HIDPI_SIZE = 64
+    
+    # Bytes of a homepage (or manifest) read while looking for icon links
+    HTML_MAX_BYTES = 64 * 1024
+    
+    # Overall deadline (seconds) for discovering one favicon
+    DISCOVERY_TIMEOUT = 10
+    
+    # Threads shared by all concurrent discovery probes (7 per domain being discovered)
+    PROBE_WORKERS = 64
+    
+    # Threads resolving whole domains for batch requests (kept apart from the probe pool)
+    BATCH_WORKERS = 8
+    
+    _executor = None
+    _batch_executor = None
+    _executor_lock = threading.Lock()
+    
+    # Coalesces concurrent fetches of the same domain within this process
+    _single_flight = SingleFlight()
+    
+    @classmethod
+    def _get_executor(cls):
+        """Return the shared probe thread pool, creating it lazily"""
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'FAVICON_PROBE_WORKERS', cls.PROBE_WORKERS),
+                    thread_name_prefix='favicon-probe',
+                )
+            return cls._executor
+    
+    @classmethod
+    def _get_batch_executor(cls):
+        """Return the shared batch thread pool, creating it lazily"""
+        with cls._executor_lock:
+            if cls._batch_executor is None:
+                cls._batch_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'FAVICON_BATCH_WORKERS', cls.BATCH_WORKERS),
+                    thread_name_prefix='favicon-batch',
+                )
+            return cls._batch_executor
+    
     @classmethod
     def get_favicon_url(cls, url):
-        """Get the most likely favicon URL for a given website URL"""
+        """
+        Get the most likely favicon URL for a given website URL.
+        
+        Returns None when every candidate was checked and none exists. Raises
+        FaviconUnavailable when the deadline passed while candidates were still
+        queued or running, e.g. because the shared probe pool was saturated.
+        """
         try:
             parsed_url = urlparse(url)
             if not parsed_url.scheme:
@@ -42,55 +107,68 @@ class FaviconService:
                 parsed_url = urlparse(url)
             
             base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
+            deadline = time.monotonic() + cls.DISCOVERY_TIMEOUT
             
-            favicon_url = cls._get_favicon_from_html(base_url)
-            if favicon_url:
-                return favicon_url
-            
+            # Run the HTML lookup and every well-known path probe at once;
+            # candidates are listed in priority order (HTML first)
+            executor = cls._get_executor()
+            futures = [executor.submit(cls._get_favicon_from_html, base_url)]
             for path in cls.FAVICON_PATHS:
-                favicon_url = urljoin(base_url, path)
-                if cls._check_favicon_exists(favicon_url):
-                    return favicon_url
+                futures.append(executor.submit(cls._probe_favicon_path, urljoin(base_url, path)))
             
-            return None
+            try:
+                for future in futures:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        favicon_url = future.result(timeout=remaining)
+                    except FutureTimeoutError:
+                        break
+                    if favicon_url:
+                        return favicon_url
+                
+                # Deadline hit: settle for the best candidate that already succeeded
+                for future in futures:
+                    if future.done() and not future.cancelled() and not future.exception():
+                        if future.result():
+                            return future.result()
+                if all(future.done() for future in futures):
+                    return None
+                raise FaviconUnavailable(f"Favicon discovery for {base_url} timed out")
+            finally:
+                # Drop probes that have not started yet; running ones end at their own timeout
+                for future in futures:
+                    future.cancel()
             
+        except FaviconUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error getting favicon URL for {url}: {str(e)}")
             return None
     
+    @classmethod
+    def _probe_favicon_path(cls, favicon_url):
+        """Return the URL if a favicon exists there, otherwise None"""
+        return favicon_url if cls._check_favicon_exists(favicon_url) else None
+    
     @classmethod
     def _get_favicon_from_html(cls, base_url):
-        """Try to extract favicon URL from HTML meta tags"""
+        """Try to extract favicon URL from the <link> tags in the page head"""
         try:
-            response = requests.get(base_url, timeout=10, headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            })
-            response.raise_for_status()
-            
-            content = response.text.lower()
+            with metrics.stage('html', urlparse(base_url).hostname) as record:
+                with http_client.get(base_url, timeout=10, stream=True) as response:
+                    response.raise_for_status()
+                    parser, record.bytes = parse_icon_links(response, cls.HTML_MAX_BYTES)
+                record.outcome = 'found' if parser.links or parser.manifest_url else 'none'
             
-            favicon_patterns = [
-                'rel="icon"',
-                'rel="shortcut icon"',
-                'rel="apple-touch-icon"',
-                'rel="apple-touch-icon-precomposed"'
-            ]
+            candidates = list(parser.links)
+            if parser.manifest_url:
+                candidates.extend(cls._get_manifest_icons(parser.manifest_url))
             
-            for pattern in favicon_patterns:
-                if pattern in content:
-                    import re
-                    match = re.search(rf'{pattern}[^>]*href=["\']([^"\']+)["\']', content)
-                    if match:
-                        favicon_url = match.group(1)
-                        if favicon_url.startswith('//'):
-                            favicon_url = 'https:' + favicon_url
-                        elif favicon_url.startswith('/'):
-                            favicon_url = urljoin(base_url, favicon_url)
-                        elif not favicon_url.startswith('http'):
-                            favicon_url = urljoin(base_url, favicon_url)
-                        
-                        if cls._check_favicon_exists(favicon_url):
-                            return favicon_url
+            for candidate in rank_candidates(candidates, cls.FAVICON_SIZE[0]):
+                if cls._check_favicon_exists(candidate.url):
+                    return candidate.url
             
             return None
             
@@ -98,73 +176,320 @@ class FaviconService:
             logger.error(f"Error parsing HTML for favicon: {str(e)}")
             return None
     
+    @classmethod
+    def _get_manifest_icons(cls, manifest_url):
+        """Return icon candidates from a web app manifest, read up to HTML_MAX_BYTES"""
+        try:
+            with metrics.stage('manifest', urlparse(manifest_url).hostname) as record, \
+                    http_client.get(manifest_url, timeout=5, stream=True) as response:
+                response.raise_for_status()
+                content = b''
+                for chunk in response.iter_content(chunk_size=2048):
+                    content += chunk
+                    record.bytes = len(content)
+                    if len(content) >= cls.HTML_MAX_BYTES:
+                        record.outcome = 'too_large'
+                        return []
+            return parse_manifest_icons(content.decode('utf-8', errors='replace'), response.url)
+        except Exception as e:
+            logger.error(f"Error reading manifest {manifest_url}: {str(e)}")
+            return []
+    
     @classmethod
     def _check_favicon_exists(cls, url):
         """Check if a favicon URL exists and is accessible"""
         try:
-            response = requests.head(url, timeout=5, headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            })
+            with metrics.stage('probe', urlparse(url).hostname) as record:
+                response = http_client.head(url, timeout=5)
+                record.outcome = 'found' if response.status_code == 200 else f'http_{response.status_code}'
             return response.status_code == 200
         except:
             return False
     
     @classmethod
-    def fetch_and_process_favicon(cls, url):
-        """Fetch favicon from URL and process it"""
+    def fetch_and_process_favicon(cls, url, refresh=False):
+        """
+        Fetch favicon from URL and process it, going through the shared domain cache.
+        
+        With refresh=True the cached entry is ignored and replaced by a fresh fetch.
+        Raises FaviconUnavailable, and caches nothing, when discovery ran out of time.
+        """
+        domain = cls.normalize_domain(url)
+        if not domain:
+            return None, None
+        
+        cache_key = cls._generate_cache_key(domain)
+        if not refresh:
+            entry = cls._get_cached_entry(domain, cache_key)
+            if entry is not None:
+                # A cached failure is stored as (None, None)
+                return entry
+        
+        # Concurrent callers for the same domain share a single outbound fetch
+        timeout = getattr(settings, 'FAVICON_COALESCE_TIMEOUT', 30)
         try:
-            favicon_url = cls.get_favicon_url(url)
-            if not favicon_url:
-                return None, None
-            
-            # Fetch the favicon
-            response = requests.get(favicon_url, timeout=10, headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            })
-            response.raise_for_status()
-            
-            # Check file size
-            if len(response.content) > cls.MAX_FILE_SIZE:
-                logger.warning(f"Favicon too large: {len(response.content)} bytes")
-                return None, None
+            return cls._single_flight.do(
+                domain, lambda: cls._fetch_and_cache(url, domain, cache_key), timeout=timeout
+            )
+        except TimeoutError:
+            logger.warning(f"Gave up waiting for the in-flight favicon fetch of {domain}")
+            return None, None
+    
+    @classmethod
+    def _fetch_and_cache(cls, url, domain, cache_key):
+        """Fetch a domain's favicon (once across processes when enabled) and cache the outcome"""
+        if getattr(settings, 'FAVICON_ADVISORY_LOCK', False):
+            waiting_since = timezone.now()
+            with advisory_lock(cache_key, getattr(settings, 'FAVICON_COALESCE_TIMEOUT', 30)):
+                # A process that held the lock while we waited has just fetched it for us
+                source = FaviconSource.objects.filter(domain=domain, checked_at__gte=waiting_since).first()
+                if source:
+                    entry = bytes(source.favicon), source.favicon_content_type
+                else:
+                    entry = cls._fetch_and_process_uncached(url)
+        else:
+            entry = cls._fetch_and_process_uncached(url)
+        
+        cache = cls._get_cache()
+        if entry[0]:
+            cache.set(cache_key, entry, getattr(settings, 'FAVICON_CACHE_TTL', 60 * 60 * 24))
+        else:
+            cache.set(cache_key, (None, None), getattr(settings, 'FAVICON_NEGATIVE_CACHE_TTL', 60 * 60))
+        return entry
+    
+    @classmethod
+    def fetch_many(cls, urls, timeout):
+        """
+        Resolve favicons for many URLs concurrently, fetching each domain once.
+        
+        Returns {domain: (data, content_type)} for every domain settled within
+        `timeout` seconds. Domains still running are left out; their fetches
+        keep going in the background and fill the cache for the next call.
+        """
+        deadline = time.monotonic() + timeout
+        results = {}
+        pending = {}
+        for url in urls:
+            domain = cls.normalize_domain(url)
+            if not domain or domain in results or domain in pending:
+                continue
+            cached = cls.get_cached_favicon(url)
+            if cached is not None:
+                results[domain] = cached
+            else:
+                pending[domain] = url
+        
+        executor = cls._get_batch_executor()
+        futures = {executor.submit(cls._fetch_in_pool, url): domain for domain, url in pending.items()}
+        try:
+            for future in as_completed(futures, timeout=max(deadline - time.monotonic(), 0)):
+                try:
+                    results[futures[future]] = future.result()
+                except FaviconUnavailable:
+                    # Reported like a domain still running at the deadline
+                    pass
+                except Exception as e:
+                    logger.error(f"Error fetching favicon for {futures[future]}: {str(e)}")
+                    results[futures[future]] = (None, None)
+        except FutureTimeoutError:
+            pass
+        return results
+    
+    @classmethod
+    def _fetch_in_pool(cls, url):
+        try:
+            return cls.fetch_and_process_favicon(url)
+        finally:
+            # Pool threads read FaviconSource with their own DB connection
+            close_old_connections()
+    
+    @classmethod
+    def get_cached_favicon(cls, url):
+        """Return the cached (data, content_type) for a URL's domain, or None if not cached"""
+        domain = cls.normalize_domain(url)
+        if not domain:
+            return None
+        return cls._get_cached_entry(domain, cls._generate_cache_key(domain))
+    
+    @classmethod
+    def _get_cached_entry(cls, domain, cache_key):
+        """
+        Read a domain's entry from the cache, falling back to its FaviconSource row.
+        
+        The favicon cache may be local to each process while fetches run in the
+        worker, so a source checked within FAVICON_CACHE_TTL counts as cached
+        and is copied into this process's cache.
+        """
+        cache = cls._get_cache()
+        entry = cache.get(cache_key)
+        if entry is not None:
+            return entry
+        
+        ttl = getattr(settings, 'FAVICON_CACHE_TTL', 60 * 60 * 24)
+        source = FaviconSource.objects.filter(
+            domain=domain, checked_at__gte=timezone.now() - timedelta(seconds=ttl)
+        ).values_list('favicon', 'favicon_content_type', 'checked_at').first()
+        if source is None:
+            return None
+        
+        favicon_data, content_type, checked_at = source
+        entry = bytes(favicon_data), content_type
+        remaining = ttl - (timezone.now() - checked_at).total_seconds()
+        cache.set(cache_key, entry, max(int(remaining), 1))
+        return entry
+    
+    @classmethod
+    def _fetch_and_process_uncached(cls, url):
+        """
+        Discover, download and process a favicon without consulting the cache.
+        
+        A domain fetched before is first revalidated against its stored
+        upstream icon; full discovery only runs when that icon is gone.
+        """
+        try:
+            domain = cls.normalize_domain(url)
+            source = FaviconSource.objects.filter(domain=domain).first() if domain else None
+            if source:
+                entry = cls._revalidate(source)
+                if entry:
+                    return entry
             
-            # Process the image
-            processed_image = cls._process_favicon(response.content)
-            if not processed_image:
+            favicon_url, response = cls._discover_and_download(url, domain)
+            if not favicon_url:
                 return None, None
+            return cls._store_response(domain, favicon_url, response, source)
             
-            return processed_image, 'image/png'
-            
+        except FaviconUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Error fetching favicon for {url}: {str(e)}")
             return None, None
     
     @classmethod
-    def _generate_cache_key(cls, url):
-        """Generate a unique cache key for a favicon URL"""
-        return hashlib.md5(url.encode()).hexdigest()
+    def _discover_and_download(cls, url, domain):
+        """Find a site's favicon and download it, returning (favicon_url, response) or (None, None)"""
+        with metrics.stage('discovery', domain) as record:
+            favicon_url = cls.get_favicon_url(url)
+            record.outcome = 'found' if favicon_url else 'none'
+        if not favicon_url:
+            return None, None
+        
+        with metrics.stage('download', urlparse(favicon_url).hostname) as record:
+            response = http_client.get(favicon_url, timeout=10)
+            response.raise_for_status()
+            record.bytes = len(response.content)
+        return favicon_url, response
+    
+    @classmethod
+    def profile_favicon(cls, url):
+        """
+        Run discovery, download and processing for a URL, recording stage metrics.
+        
+        Unlike fetch_and_process_favicon this neither reads nor writes the cache
+        or FaviconSource, so profiling never changes what is served. Returns
+        the processed PNG, or None when no usable favicon was found.
+        """
+        favicon_url, response = cls._discover_and_download(url, cls.normalize_domain(url))
+        if not favicon_url or len(response.content) > cls.MAX_FILE_SIZE:
+            return None
+        variants = cls._process_favicon(response.content)
+        return variants[cls.FAVICON_SIZE[0]] if variants else None
+    
+    @classmethod
+    def _revalidate(cls, source):
+        """
+        Conditionally re-request a stored upstream icon.
+        
+        Returns the stored favicon on 304 or identical content, the newly
+        processed one if the icon changed, and None if the icon is gone.
+        """
+        headers = {}
+        if source.etag:
+            headers['If-None-Match'] = source.etag
+        if source.last_modified:
+            headers['If-Modified-Since'] = source.last_modified
+        
+        try:
+            with metrics.stage('revalidate', urlparse(source.icon_url).hostname) as record:
+                response = http_client.get(source.icon_url, headers=headers, timeout=10)
+                record.bytes = len(response.content)
+                record.outcome = 'not_modified' if response.status_code == 304 else f'http_{response.status_code}'
+        except Exception as e:
+            logger.warning(f"Error revalidating favicon {source.icon_url}: {str(e)}")
+            return None
+        
+        if response.status_code == 304:
+            source.save(update_fields=['checked_at'])
+            return bytes(source.favicon), source.favicon_content_type
+        if response.status_code != 200:
+            return None
+        return cls._store_response(source.domain, source.icon_url, response, source)
+    
+    @classmethod
+    def _store_response(cls, domain, favicon_url, response, source=None):
+        """Process a downloaded icon unless its bytes are unchanged, and record it as the domain's source"""
+        # Check file size
+        if len(response.content) > cls.MAX_FILE_SIZE:
+            logger.warning(f"Favicon too large: {len(response.content)} bytes")
+            return None, None
+        
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        if source and source.content_hash == content_hash and source.favicon_hidpi:
+            processed_image, hidpi_image = bytes(source.favicon), bytes(source.favicon_hidpi)
+        else:
+            # Process the image
+            variants = cls._process_favicon(response.content)
+            if not variants:
+                return None, None
+            processed_image, hidpi_image = variants[cls.FAVICON_SIZE[0]], variants[cls.HIDPI_SIZE]
+        
+        if domain:
+            FaviconSource.objects.update_or_create(domain=domain, defaults={
+                'icon_url': favicon_url,
+                'etag': response.headers.get('ETag', ''),
+                'last_modified': response.headers.get('Last-Modified', ''),
+                'content_hash': content_hash,
+                'favicon': processed_image,
+                'favicon_hidpi': hidpi_image,
+                'favicon_content_type': 'image/png',
+            })
+        return processed_image, 'image/png'
+    
+    @classmethod
+    def normalize_domain(cls, url):
+        """Return the lowercased host of a URL without a leading www."""
+        return normalize_domain(url)
+    
+    @classmethod
+    def _get_cache(cls):
+        return caches[getattr(settings, 'FAVICON_CACHE_ALIAS', 'default')]
+    
+    @classmethod
+    def connection_stats(cls):
+        """Return connection-reuse statistics of the pooled HTTP client"""
+        return http_client.stats()
+    
+    @classmethod
+    def stage_stats(cls):
+        """Return per-stage timing histograms recorded in this process"""
+        return metrics.snapshot()
+    
+    @classmethod
+    def outbound_status(cls):
+        """Return connection reuse, DNS cache and per-host circuit breaker state"""
+        return http_client.status()
+    
+    @classmethod
+    def _generate_cache_key(cls, domain):
+        """Generate a unique cache key for a normalized favicon domain"""
+        return f"favicon:{hashlib.md5(domain.encode()).hexdigest()}"
     
     @classmethod
     def _process_favicon(cls, image_data):
-        """Process favicon image: resize, convert to PNG, optimize"""
+        """Process favicon image: decode once and return {size: PNG} for FAVICON_SIZE and HIDPI_SIZE"""
         try:
-            image = Image.open(BytesIO(image_data))
-            
-            if image.mode in ('RGBA', 'LA'):
-                pass
-            elif image.mode == 'P':
-                image = image.convert('RGBA')
-            else:
-                image = image.convert('RGB')
-            
-            image = image.resize(cls.FAVICON_SIZE, Image.Resampling.LANCZOS)
-            
-            output = BytesIO()
-            image.save(output, format='PNG', optimize=True)
-            
-            return output.getvalue()
+            return process_favicon_variants(image_data, (cls.FAVICON_SIZE[0], cls.HIDPI_SIZE))
             
         except Exception as e:
             logger.error(f"Error processing favicon: {str(e)}")
             return None
-    
@@ -1,6 +1,8 @@
 import django_filters
-from django.db.models import Q
+from rest_framework.filters import SearchFilter
+from .domains import normalize_domain
 from .models import Account
+from .search import search_accounts
 
 
 class AccountFilter(django_filters.FilterSet):
@@ -31,35 +33,30 @@ class AccountFilter(django_filters.FilterSet):
                  'username_contains', 'url_contains', 'notes_contains']
     
     def filter_search(self, queryset, name, value):
-        """Search across username, url, and notes fields"""
+        """Search across username, url, and notes fields; every whitespace-separated term must match"""
         if not value:
             return queryset
             
-        return queryset.filter(
-            Q(username__icontains=value) |
-            Q(url__icontains=value) |
-            Q(notes__icontains=value)
-        )
+        for term in value.split():
+            queryset = search_accounts(queryset, term)
+        return queryset
     
     def filter_domain(self, queryset, name, value):
-        """Filter by domain extracted from URL"""
+        """Filter by domain, matched exactly against the normalized domain column"""
         if not value:
             return queryset
-            
-        # Remove protocol if present
-        domain = value.lower()
-        if domain.startswith(('http://', 'https://')):
-            domain = domain.split('://', 1)[1]
-        
-        # Remove www. if present
-        if domain.startswith('www.'):
-            domain = domain[4:]
-            
-        # Remove trailing slash
-        domain = domain.rstrip('/')
         
-        return queryset.filter(
-            Q(url__icontains=f'://{domain}') |
-            Q(url__icontains=f'://www.{domain}') |
-            Q(url__icontains=f'{domain}/')
-        )
+        # Accepts bare domains as well as full URLs, with or without www.
+        domain = normalize_domain(value.strip())
+        if not domain:
+            return queryset.none()
+        return queryset.filter(domain=domain)
+
+
+class AccountSearchFilter(SearchFilter):
+    """DRF SearchFilter that matches every term through the indexed account search backend"""
+    
+    def filter_queryset(self, request, queryset, view):
+        for term in self.get_search_terms(request):
+            queryset = search_accounts(queryset, term)
+        return queryset
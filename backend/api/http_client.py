@@ -0,0 +1,152 @@
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from .circuit_breaker import CircuitBreaker
+from .dns_cache import DnsCache, pool_classes
+
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+
+class CachedDnsAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections resolve hosts through a shared DnsCache"""
+
+    def __init__(self, dns_cache, **kwargs):
+        self.dns_cache = dns_cache
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = pool_classes(self.dns_cache)
+
+
+class PooledHttpClient:
+    """
+    Thread-safe HTTP client with keep-alive connection pools.
+
+    All threads share one HTTPAdapter (and so one urllib3 PoolManager), which
+    keeps up to `pool_maxsize` open connections per host and blocks instead of
+    opening more. Each thread gets its own lightweight Session mounted on that
+    adapter, since Session objects themselves are not thread-safe.
+
+    Host lookups go through a TTL'd DnsCache, and every request passes a
+    per-host CircuitBreaker so hosts that keep failing are skipped outright.
+    """
+
+    def __init__(self, pool_connections=32, pool_maxsize=8, retries=2, backoff_factor=0.3,
+                 dns_cache=None, breaker=None):
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=0,
+            backoff_factor=backoff_factor,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False,
+        )
+        self.dns_cache = dns_cache or DnsCache()
+        self.breaker = breaker or CircuitBreaker()
+        self.adapter = CachedDnsAdapter(
+            self.dns_cache,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+            pool_block=True,
+        )
+        self._local = threading.local()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            pool_connections=getattr(settings, 'FAVICON_HTTP_POOL_CONNECTIONS', 32),
+            pool_maxsize=getattr(settings, 'FAVICON_HTTP_POOL_MAXSIZE', 8),
+            retries=getattr(settings, 'FAVICON_HTTP_RETRIES', 2),
+            backoff_factor=getattr(settings, 'FAVICON_HTTP_BACKOFF', 0.3),
+            dns_cache=DnsCache(
+                ttl=getattr(settings, 'FAVICON_DNS_CACHE_TTL', 300),
+                negative_ttl=getattr(settings, 'FAVICON_DNS_NEGATIVE_TTL', 30),
+            ),
+            breaker=CircuitBreaker(
+                failure_threshold=getattr(settings, 'FAVICON_BREAKER_THRESHOLD', 3),
+                reset_timeout=getattr(settings, 'FAVICON_BREAKER_RESET_TIMEOUT', 60),
+            ),
+        )
+
+    @property
+    def session(self):
+        """Return this thread's Session, bound to the shared connection pools"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers['User-Agent'] = USER_AGENT
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        """Send a request unless the host's circuit is open, recording the outcome"""
+        host = (urlparse(url).hostname or '').lower()
+        self.breaker.before_request(host)
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            self.breaker.record_failure(host)
+            raise
+        except Exception:
+            # Not a sign the host is down (bad URL, redirect loop, undecodable
+            # body), but a half-open trial must still be handed back
+            self.breaker.release(host)
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure(host)
+        else:
+            self.breaker.record_success(host)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def stats(self):
+        """Return per-host connection and request counts, and how many requests reused a connection"""
+        hosts = {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            entry = hosts.setdefault(host, {'connections': 0, 'requests': 0})
+            entry['connections'] += pool.num_connections
+            entry['requests'] += pool.num_requests
+
+        for entry in hosts.values():
+            entry['reused'] = max(entry['requests'] - entry['connections'], 0)
+
+        return {
+            'hosts': hosts,
+            'connections': sum(entry['connections'] for entry in hosts.values()),
+            'requests': sum(entry['requests'] for entry in hosts.values()),
+            'reused': sum(entry['reused'] for entry in hosts.values()),
+        }
+
+    def status(self):
+        """Return connection pool, DNS cache and circuit breaker state in one report"""
+        return {
+            'connections': self.stats(),
+            'dns': self.dns_cache.stats(),
+            'circuits': self.breaker.stats(),
+        }
+
+    def close(self):
+        """Close every pooled connection"""
+        self.adapter.close()
+
+
+http_client = PooledHttpClient.from_settings()
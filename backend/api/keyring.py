@@ -0,0 +1,123 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+from .ciphers import CipherSet, NONCE_SIZE
+
+
+DEFAULT_ENCRYPTION_SECRET = 'default-secret-key-change-this'
+
+DATA_KEY_SIZE = 32
+
+
+def get_encryption_secret():
+    """Return the configured master encryption secret"""
+    return getattr(settings, 'ENCRYPTION_SECRET', DEFAULT_ENCRYPTION_SECRET)
+
+
+def derive_user_key(author_id, secret):
+    """Derive the legacy 32-byte encryption key for a user from the master secret"""
+    user_key = f"{author_id}_{secret}".encode()
+    # Hash to get consistent 32-byte key
+    return hashlib.sha256(user_key).digest()
+
+
+def derive_master_key(secret):
+    """Derive the 32-byte key-encryption key from the master secret"""
+    return hashlib.sha256(f"master_{secret}".encode()).digest()
+
+
+def master_key_id(secret):
+    """Return a short, non-secret fingerprint identifying a master secret"""
+    return hashlib.sha256(b"fingerprint_" + derive_master_key(secret)).hexdigest()[:16]
+
+
+def generate_data_key():
+    """Return a fresh random data-encryption key"""
+    return os.urandom(DATA_KEY_SIZE)
+
+
+def wrap_data_key(data_key, user_id, secret):
+    """Encrypt a user's data key under the master secret"""
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + AESGCM(derive_master_key(secret)).encrypt(nonce, data_key, str(user_id).encode())
+
+
+def unwrap_data_key(wrapped_key, user_id, secret):
+    """Decrypt a user's wrapped data key with the master secret"""
+    wrapped_key = bytes(wrapped_key)
+    nonce = wrapped_key[:NONCE_SIZE]
+    return AESGCM(derive_master_key(secret)).decrypt(nonce, wrapped_key[NONCE_SIZE:], str(user_id).encode())
+
+
+def load_data_key(author_id):
+    """Return the unwrapped data key for an author, creating it on first use"""
+    from .models import DataKey
+    return DataKey.objects.get_data_key(author_id)
+
+
+class Keyring:
+    """Process-local LRU cache of unwrapped data keys and cipher objects per author"""
+
+    def __init__(self, max_size=1024, load_key=load_data_key):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._load_key = load_key
+        self._entries = OrderedDict()
+        self._secret = None
+        self._lock = threading.Lock()
+
+    def get_key(self, author_id):
+        """Return the data-encryption key for an author"""
+        return self._get_entry(author_id).key
+
+    def get_cipher(self, author_id):
+        """Return the ready-to-use CipherSet for an author"""
+        return self._get_entry(author_id)
+
+    def clear(self):
+        """Drop every cached key, e.g. after the secret has changed"""
+        with self._lock:
+            self._entries.clear()
+            self._secret = None
+
+    def stats(self):
+        """Return hit/miss counters and the current cache size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+            }
+
+    def _get_entry(self, author_id):
+        secret = get_encryption_secret()
+        with self._lock:
+            if secret != self._secret:
+                # The secret changed under us: re-unwrap keys with the new one
+                self._entries.clear()
+                self._secret = secret
+
+            entry = self._entries.get(author_id)
+            if entry is not None:
+                self._entries.move_to_end(author_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = CipherSet(self._load_key(author_id))
+
+        with self._lock:
+            if secret == self._secret:
+                self._entries[author_id] = entry
+                self._entries.move_to_end(author_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return entry
+
+
+keyring = Keyring(max_size=getattr(settings, 'ENCRYPTION_KEYRING_SIZE', 1024))
@@ -0,0 +1,48 @@
+import base64
+import os
+import time
+from django.core.management.base import BaseCommand
+from api.ciphers import CipherSet, ENGINES
+
+
+class Command(BaseCommand):
+    help = "Compare ciphertext size and encrypt/decrypt throughput of the password engines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help='Passwords to encrypt per engine')
+        parser.add_argument('--length', type=int, default=16, help='Length of each plaintext password')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        passwords = [base64.b64encode(os.urandom(options['length']))[:options['length']].decode() for _ in range(rows)]
+        cipher_set = CipherSet(os.urandom(32))
+
+        self.stdout.write(f"{'engine':<16}{'bytes/row':>12}{'encrypt/s':>14}{'decrypt/s':>14}")
+
+        # Legacy layout: base64 text around a Fernet token
+        fernet = cipher_set.get(ENGINES['fernet'])
+        start = time.perf_counter()
+        legacy = [base64.b64encode(fernet.encrypt(p.encode())) for p in passwords]
+        encrypt_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for stored in legacy:
+            cipher_set.decrypt(stored)
+        decrypt_time = time.perf_counter() - start
+        self._report('legacy-base64', legacy, encrypt_time, decrypt_time)
+
+        for engine in ENGINES:
+            start = time.perf_counter()
+            ciphertexts = [cipher_set.encrypt(p, engine) for p in passwords]
+            encrypt_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for stored in ciphertexts:
+                cipher_set.decrypt(stored)
+            decrypt_time = time.perf_counter() - start
+            self._report(engine, ciphertexts, encrypt_time, decrypt_time)
+
+    def _report(self, name, ciphertexts, encrypt_time, decrypt_time):
+        rows = len(ciphertexts)
+        size = sum(len(c) for c in ciphertexts) / rows
+        self.stdout.write(
+            f"{name:<16}{size:>12.1f}{rows / encrypt_time:>14.0f}{rows / decrypt_time:>14.0f}"
+        )
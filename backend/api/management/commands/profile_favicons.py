@@ -0,0 +1,45 @@
+import json
+import requests
+from django.core.management.base import BaseCommand
+from api.favicon_service import FaviconService, FaviconUnavailable
+
+
+class Command(BaseCommand):
+    help = (
+        "Probe the favicon pipeline live for the given URLs and print where the "
+        "time went per stage and per host. Nothing is cached or stored; for the "
+        "server's own histograms use GET /api/favicon-stats/"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='Site URLs to fetch favicons for')
+        parser.add_argument('--json', action='store_true', help='Print the raw stage report as JSON')
+
+    def handle(self, *args, **options):
+        for url in options['urls']:
+            try:
+                favicon_data = FaviconService.profile_favicon(url)
+                outcome = f"{len(favicon_data)} bytes" if favicon_data else 'no favicon'
+            except FaviconUnavailable:
+                outcome = 'discovery timed out'
+            except requests.RequestException as e:
+                outcome = f"download failed: {e}"
+            self.stdout.write(f"{url}: {outcome}")
+
+        report = FaviconService.stage_stats()
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"\n{'stage':<12}{'count':>7}{'mean ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'bytes':>10}  outcomes")
+        for stage, entry in report.items():
+            outcomes = ', '.join(f"{name}={count}" for name, count in sorted(entry['outcomes'].items()))
+            self.stdout.write(
+                f"{stage:<12}{entry['count']:>7}{entry['mean_ms']:>10}{entry['p50_ms']:>9}"
+                f"{entry['p95_ms']:>9}{entry['max_ms']:>9}{entry['bytes']:>10}  {outcomes}"
+            )
+
+        self.stdout.write('\nSlowest hosts')
+        for stage, entry in report.items():
+            for host in entry['slowest_hosts'][:3]:
+                self.stdout.write(f"  {stage:<12}{host['host']:<40}{host['count']:>5}{host['total_ms']:>12} ms")
@@ -0,0 +1,174 @@
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from api.favicon_service import FaviconService, FaviconUnavailable
+from api.http_client import http_client
+from api.models import Account, VaultVersion
+
+
+def host_address(domain):
+    """Return the address fetches for a domain connect to, or the domain if it does not resolve"""
+    try:
+        return http_client.dns_cache.resolve(domain, 443)[0][4][0]
+    except (OSError, IndexError):
+        return domain
+
+
+class HostLimiter:
+    """
+    Per-host semaphores so no server sees more than `limit` fetches at once.
+
+    Each domain is fetched once per run, so domains are keyed by the address
+    they resolve to: sites on the same shared host or CDN edge share a limit.
+    The lookup goes through the HTTP client's DNS cache, which the fetch reuses.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, domain):
+        key = host_address(domain)
+        with self._lock:
+            semaphore = self._semaphores.get(key)
+            if semaphore is None:
+                semaphore = self._semaphores[key] = threading.BoundedSemaphore(self.limit)
+        return semaphore
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch favicons for accounts whose favicon is missing or older than the "
+        "refresh window, fetching each distinct domain only once"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, help='Seconds before a favicon is stale (defaults to FAVICON_REFRESH_MAX_AGE)')
+        parser.add_argument('--limit', type=int, help='Refresh at most this many domains per run')
+        parser.add_argument('--concurrency', type=int, default=8, help='Domains fetched at the same time')
+        parser.add_argument('--per-host', type=int, default=1, help='Concurrent fetches allowed per server address')
+        parser.add_argument('--jitter', type=float, default=0.5, help='Maximum random delay in seconds before each fetch')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per bulk_update')
+        parser.add_argument('--every', type=float, help='Keep running and start a new pass every N seconds')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['per_host'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--concurrency, --per-host and --batch-size must be at least 1')
+
+        while True:
+            self._refresh(options)
+            if not options['every']:
+                break
+            time.sleep(options['every'])
+
+    def _select_stale(self, max_age):
+        """Return {domain: (url, [account ids])} for accounts needing a favicon fetch"""
+        cutoff = timezone.now() - timedelta(seconds=max_age)
+        queryset = (
+            Account.objects
+            .filter(Q(icon__isnull=True) | Q(icon=''))
+            .filter(Q(favicon_fetched_at__isnull=True) | Q(favicon_fetched_at__lt=cutoff))
+            .exclude(domain='')
+            .order_by('id')
+            .values_list('id', 'url', 'domain')
+        )
+
+        domains = {}
+        for account_id, url, domain in queryset.iterator(chunk_size=2000):
+            domains.setdefault(domain, (url, []))[1].append(account_id)
+        return domains
+
+    def _fetch(self, domain, url, limiter, jitter):
+        # Jitter spreads the start of each fetch so a run never bursts outbound traffic
+        if jitter:
+            time.sleep(random.uniform(0, jitter))
+        try:
+            with limiter(domain):
+                return FaviconService.fetch_and_process_favicon(url, refresh=True)
+        finally:
+            # Revalidation reads stored sources, so each pool thread holds a DB connection
+            close_old_connections()
+
+    def _refresh(self, options):
+        started = time.monotonic()
+        max_age = options['max_age']
+        if max_age is None:
+            max_age = getattr(settings, 'FAVICON_REFRESH_MAX_AGE', 60 * 60 * 24 * 7)
+
+        domains = self._select_stale(max_age)
+        if options['limit']:
+            domains = dict(list(domains.items())[:options['limit']])
+        total_accounts = sum(len(ids) for _, ids in domains.values())
+        self.stdout.write(f"Refreshing {len(domains)} domains for {total_accounts} accounts")
+        if not domains:
+            return
+
+        limiter = HostLimiter(options['per_host'])
+        pending = defaultdict(list)
+        counts = {'domains': 0, 'succeeded': 0, 'failed': 0, 'deferred': 0, 'accounts': 0}
+
+        with ThreadPoolExecutor(max_workers=options['concurrency'], thread_name_prefix='favicon-refresh') as executor:
+            futures = {
+                executor.submit(self._fetch, domain, url, limiter, options['jitter']): domain
+                for domain, (url, _) in domains.items()
+            }
+            for future in as_completed(futures):
+                domain = futures[future]
+                try:
+                    favicon_data, content_type = future.result()
+                except FaviconUnavailable:
+                    # Unknown outcome: leave the accounts unstamped so the next run retries them
+                    counts['domains'] += 1
+                    counts['deferred'] += 1
+                    continue
+                except Exception:
+                    favicon_data, content_type = None, None
+
+                counts['domains'] += 1
+                counts['succeeded' if favicon_data else 'failed'] += 1
+                fetched_at = timezone.now()
+                for account_id in domains[domain][1]:
+                    account = Account(pk=account_id)
+                    if favicon_data:
+                        account.set_favicon(favicon_data, content_type)
+                        pending['found'].append(account)
+                    else:
+                        # Keep whatever favicon the account had, but do not retry until it is stale again
+                        account.favicon_fetched_at = fetched_at
+                        pending['missing'].append(account)
+
+                if sum(len(batch) for batch in pending.values()) >= options['batch_size']:
+                    counts['accounts'] += self._flush(pending)
+                    self._report(counts, len(domains), started)
+
+        counts['accounts'] += self._flush(pending)
+        self._report(counts, len(domains), started)
+        self.stdout.write(self.style.SUCCESS(
+            f"Refreshed {counts['succeeded']} domains ({counts['failed']} without a favicon, "
+            f"{counts['deferred']} timed out), {counts['accounts']} accounts updated"
+        ))
+
+    def _flush(self, pending):
+        written = 0
+        if pending['found']:
+            written += Account.objects.bulk_update(pending['found'], Account.FAVICON_FIELDS)
+            # bulk_update sends no signals, so invalidate the owners' cached lists here
+            VaultVersion.objects.bump_for_accounts([account.pk for account in pending['found']])
+        if pending['missing']:
+            written += Account.objects.bulk_update(pending['missing'], ['favicon_fetched_at'])
+        pending.clear()
+        return written
+
+    def _report(self, counts, total, started):
+        elapsed = time.monotonic() - started
+        rate = counts['domains'] / elapsed if elapsed else 0
+        self.stdout.write(f"  {counts['domains']}/{total} domains, {counts['accounts']} accounts written ({rate:.1f} domains/s)")
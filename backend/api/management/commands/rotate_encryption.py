@@ -0,0 +1,260 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from api.ciphers import CipherSet, ENGINES, get_version, to_bytes
+from api.keyring import (
+    derive_user_key, generate_data_key, get_encryption_secret, keyring, master_key_id,
+    unwrap_data_key, wrap_data_key,
+)
+from api.models import Account, DataKey
+
+
+def reencrypt_chunk(groups, engine):
+    """
+    Re-encrypt one chunk of rows; runs inside pool workers.
+
+    `groups` is a list of (old_key, new_key, [(id, ciphertext), ...]) tuples,
+    one per author in the chunk. Returns (updated, failed_ids) where updated
+    is a list of (id, new_ciphertext).
+    """
+    updated = []
+    failed = []
+    for old_key, new_key, rows in groups:
+        old_ciphers = CipherSet(old_key)
+        new_ciphers = CipherSet(new_key)
+        for account_id, stored in rows:
+            try:
+                plaintext = old_ciphers.decrypt(stored)
+            except Exception:
+                failed.append(account_id)
+                continue
+            updated.append((account_id, new_ciphers.encrypt(plaintext, engine)))
+    return updated, failed
+
+
+class Command(BaseCommand):
+    help = (
+        "Rotate ENCRYPTION_SECRET by rewrapping every user's data key, and/or "
+        "re-encrypt every stored password to change ENCRYPTION_ENGINE. Legacy "
+        "data keys derived from the secret are always replaced with random ones; "
+        "stop the web and worker processes first, as their cached keys go stale"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--old-secret', help='Secret the data keys are currently wrapped with (defaults to ENCRYPTION_SECRET)')
+        parser.add_argument('--reencrypt', action='store_true', help='Also rewrite every password with the target engine')
+        parser.add_argument('--engine', choices=sorted(ENGINES), help='Engine for the new ciphertexts (defaults to ENCRYPTION_ENGINE)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows per worker task and per bulk_update')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes, 0 to run inline')
+        parser.add_argument('--checkpoint', default='rotate_encryption.checkpoint.json', help='Progress file used to resume')
+        parser.add_argument('--resume', action='store_true', help='Continue from the checkpoint file if it exists')
+
+    def handle(self, *args, **options):
+        new_secret = get_encryption_secret()
+        old_secret = options['old_secret'] or new_secret
+
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        rotating = old_secret != new_secret
+        if not rotating and not options['reencrypt'] and not DataKey.objects.filter(legacy=True).exists():
+            raise CommandError('Nothing to do: pass --old-secret to rotate the master secret or --reencrypt to rewrite rows')
+
+        engine = options['engine'] or getattr(settings, 'ENCRYPTION_ENGINE', 'aesgcm')
+        if rotating:
+            self._rewrap_data_keys(old_secret, new_secret, options['chunk_size'])
+        self._replace_legacy_keys(new_secret, engine)
+        if options['reencrypt']:
+            self._reencrypt_accounts(engine, options)
+
+    def _rewrap_data_keys(self, old_secret, new_secret, chunk_size):
+        """Re-wrap data keys under the new secret: one small write per user, no account rows touched"""
+        started = time.monotonic()
+        new_key_id = master_key_id(new_secret)
+        # Keys already carrying the new fingerprint were done by an earlier run
+        queryset = DataKey.objects.filter(master_key_id=master_key_id(old_secret)).order_by('id')
+        rewrapped = 0
+        batch = []
+
+        for record in queryset.iterator(chunk_size=chunk_size):
+            try:
+                data_key = unwrap_data_key(record.wrapped_key, record.user_id, old_secret)
+            except Exception:
+                self.stderr.write(f"Could not unwrap the data key of user {record.user_id}, left unchanged")
+                continue
+            record.wrapped_key = wrap_data_key(data_key, record.user_id, new_secret)
+            record.master_key_id = new_key_id
+            # Legacy keys derived from the old secret must not outlive it
+            record.legacy = record.legacy or data_key == derive_user_key(record.user_id, old_secret)
+            record.rotated_at = timezone.now()
+            batch.append(record)
+            if len(batch) >= chunk_size:
+                rewrapped += self._save_data_keys(batch)
+                batch = []
+        if batch:
+            rewrapped += self._save_data_keys(batch)
+
+        keyring.clear()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Rewrapped {rewrapped} data keys in {elapsed:.1f}s"))
+
+    def _save_data_keys(self, batch):
+        with transaction.atomic():
+            DataKey.objects.bulk_update(batch, fields=['wrapped_key', 'master_key_id', 'legacy', 'rotated_at'])
+        return len(batch)
+
+    def _replace_legacy_keys(self, secret, engine):
+        """
+        Give every user still on a secret-derived key a fresh random one.
+
+        Each user's rows are re-encrypted and their key replaced in a single
+        transaction, and the legacy flag is cleared with it, so an interrupted
+        run simply resumes with the users that are left.
+        """
+        started = time.monotonic()
+        queryset = DataKey.objects.filter(legacy=True, master_key_id=master_key_id(secret)).order_by('id')
+        replaced = 0
+        rows = 0
+
+        for record in queryset.iterator():
+            old_key = unwrap_data_key(record.wrapped_key, record.user_id, secret)
+            new_key = generate_data_key()
+            accounts = Account.objects.filter(author_id=record.user_id).exclude(password=b'').only('id', 'password')
+            stored = [(account.id, to_bytes(account.password)) for account in accounts]
+            updated, failed = reencrypt_chunk([(old_key, new_key, stored)], engine)
+            if failed:
+                # Rows the old key cannot read would be lost for good under a new key
+                self.stderr.write(
+                    f"Could not decrypt {len(failed)} accounts of user {record.user_id}, data key left unchanged"
+                )
+                continue
+
+            record.wrapped_key = wrap_data_key(new_key, record.user_id, secret)
+            record.legacy = False
+            record.rotated_at = timezone.now()
+            with transaction.atomic():
+                Account.objects.bulk_update(
+                    [Account(id=account_id, password=ciphertext) for account_id, ciphertext in updated],
+                    fields=['password'], batch_size=1000,
+                )
+                record.save(update_fields=['wrapped_key', 'legacy', 'rotated_at'])
+            replaced += 1
+            rows += len(updated)
+
+        keyring.clear()
+        if replaced:
+            elapsed = time.monotonic() - started
+            self.stdout.write(self.style.SUCCESS(
+                f"Replaced {replaced} legacy data keys and re-encrypted {rows} rows in {elapsed:.1f}s"
+            ))
+
+    def _reencrypt_accounts(self, engine, options):
+        """Stream every account through the worker pool and rewrite its ciphertext"""
+        chunk_size = options['chunk_size']
+        checkpoint_path = options['checkpoint']
+
+        queryset = Account.objects.only('id', 'author_id', 'password').order_by('author_id', 'id')
+        position = self._load_checkpoint(checkpoint_path) if options['resume'] else None
+        if position:
+            author_id, account_id = position
+            queryset = queryset.filter(Q(author_id__gt=author_id) | Q(author_id=author_id, id__gt=account_id))
+            self.stdout.write(f"Resuming after account {account_id} (author {author_id})")
+
+        self.stats = {'rows': 0, 'failed': 0, 'started': time.monotonic()}
+        executor = ProcessPoolExecutor(max_workers=options['workers']) if options['workers'] > 0 else None
+        max_in_flight = max(1, options['workers']) * 2
+        in_flight = []
+
+        try:
+            for chunk in self._iter_chunks(queryset, chunk_size):
+                groups = self._build_groups(chunk, ENGINES[engine])
+                last = (chunk[-1].author_id, chunk[-1].id)
+                if executor is None:
+                    self._write_chunk(reencrypt_chunk(groups, engine), last, checkpoint_path)
+                    continue
+
+                in_flight.append((executor.submit(reencrypt_chunk, groups, engine), last))
+                # Bound memory: never hold more than a few chunks in flight
+                if len(in_flight) >= max_in_flight:
+                    future, last = in_flight.pop(0)
+                    self._write_chunk(future.result(), last, checkpoint_path)
+
+            for future, last in in_flight:
+                self._write_chunk(future.result(), last, checkpoint_path)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        elapsed = time.monotonic() - self.stats['started']
+        rate = self.stats['rows'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-encrypted {self.stats['rows']} rows in {elapsed:.1f}s ({rate:.0f} rows/sec), "
+            f"{self.stats['failed']} failed"
+        ))
+
+    def _iter_chunks(self, queryset, chunk_size):
+        """Stream accounts from the database in fixed-size chunks"""
+        chunk = []
+        for account in queryset.iterator(chunk_size=chunk_size):
+            chunk.append(account)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _build_groups(self, chunk, target_version):
+        """Group a chunk by author and attach each author's data key"""
+        groups = []
+        for account in chunk:
+            if not groups or groups[-1][0] != account.author_id:
+                groups.append((account.author_id, []))
+            stored = to_bytes(account.password)
+            # Skip empty rows and rows already in the target format
+            if stored and get_version(stored) != target_version:
+                groups[-1][1].append((account.id, stored))
+
+        result = []
+        for author_id, rows in groups:
+            if rows:
+                key = keyring.get_key(author_id)
+                result.append((key, key, rows))
+        return result
+
+    def _write_chunk(self, result, last, checkpoint_path):
+        """Persist one re-encrypted chunk, then advance the checkpoint"""
+        updated, failed = result
+        accounts = [Account(id=account_id, password=ciphertext) for account_id, ciphertext in updated]
+        with transaction.atomic():
+            Account.objects.bulk_update(accounts, fields=['password'])
+        self._save_checkpoint(checkpoint_path, last)
+
+        for account_id in failed:
+            self.stderr.write(f"Could not decrypt account {account_id}, left unchanged")
+        self.stats['rows'] += len(updated)
+        self.stats['failed'] += len(failed)
+
+        elapsed = time.monotonic() - self.stats['started']
+        rate = self.stats['rows'] / elapsed if elapsed else 0
+        self.stdout.write(f"{self.stats['rows']} rows re-encrypted ({rate:.0f} rows/sec)")
+
+    def _load_checkpoint(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        return data['author_id'], data['account_id']
+
+    def _save_checkpoint(self, path, last):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'author_id': last[0], 'account_id': last[1]}, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,69 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+from api.favicon_jobs import claim_jobs, prune_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Claim queued favicon jobs in batches and run them concurrently"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10, help='Jobs claimed per poll')
+        parser.add_argument('--concurrency', type=int, default=4, help='Jobs run at the same time')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once no runnable job is left')
+        parser.add_argument('--prune-interval', type=float, default=3600,
+                            help='Seconds between deletions of finished jobs older than FAVICON_JOB_RETENTION')
+
+    # Longest pause, in seconds, between retries while the database is unavailable
+    MAX_BACKOFF = 60
+
+    def handle(self, *args, **options):
+        processed = 0
+        failures = 0
+        next_prune = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency'], thread_name_prefix='favicon-job') as executor:
+            while True:
+                # Drop a connection a database restart left dead before using it again
+                close_old_connections()
+                try:
+                    if time.monotonic() >= next_prune:
+                        pruned = prune_jobs()
+                        if pruned:
+                            self.stdout.write(f"Pruned {pruned} finished favicon jobs")
+                        next_prune = time.monotonic() + options['prune_interval']
+
+                    jobs = claim_jobs(options['batch_size'])
+                except DatabaseError as e:
+                    failures += 1
+                    delay = min(options['poll_interval'] * 2 ** failures, self.MAX_BACKOFF)
+                    self.stderr.write(f"Database error, retrying in {delay:.0f}s: {e}")
+                    time.sleep(delay)
+                    continue
+                failures = 0
+
+                if not jobs:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                for job, outcome in zip(jobs, executor.map(self._run, jobs)):
+                    processed += 1
+                    self.stdout.write(f"Job {job.pk} {outcome} ({job.url})")
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} favicon jobs"))
+
+    def _run(self, job):
+        """Run one job and return its outcome; a crashing job must not stop the worker"""
+        try:
+            finished = run_job(job)
+            return finished.status if finished else 'deleted'
+        except Exception as e:
+            # Its lease expires and another claim retries it
+            self.stderr.write(f"Job {job.pk} crashed: {e}")
+            return 'crashed'
+        finally:
+            # Each pool thread holds its own DB connection
+            close_old_connections()
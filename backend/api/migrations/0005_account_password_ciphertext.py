@@ -0,0 +1,41 @@
+# Generated by Django 4.2.24 on 2026-10-18 05:58
+
+import base64
+import api.models
+from django.db import migrations
+
+VERSION_FERNET = 0x01
+BATCH_SIZE = 1000
+
+
+def add_version_headers(apps, schema_editor):
+    """Unwrap legacy base64 text into a versioned Fernet ciphertext, no decryption needed"""
+    Account = apps.get_model('api', 'Account')
+    batch = []
+    for account in Account.objects.only('id', 'password').iterator(chunk_size=BATCH_SIZE):
+        stored = bytes(account.password or b'')
+        if not stored or stored[0] < 0x20:
+            continue
+        account.password = bytes([VERSION_FERNET]) + base64.b64decode(stored)
+        batch.append(account)
+        if len(batch) >= BATCH_SIZE:
+            Account.objects.bulk_update(batch, ['password'])
+            batch = []
+    if batch:
+        Account.objects.bulk_update(batch, ['password'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_account_favicon_content_type_alter_account_favicon'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='account',
+            name='password',
+            field=api.models.CiphertextField(),
+        ),
+        migrations.RunPython(add_version_headers),
+    ]
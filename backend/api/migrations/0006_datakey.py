@@ -0,0 +1,47 @@
+# Generated by Django 4.2.24 on 2026-10-18 06:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from api.keyring import derive_user_key, get_encryption_secret, master_key_id, wrap_data_key
+
+
+def create_legacy_data_keys(apps, schema_editor):
+    """Adopt each existing user's derived key as their data key, so no row is rewritten"""
+    Account = apps.get_model('api', 'Account')
+    DataKey = apps.get_model('api', 'DataKey')
+    secret = get_encryption_secret()
+    key_id = master_key_id(secret)
+
+    author_ids = Account.objects.exclude(password=b'').values_list('author_id', flat=True).distinct()
+    DataKey.objects.bulk_create([
+        DataKey(
+            user_id=author_id,
+            wrapped_key=wrap_data_key(derive_user_key(author_id, secret), author_id, secret),
+            master_key_id=key_id,
+        )
+        for author_id in author_ids.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0005_account_password_ciphertext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wrapped_key', models.BinaryField()),
+                ('master_key_id', models.CharField(max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('rotated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='data_key', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(create_legacy_data_keys, migrations.RunPython.noop),
+    ]
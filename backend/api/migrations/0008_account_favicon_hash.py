@@ -0,0 +1,36 @@
+# Generated by Django 4.2.24 on 2026-10-18 06:09
+
+import hashlib
+from django.db import migrations, models
+
+
+def backfill_favicon_hashes(apps, schema_editor):
+    Account = apps.get_model('api', 'Account')
+    batch = []
+    accounts = Account.objects.filter(favicon__isnull=False).only('id', 'favicon')
+    for account in accounts.iterator(chunk_size=500):
+        if not account.favicon:
+            continue
+        account.favicon_hash = hashlib.sha256(bytes(account.favicon)).hexdigest()
+        batch.append(account)
+        if len(batch) >= 500:
+            Account.objects.bulk_update(batch, ['favicon_hash'])
+            batch = []
+    if batch:
+        Account.objects.bulk_update(batch, ['favicon_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_faviconjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='favicon_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_favicon_hashes, migrations.RunPython.noop),
+    ]
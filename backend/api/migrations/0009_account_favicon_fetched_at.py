@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-18 06:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_account_favicon_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='favicon_fetched_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.24 on 2026-10-18 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_account_favicon_fetched_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaviconSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain', models.CharField(max_length=255, unique=True)),
+                ('icon_url', models.URLField(max_length=2048)),
+                ('etag', models.CharField(blank=True, default='', max_length=255)),
+                ('last_modified', models.CharField(blank=True, default='', max_length=64)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('favicon', models.BinaryField()),
+                ('favicon_content_type', models.CharField(max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('checked_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.24 on 2026-10-18 07:05
+
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+# Columns covered by account search, see api.search
+SEARCH_FIELDS = ('username', 'url', 'notes')
+
+
+def create_search_index(apps, schema_editor):
+    """Create the vendor-specific index behind api.search"""
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for field in SEARCH_FIELDS:
+            # Same expression Django emits for icontains, so the planner can use it
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS api_account_{field}_trgm '
+                f'ON api_account USING gin ((UPPER("{field}"::text)) gin_trgm_ops)'
+            )
+    elif connection.vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE api_account_fts USING fts5(username, url, notes, tokenize='trigram')"
+            )
+        except OperationalError:
+            # SQLite older than 3.34 has no trigram tokenizer; search falls back to icontains
+            return
+        schema_editor.execute(
+            "INSERT INTO api_account_fts (rowid, username, url, notes) "
+            "SELECT id, username, url, COALESCE(notes, '') FROM api_account"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        for field in SEARCH_FIELDS:
+            schema_editor.execute(f'DROP INDEX IF EXISTS api_account_{field}_trgm')
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS api_account_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_faviconsource'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
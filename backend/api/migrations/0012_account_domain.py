@@ -0,0 +1,37 @@
+# Generated by Django 4.2.24 on 2026-10-18 06:32
+
+from django.db import migrations, models
+from api.domains import normalize_domain
+
+
+def backfill_domains(apps, schema_editor):
+    Account = apps.get_model('api', 'Account')
+    batch = []
+    for account in Account.objects.only('id', 'url').iterator(chunk_size=1000):
+        account.domain = normalize_domain(account.url) or ''
+        batch.append(account)
+        if len(batch) >= 1000:
+            Account.objects.bulk_update(batch, ['domain'])
+            batch = []
+    if batch:
+        Account.objects.bulk_update(batch, ['domain'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_account_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='domain',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(backfill_domains, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['author', 'domain'], name='api_account_author__738c19_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.24 on 2026-10-18 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_account_domain'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['author', 'created_at', 'id'], name='api_account_author__59d459_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['author', 'username', 'id'], name='api_account_author__e4a5da_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['author', 'url', 'id'], name='api_account_author__762af2_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.24 on 2026-10-18 07:08
+
+from django.db import migrations, models
+from api.keyring import derive_user_key, get_encryption_secret, master_key_id, unwrap_data_key
+
+
+def flag_legacy_data_keys(apps, schema_editor):
+    """Flag data keys that are the user's secret-derived legacy key rather than random"""
+    DataKey = apps.get_model('api', 'DataKey')
+    secret = get_encryption_secret()
+
+    legacy_ids = []
+    # Keys wrapped under another secret cannot be checked here; rotate_encryption
+    # flags them when it unwraps them with --old-secret
+    for record in DataKey.objects.filter(master_key_id=master_key_id(secret)).iterator():
+        try:
+            data_key = unwrap_data_key(record.wrapped_key, record.user_id, secret)
+        except Exception:
+            continue
+        if data_key == derive_user_key(record.user_id, secret):
+            legacy_ids.append(record.id)
+    for start in range(0, len(legacy_ids), 1000):
+        DataKey.objects.filter(id__in=legacy_ids[start:start + 1000]).update(legacy=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_vaultversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datakey',
+            name='legacy',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(flag_legacy_data_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_datakey_legacy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faviconsource',
+            name='favicon_hidpi',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
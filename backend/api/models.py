@@ -1,35 +1,124 @@
-from django.db import models
+from django.db import models, IntegrityError, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
-from cryptography.fernet import Fernet
+from django.conf import settings
+from django.utils import timezone
 import base64
 import hashlib
-from django.conf import settings
 from django.core.files.base import ContentFile
+from django.utils.crypto import salted_hmac
+from .keyring import (
+    keyring, derive_user_key, generate_data_key, get_encryption_secret,
+    master_key_id, unwrap_data_key, wrap_data_key,
+)
+from .ciphers import to_bytes
+from .domains import normalize_domain
+
+
+class CiphertextField(models.BinaryField):
+    """Binary column for versioned ciphertext that still accepts legacy base64 text"""
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return to_bytes(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, str):
+            value = value.encode()
+        return super().get_db_prep_value(value, connection, prepared)
+
+
+def favicon_token(account_id, favicon_hash):
+    """
+    Return the token addressing an account's favicon.
+
+    Favicon bytes are deterministic, so a bare content hash would let anyone
+    probe whether some user has an account on a given site; keying the HMAC
+    with the account makes the URL unguessable while still changing with
+    the content, which keeps it safe to cache forever.
+    """
+    return salted_hmac('api.favicon', f'{account_id}:{favicon_hash}', algorithm='sha256').hexdigest()[:32]
+
+
+class AccountQuerySet(models.QuerySet):
+    """Account queries with named column projections"""
+
+    # Columns no projection loads up front; favicons are served by hash from /favicons/
+    HEAVY_COLUMNS = ('favicon', 'favicon_content_type')
+
+    # Serializer fields backed by a column the list projection skips when not rendered
+    OPTIONAL_COLUMNS = {'notes': 'notes', 'decrypted_password': 'password'}
+
+    PROJECTIONS = ('list', 'detail', 'write')
+
+    def for_author(self, user):
+        return self.filter(author=user)
+
+    def projection(self, name, fields=None):
+        """
+        Defer the columns a projection does not need.
+
+        Every projection skips the favicon bytes. The list projection also skips
+        notes and the ciphertext when `fields` (the serializer fields to be
+        rendered) leaves them out. Deferred columns still load on access, and
+        saving an instance only writes the columns that were loaded.
+        """
+        if name not in self.PROJECTIONS:
+            raise ValueError(f"Unknown account projection: {name}")
+
+        deferred = list(self.HEAVY_COLUMNS)
+        if name == 'list' and fields is not None:
+            deferred.extend(column for field, column in self.OPTIONAL_COLUMNS.items() if field not in fields)
+        return self.defer(*deferred)
 
 
 class Account(models.Model):
     username = models.CharField(max_length=100)
-    password = models.TextField()  # Encrypted password
+    password = CiphertextField()  # Versioned ciphertext, see api.ciphers
     url = models.URLField()
+    domain = models.CharField(max_length=255, blank=True, default='')  # Normalized host of url, see api.domains
     notes = models.TextField(blank=True, null=True)
     icon = models.URLField(blank=True, null=True)  # Legacy field for manual icon URLs
     favicon = models.BinaryField(blank=True, null=True)  # Cached favicon as binary data
     favicon_content_type = models.CharField(max_length=50, blank=True, null=True)  # MIME type
+    favicon_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)  # SHA-256 of favicon
+    favicon_fetched_at = models.DateTimeField(blank=True, null=True, db_index=True)  # Last favicon fetch attempt
     created_at = models.DateTimeField(auto_now_add=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="accounts")
 
+    FAVICON_FIELDS = ['favicon', 'favicon_content_type', 'favicon_hash', 'favicon_fetched_at']
+
+    objects = AccountQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['author', 'domain']),
+            # Per-author list orderings; the trailing id matches the cursor pagination tiebreaker
+            models.Index(fields=['author', 'created_at', 'id']),
+            models.Index(fields=['author', 'username', 'id']),
+            models.Index(fields=['author', 'url', 'id']),
+        ]
+
     def __str__(self):
         return f"{self.username} @ {self.url}"
+
+    def save(self, *args, **kwargs):
+        """Keep `domain` derived from `url` whenever the url is written"""
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'url' in update_fields:
+            self.domain = normalize_domain(self.url) or ''
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'domain'}
+        super().save(*args, **kwargs)
     
     def set_password(self, plain_password):
         """Encrypt and store the password"""
         if not self.author_id:
             raise ValueError("Account must have an author before setting password")
         
-        key = self._get_encryption_key()
-        fernet = Fernet(key)
-        encrypted_password = fernet.encrypt(plain_password.encode())
-        self.password = base64.b64encode(encrypted_password).decode()
+        engine = getattr(settings, 'ENCRYPTION_ENGINE', 'aesgcm')
+        self.password = self._get_cipher().encrypt(plain_password, engine)
     
     def get_password(self):
         """Decrypt and return the password"""
@@ -37,24 +126,23 @@ class Account(models.Model):
             return ""
         
         try:
-            key = self._get_encryption_key()
-            fernet = Fernet(key)
-            encrypted_password = base64.b64decode(self.password.encode())
-            decrypted_password = fernet.decrypt(encrypted_password)
-            return decrypted_password.decode()
+            return self._get_cipher().decrypt(self.password)
         except Exception as e:
             raise ValueError(f"Failed to decrypt password: {str(e)}")
     
     def _get_encryption_key(self):
-        """Generate encryption key based on user ID and secret"""
+        """Return the author's data-encryption key"""
         if not self.author_id:
             raise ValueError("Account must have an author to generate encryption key")
-            
-        secret = getattr(settings, 'ENCRYPTION_SECRET', 'default-secret-key-change-this')
-        user_key = f"{self.author_id}_{secret}".encode()
-        # Hash to get consistent 32-byte key
-        key_hash = hashlib.sha256(user_key).digest()
-        return base64.urlsafe_b64encode(key_hash)
+        
+        return keyring.get_key(self.author_id)
+    
+    def _get_cipher(self):
+        """Return the cached CipherSet for this account's author"""
+        if not self.author_id:
+            raise ValueError("Account must have an author to generate encryption key")
+        
+        return keyring.get_cipher(self.author_id)
     
     def get_favicon_url(self):
         """Get the URL for the favicon (either cached or manual icon)"""
@@ -68,6 +156,19 @@ class Account(models.Model):
         
         return None
     
+    def get_favicon_token(self):
+        """Return the token of the favicon endpoint URL, or None without a favicon"""
+        if not self.favicon_hash:
+            return None
+        return favicon_token(self.pk, self.favicon_hash)
+
+    def set_favicon(self, favicon_data, content_type):
+        """Store favicon bytes along with the content hash used to address them"""
+        self.favicon = favicon_data
+        self.favicon_content_type = content_type if favicon_data else None
+        self.favicon_hash = hashlib.sha256(favicon_data).hexdigest() if favicon_data else None
+        self.favicon_fetched_at = timezone.now() if favicon_data else None
+    
     def fetch_favicon(self):
         """Fetch and cache favicon for this account's URL"""
         from .favicon_service import FaviconService
@@ -75,9 +176,8 @@ class Account(models.Model):
         try:
             favicon_data, content_type = FaviconService.fetch_and_process_favicon(self.url)
             if favicon_data:
-                self.favicon = favicon_data
-                self.favicon_content_type = content_type
-                self.save(update_fields=['favicon', 'favicon_content_type'])
+                self.set_favicon(favicon_data, content_type)
+                self.save(update_fields=self.FAVICON_FIELDS)
                 return True
         except Exception:
             pass
@@ -87,6 +187,154 @@ class Account(models.Model):
     def delete_favicon(self):
         """Delete the cached favicon data"""
         if self.favicon:
-            self.favicon = None
-            self.favicon_content_type = None
-            self.save(update_fields=['favicon', 'favicon_content_type'])
+            self.set_favicon(None, None)
+            self.save(update_fields=self.FAVICON_FIELDS)
+
+
+class DataKeyManager(models.Manager):
+    def get_data_key(self, user_id):
+        """Return the unwrapped data key for a user, creating it on first use"""
+        secret = get_encryption_secret()
+        try:
+            record = self.get(user_id=user_id)
+        except self.model.DoesNotExist:
+            record = self._create_for_user(user_id, secret)
+        
+        if record.master_key_id != master_key_id(secret):
+            raise ValueError(
+                f"Data key for user {user_id} is wrapped with a different master secret; "
+                "run 'manage.py rotate_encryption --old-secret ...'"
+            )
+        return unwrap_data_key(record.wrapped_key, user_id, secret)
+    
+    def _create_for_user(self, user_id, secret):
+        # Users that already own ciphertext from before envelope encryption keep
+        # their legacy derived key for now, flagged so rotate_encryption replaces
+        # it with a random key and re-encrypts their rows
+        legacy = Account.objects.filter(author_id=user_id).exclude(password=b'').exists()
+        data_key = derive_user_key(user_id, secret) if legacy else generate_data_key()
+        
+        try:
+            with transaction.atomic():
+                return self.create(
+                    user_id=user_id,
+                    wrapped_key=wrap_data_key(data_key, user_id, secret),
+                    master_key_id=master_key_id(secret),
+                    legacy=legacy,
+                )
+        except IntegrityError:
+            # Another request created it first; use theirs
+            return self.get(user_id=user_id)
+
+
+class DataKey(models.Model):
+    """Per-user data-encryption key, stored wrapped under the master secret"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="data_key")
+    wrapped_key = models.BinaryField()  # Nonce + AES-GCM ciphertext of the data key
+    master_key_id = models.CharField(max_length=16)  # Fingerprint of the wrapping secret
+    legacy = models.BooleanField(default=False)  # Derived from the master secret, not random; see rotate_encryption
+    created_at = models.DateTimeField(auto_now_add=True)
+    rotated_at = models.DateTimeField(auto_now=True)
+
+    objects = DataKeyManager()
+
+    def __str__(self):
+        return f"Data key for {self.user}"
+
+
+class VaultVersionManager(models.Manager):
+    def current(self, user_id):
+        """Return a user's vault version, starting the counter on first use"""
+        version = self.filter(user_id=user_id).values_list('version', flat=True).first()
+        if version is not None:
+            return version
+        try:
+            with transaction.atomic():
+                return self.create(user_id=user_id).version
+        except IntegrityError:
+            # Another request started it first; use theirs
+            return self.filter(user_id=user_id).values_list('version', flat=True).get()
+
+    def bump(self, user_ids):
+        """
+        Advance the vault version of every user in `user_ids`.
+
+        Only existing counters are bumped: a user without one has never been
+        handed a version, so there is no ETag to invalidate.
+        """
+        return self.filter(user_id__in=user_ids).update(version=F('version') + 1)
+
+    def bump_for_accounts(self, account_ids):
+        """Advance the vault versions of the owners of `account_ids`"""
+        return self.bump(Account.objects.filter(pk__in=account_ids).values('author_id'))
+
+
+class VaultVersion(models.Model):
+    """Per-user counter of vault changes, used to validate cached account responses"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="vault_version")
+    version = models.PositiveBigIntegerField(default=0)
+
+    objects = VaultVersionManager()
+
+    def __str__(self):
+        return f"Vault version {self.version} for {self.user}"
+
+
+class FaviconJob(models.Model):
+    """Queued favicon fetch, claimed and run by the run_favicon_worker command"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = [STATUS_PENDING, STATUS_RUNNING]
+
+    url = models.URLField()
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name="favicon_jobs", blank=True, null=True)
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="favicon_jobs")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)  # Earliest time the job may be claimed
+    locked_until = models.DateTimeField(blank=True, null=True)  # Lease held by the claiming worker
+    last_error = models.TextField(blank=True, default='')
+    favicon = models.BinaryField(blank=True, null=True)  # Result for jobs without an account
+    favicon_content_type = models.CharField(max_length=50, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"Favicon job {self.pk} for {self.url} ({self.status})"
+
+    def get_favicon_url(self):
+        """Return the fetched favicon as a data URL, if the job succeeded"""
+        if self.account_id:
+            return self.account.get_favicon_url()
+        if self.favicon and self.favicon_content_type:
+            favicon_b64 = base64.b64encode(self.favicon).decode('utf-8')
+            return f"data:{self.favicon_content_type};base64,{favicon_b64}"
+        return None
+
+
+class FaviconSource(models.Model):
+    """Upstream icon behind a domain's favicon, kept so refreshes can revalidate it conditionally"""
+    domain = models.CharField(max_length=255, unique=True)  # Normalized, see FaviconService.normalize_domain
+    icon_url = models.URLField(max_length=2048)  # Resolved upstream icon URL
+    etag = models.CharField(max_length=255, blank=True, default='')
+    last_modified = models.CharField(max_length=64, blank=True, default='')
+    content_hash = models.CharField(max_length=64)  # SHA-256 of the upstream bytes
+    favicon = models.BinaryField()  # Processed favicon served for this domain
+    favicon_hidpi = models.BinaryField(blank=True, null=True)  # Same icon at FaviconService.HIDPI_SIZE
+    favicon_content_type = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+    checked_at = models.DateTimeField(auto_now=True)  # Last time upstream was contacted
+
+    def __str__(self):
+        return f"Favicon source for {self.domain}"
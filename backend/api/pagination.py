@@ -0,0 +1,128 @@
+import base64
+import json
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class AccountCursorPagination(BasePagination):
+    """
+    Opt-in keyset pagination for the account list.
+
+    Only active when the request carries `page_size` or `cursor`, so plain
+    `GET /api/accounts/` keeps returning the full list. Pages are cut with a
+    `(sort column, id) > (last value, last id)` condition instead of OFFSET,
+    the id tiebreaker keeps the order stable for duplicate values, and no
+    COUNT(*) is ever run: one extra row tells whether a next page exists.
+    """
+
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+
+    # Sort columns a cursor can be built on; `id` breaks ties
+    ORDERING_FIELDS = ('created_at', 'username', 'url')
+    DEFAULT_ORDERING = '-created_at'
+
+    def _is_requested(self, request):
+        params = request.query_params
+        return self.page_size_query_param in params or self.cursor_query_param in params
+
+    def get_page_size(self, request):
+        default = getattr(settings, 'ACCOUNT_PAGE_SIZE', 50)
+        maximum = getattr(settings, 'ACCOUNT_MAX_PAGE_SIZE', 500)
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return default
+        try:
+            page_size = int(value)
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: 'Must be an integer.'})
+        if page_size < 1:
+            raise ValidationError({self.page_size_query_param: 'Must be at least 1.'})
+        return min(page_size, maximum)
+
+    def get_ordering(self, request, queryset, view):
+        """Return the single supported ordering asked for with ?ordering=, or the default"""
+        ordering = OrderingFilter().get_ordering(request, queryset, view) or [self.DEFAULT_ORDERING]
+        ordering = ordering[0]
+        if ordering.lstrip('-') not in self.ORDERING_FIELDS:
+            raise ValidationError({'ordering': f"Cursor pagination supports: {', '.join(self.ORDERING_FIELDS)}"})
+        return ordering
+
+    def encode_cursor(self, ordering, obj):
+        field = ordering.lstrip('-')
+        value = getattr(obj, field)
+        if field == 'created_at':
+            value = value.isoformat()
+        payload = json.dumps({'o': ordering, 'v': value, 'id': obj.pk}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor, ordering):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            value, last_id = payload['v'], int(payload['id'])
+            if not isinstance(value, str):
+                raise ValueError('cursor value must be a string')
+            if payload['o'] != ordering:
+                raise ValueError('cursor was issued for another ordering')
+            if ordering.lstrip('-') == 'created_at':
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError('bad timestamp')
+        except (ValueError, TypeError, KeyError):
+            raise NotFound('Invalid cursor.')
+        return value, last_id
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self._is_requested(request):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        field = self.ordering.lstrip('-')
+        descending = self.ordering.startswith('-')
+        order = '-' if descending else ''
+
+        queryset = queryset.order_by(f'{order}{field}', f'{order}id')
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, last_id = self.decode_cursor(cursor, self.ordering)
+            after = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{field}__{after}': value}) | Q(**{field: value, f'id__{after}': last_id})
+            )
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.ordering, self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+
+# Columns covered by account search
+SEARCH_FIELDS = ('username', 'url', 'notes')
+
+FTS_TABLE = 'api_account_fts'
+
+# Trigram indexes cannot match anything shorter than one trigram
+MIN_INDEXED_LENGTH = 3
+
+
+class IcontainsSearchBackend:
+    """Unindexed fallback: OR of icontains over every search field"""
+
+    name = 'icontains'
+
+    def search(self, queryset, term):
+        query = Q()
+        for field in SEARCH_FIELDS:
+            query |= Q(**{f'{field}__icontains': term})
+        return queryset.filter(query)
+
+    def index(self, account):
+        pass
+
+    def remove(self, account_id):
+        pass
+
+
+class PostgresTrigramSearchBackend(IcontainsSearchBackend):
+    """
+    icontains served by pg_trgm GIN indexes.
+
+    Django renders icontains as UPPER(col::text) LIKE UPPER(%s), and the
+    migration indexes exactly those expressions with gin_trgm_ops, so
+    Postgres answers the query from the index and keeps it up to date itself.
+    """
+
+    name = 'postgres-trigram'
+
+
+class SqliteFtsSearchBackend(IcontainsSearchBackend):
+    """Substring search through an FTS5 trigram table kept in sync by signals"""
+
+    name = 'sqlite-fts5'
+
+    def __init__(self, using='default'):
+        self.using = using
+
+    def search(self, queryset, term):
+        if len(term) < MIN_INDEXED_LENGTH:
+            return super().search(queryset, term)
+        # A quoted phrase of trigrams matches the term as a substring of one column
+        phrase = '"' + term.replace('"', '""') + '"'
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [phrase])
+        )
+
+    def index(self, account):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [account.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, username, url, notes) VALUES (%s, %s, %s, %s)',
+                [account.pk, account.username, account.url, account.notes or ''],
+            )
+
+    def remove(self, account_id):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [account_id])
+
+
+_backends = {}
+
+
+def _has_fts_table(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def get_search_backend(using='default'):
+    """
+    Return the search backend for a database alias.
+
+    ACCOUNT_SEARCH_BACKEND='icontains' forces the unindexed fallback; the
+    default 'auto' picks the indexed backend for the database vendor. SQLite
+    builds without FTS5 trigram support (migration skipped the table) fall
+    back to icontains.
+    """
+    backend = _backends.get(using)
+    if backend is not None:
+        return backend
+
+    connection = connections[using]
+    if getattr(settings, 'ACCOUNT_SEARCH_BACKEND', 'auto') == 'icontains':
+        backend = IcontainsSearchBackend()
+    elif connection.vendor == 'postgresql':
+        backend = PostgresTrigramSearchBackend()
+    elif connection.vendor == 'sqlite' and _has_fts_table(connection):
+        backend = SqliteFtsSearchBackend(using)
+    else:
+        backend = IcontainsSearchBackend()
+    _backends[using] = backend
+    return backend
+
+
+def reset_search_backends():
+    """Forget chosen backends, e.g. after the schema or settings changed"""
+    _backends.clear()
+
+
+def search_accounts(queryset, term):
+    """Filter an Account queryset to rows whose username, url or notes contain `term`"""
+    term = term.strip()
+    if not term:
+        return queryset
+    return get_search_backend(queryset.db).search(queryset, term)
@@ -1,6 +1,14 @@
 from django.contrib.auth.models import User
+from django.urls import reverse
 from rest_framework import serializers
 from .models import Account
+from .decryption import decrypt_passwords
+from .favicon_jobs import enqueue_favicon_job
+from .favicon_service import FaviconService
+
+
+DECRYPTION_ERROR = "Error decrypting password"
+
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -21,26 +29,71 @@ class UserSerializer(serializers.ModelSerializer):
                 'non_field_errors': ['Registration failed. Please try again.']
             })
 
+class AccountListSerializer(serializers.ListSerializer):
+    """List serializer that decrypts the whole page in one batch"""
+
+    def to_representation(self, data):
+        accounts = list(data.all() if hasattr(data, 'all') else data)
+        if 'decrypted_password' not in self.child.fields:
+            return super().to_representation(accounts)
+        self.child.decrypted_passwords = decrypt_passwords(accounts)
+        try:
+            return super().to_representation(accounts)
+        finally:
+            self.child.decrypted_passwords = None
+
 class AccountSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)  # Only for input
     decrypted_password = serializers.SerializerMethodField()  # For output
     favicon_url = serializers.SerializerMethodField()  # For output
+    favicon_srcset = serializers.SerializerMethodField()  # For output, <img srcset> with the HiDPI variant
 
     class Meta:
         model = Account
-        fields = ["id", "username", "password", "decrypted_password", "url", "notes", "icon", "favicon_url", "created_at", "author"]
+        fields = [
+            "id", "username", "password", "decrypted_password", "url", "notes", "icon",
+            "favicon_url", "favicon_srcset", "created_at", "author",
+        ]
         extra_kwargs = {"author": {"read_only": True}}
+        list_serializer_class = AccountListSerializer
+
+    def __init__(self, *args, **kwargs):
+        """Accept an optional `fields` iterable to render a sparse fieldset"""
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
 
     def get_decrypted_password(self, obj):
         """Return decrypted password for the authenticated user"""
+        decrypted = getattr(self, 'decrypted_passwords', None)
+        if decrypted is not None and obj.pk in decrypted:
+            password = decrypted[obj.pk]
+            return password if password is not None else DECRYPTION_ERROR
         try:
             return obj.get_password()
         except Exception:
-            return "Error decrypting password"
+            return DECRYPTION_ERROR
 
     def get_favicon_url(self, obj):
-        """Return the favicon URL (cached or manual icon)"""
-        return obj.get_favicon_url()
+        """Return the favicon URL (manual icon, or the cacheable favicon endpoint)"""
+        if obj.icon:
+            return obj.icon
+        token = obj.get_favicon_token()
+        if not token:
+            return None
+        
+        url = reverse('favicon', kwargs={'pk': obj.pk, 'token': token})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_favicon_srcset(self, obj):
+        """Return an <img srcset> offering the 64px favicon to HiDPI screens, or None for manual icons"""
+        if obj.icon or not obj.get_favicon_token():
+            return None
+        url = self.get_favicon_url(obj)
+        return f"{url} 1x, {url}?size={FaviconService.HIDPI_SIZE} 2x"
 
     def create(self, validated_data):
         """Create account with encrypted password"""
@@ -52,4 +105,21 @@ class AccountSerializer(serializers.ModelSerializer):
         except Exception as e:
             account.delete()
             raise serializers.ValidationError(f"Failed to encrypt password: {str(e)}")
-        return account
\ No newline at end of file
+        if not account.icon:
+            enqueue_favicon_job(account.url, account.author, account)
+        return account
+
+
+class AccountRevealSerializer(serializers.ModelSerializer):
+    """Serializer that exposes the decrypted password of a single account"""
+    decrypted_password = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Account
+        fields = ["id", "decrypted_password"]
+
+    def get_decrypted_password(self, obj):
+        try:
+            return obj.get_password()
+        except Exception:
+            return DECRYPTION_ERROR
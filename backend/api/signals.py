@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Account, VaultVersion
+from .search import SEARCH_FIELDS, get_search_backend
+
+
+@receiver(post_save, sender=Account)
+def index_account(sender, instance, using, update_fields=None, **kwargs):
+    """Keep the account search index in step with saved rows"""
+    if update_fields is not None and not set(update_fields) & set(SEARCH_FIELDS):
+        return
+    get_search_backend(using).index(instance)
+
+
+@receiver(post_delete, sender=Account)
+def unindex_account(sender, instance, using, **kwargs):
+    get_search_backend(using).remove(instance.pk)
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def bump_vault_version(sender, instance, using, **kwargs):
+    """Invalidate the owner's cached account responses on every write"""
+    VaultVersion.objects.db_manager(using).bump([instance.author_id])
@@ -0,0 +1,94 @@
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from django.db import connection
+
+
+class _Call:
+    """One in-flight call whose outcome is shared with every waiter"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into a single execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for its result (or exception) instead of repeating the work.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        """Run fn() once per key at a time; raise TimeoutError if a waiter gives up"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.event.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight call {key!r}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def in_flight(self):
+        """Return how many keys are currently being computed"""
+        with self._lock:
+            return len(self._calls)
+
+
+def advisory_lock_id(name):
+    """Map a lock name to the signed 64-bit key Postgres advisory locks take"""
+    return int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], 'big', signed=True)
+
+
+@contextmanager
+def advisory_lock(name, timeout, poll_interval=0.05):
+    """
+    Hold a Postgres session-level advisory lock named `name` for the block.
+
+    Yields True once the lock is held, or False if it could not be taken
+    within `timeout` seconds or the database is not Postgres; callers go
+    ahead either way, so a stuck holder can never block them for good.
+    """
+    if connection.vendor != 'postgresql':
+        yield False
+        return
+
+    lock_id = advisory_lock_id(name)
+    deadline = time.monotonic() + timeout
+    acquired = False
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [lock_id])
+            acquired = cursor.fetchone()[0]
+            if acquired or time.monotonic() >= deadline:
+                break
+            time.sleep(poll_interval)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [lock_id])
@@ -1,16 +1,50 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from PIL import Image
+import requests
+from cryptography.exceptions import InvalidTag
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Account
+from .models import Account, DataKey, FaviconJob, FaviconSource, VaultVersion
+from .keyring import Keyring, keyring, derive_user_key, master_key_id
+from .decryption import decrypt_passwords
+from .ciphers import CipherSet, ENGINES
+from .favicon_service import FaviconService, FaviconUnavailable
+from .favicon_html import parse_icon_links, parse_manifest_icons, rank_candidates
+from .http_client import PooledHttpClient
+from .dns_cache import DnsCache
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .favicon_jobs import claim_jobs, enqueue_favicon_job, prune_jobs, run_job
+from .search import get_search_backend, search_accounts
+from .domains import normalize_domain
+from .singleflight import SingleFlight, advisory_lock
+from .favicon_metrics import StageMetrics, metrics
+from .favicon_images import MAX_IMAGE_PIXELS, decode_favicon, process_favicon, process_favicon_variants
 
 
 class AccountModelTest(TestCase):
     """Tests for the Account model functionality"""
     
     def setUp(self):
+        keyring.clear()
         self.user = User.objects.create_user(
             username='testuser',
             password='testpass123'
@@ -40,6 +74,7 @@ class AccountAPITest(APITestCase):
     """Tests for the Account API endpoints"""
     
     def setUp(self):
+        keyring.clear()
         self.user = User.objects.create_user(
             username='testuser',
             password='testpass123'
@@ -133,6 +168,7 @@ class AccountSearchFilterTest(APITestCase):
     """Tests for search and filtering functionality"""
     
     def setUp(self):
+        keyring.clear()
         self.user = User.objects.create_user(
             username='testuser',
             password='testpass123'
@@ -193,6 +229,7 @@ class AccountDetailTest(APITestCase):
     """Tests for account detail view and updates"""
     
     def setUp(self):
+        keyring.clear()
         self.user = User.objects.create_user(
             username='testuser',
             password='testpass123'
@@ -322,6 +359,7 @@ class SecurityTest(APITestCase):
     """Tests for security features and data isolation"""
     
     def setUp(self):
+        keyring.clear()
         self.user1 = User.objects.create_user(
             username='user1',
             email='user1@example.com',
@@ -419,4 +457,1927 @@ class SecurityTest(APITestCase):
             url = reverse('account-list')
             response = self.client.get(url)
             self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED,
-                           f"Invalid token '{invalid_token}' should be rejected")
\ No newline at end of file
+                           f"Invalid token '{invalid_token}' should be rejected")
+
+class KeyringTest(TestCase):
+    """Tests for the per-user cipher keyring cache"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.keyring = Keyring(max_size=2)
+    
+    def test_key_is_derived_once_per_author(self):
+        """Test that repeated lookups hit the cache"""
+        first = self.keyring.get_cipher(self.user.id)
+        second = self.keyring.get_cipher(self.user.id)
+        
+        self.assertIs(first, second)
+        self.assertEqual(self.keyring.stats()['misses'], 1)
+        self.assertEqual(self.keyring.stats()['hits'], 1)
+    
+    def test_lru_eviction(self):
+        """Test that the least recently used author is evicted"""
+        keyring = Keyring(max_size=2, load_key=lambda author_id: bytes([author_id]) * 32)
+        keyring.get_key(1)
+        keyring.get_key(2)
+        keyring.get_key(1)
+        keyring.get_key(3)
+        
+        self.assertEqual(keyring.stats()['size'], 2)
+        keyring.get_key(1)
+        self.assertEqual(keyring.stats()['misses'], 3)
+        keyring.get_key(2)
+        self.assertEqual(keyring.stats()['misses'], 4)
+    
+    def test_secret_change_clears_cache(self):
+        """Test that cached keys are unwrapped again when the secret changes"""
+        self.keyring.get_key(self.user.id)
+        with self.settings(ENCRYPTION_SECRET='rotated-secret'):
+            with self.assertRaises(ValueError):
+                self.keyring.get_key(self.user.id)
+        
+        self.assertEqual(self.keyring.stats()['misses'], 2)
+        self.keyring.clear()
+        self.assertEqual(self.keyring.stats()['size'], 0)
+    
+    def test_account_uses_shared_keyring(self):
+        """Test that accounts still round-trip through the shared keyring"""
+        account = Account.objects.create(
+            username='john_doe',
+            password='',
+            url='https://example.com',
+            author=self.user
+        )
+        account.set_password('test_password')
+        account.save()
+        
+        hits_before = keyring.stats()['hits']
+        self.assertEqual(account.get_password(), 'test_password')
+        self.assertGreater(keyring.stats()['hits'], hits_before)
+
+
+class BatchDecryptionTest(APITestCase):
+    """Tests for batched decryption in the account list serializer"""
+    
+    def setUp(self):
+        keyring.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.access_token}')
+        
+        for i in range(5):
+            account = Account.objects.create(
+                username=f'user{i}',
+                password='',
+                url=f'https://site{i}.com',
+                author=self.user
+            )
+            account.set_password(f'password{i}')
+            account.save()
+        
+        self.broken = Account.objects.create(
+            username='broken',
+            password='bm90LWEtdmFsaWQtdG9rZW4=',
+            url='https://broken.com',
+            author=self.user
+        )
+    
+    def test_decrypt_passwords_reports_failures_per_row(self):
+        """Test that one bad row does not fail the whole batch"""
+        accounts = list(Account.objects.filter(author=self.user))
+        with self.settings(ACCOUNT_DECRYPT_BATCH_THRESHOLD=1, ACCOUNT_DECRYPT_EXECUTOR='thread',
+                           ACCOUNT_DECRYPT_WORKERS=2):
+            results = decrypt_passwords(accounts)
+        
+        self.assertIsNone(results[self.broken.pk])
+        for account in accounts:
+            if account.pk != self.broken.pk:
+                self.assertEqual(results[account.pk], f'password{account.username[4:]}')
+    
+    def test_pool_workers_do_not_load_keys(self):
+        """Test that a cold keyring is filled on the calling thread, once per author"""
+        accounts = list(Account.objects.filter(author=self.user))
+        load_data_key = DataKey.objects.get_data_key
+        threads = []
+        
+        def record_thread(user_id):
+            threads.append(threading.current_thread().name)
+            return load_data_key(user_id)
+        
+        keyring.clear()
+        with patch.object(DataKey.objects, 'get_data_key', side_effect=record_thread), \
+                self.settings(ACCOUNT_DECRYPT_BATCH_THRESHOLD=1, ACCOUNT_DECRYPT_EXECUTOR='thread',
+                              ACCOUNT_DECRYPT_WORKERS=2):
+            results = decrypt_passwords(accounts)
+        
+        self.assertEqual(threads, [threading.current_thread().name])
+        self.assertEqual({a.username: results[a.pk] for a in accounts}['user0'], 'password0')
+    
+    def test_default_decrypts_inline(self):
+        """Test that large batches skip the pools unless an executor is configured"""
+        accounts = list(Account.objects.filter(author=self.user))
+        with patch('api.decryption._get_executor') as get_executor, \
+                self.settings(ACCOUNT_DECRYPT_BATCH_THRESHOLD=1):
+            results = decrypt_passwords(accounts)
+        
+        get_executor.assert_not_called()
+        self.assertEqual({a.username: results[a.pk] for a in accounts}['user0'], 'password0')
+    
+    def test_list_uses_batch_results(self):
+        """Test that the list endpoint returns batch-decrypted passwords"""
+        url = reverse('account-list')
+        with self.settings(ACCOUNT_DECRYPT_BATCH_THRESHOLD=1):
+            response = self.client.get(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        passwords = {row['username']: row['decrypted_password'] for row in response.data}
+        self.assertEqual(passwords['user3'], 'password3')
+        self.assertEqual(passwords['broken'], 'Error decrypting password')
+    
+    def test_list_survives_unloadable_key(self):
+        """Test that a data key wrapped under another secret fails its rows, not the list"""
+        url = reverse('account-list')
+        for executor in (None, 'thread'):
+            keyring.clear()
+            with self.settings(ENCRYPTION_SECRET='rotated-secret', ACCOUNT_DECRYPT_BATCH_THRESHOLD=1,
+                               ACCOUNT_DECRYPT_EXECUTOR=executor):
+                response = self.client.get(url)
+            
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual({row['decrypted_password'] for row in response.data}, {'Error decrypting password'})
+        keyring.clear()
+
+
+class SparseFieldsetTest(APITestCase):
+    """Tests for sparse list fieldsets and the per-account reveal endpoint"""
+    
+    def setUp(self):
+        keyring.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.access_token}')
+        
+        self.account = Account.objects.create(
+            username='john_doe',
+            password='',
+            url='https://gmail.com',
+            author=self.user
+        )
+        self.account.set_password('secret_password')
+        self.account.save()
+    
+    def test_fields_param_limits_output(self):
+        """Test that ?fields= only renders the requested fields"""
+        url = reverse('account-list')
+        response = self.client.get(url, {'fields': 'id,username,url'})
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data[0]), {'id', 'username', 'url'})
+    
+    def test_reveal_false_skips_decryption(self):
+        """Test that ?reveal=false omits decrypted passwords"""
+        url = reverse('account-list')
+        response = self.client.get(url, {'reveal': 'false'})
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('decrypted_password', response.data[0])
+        self.assertIn('favicon_url', response.data[0])
+    
+    def test_reveal_endpoint(self):
+        """Test decrypting a single password on demand"""
+        url = reverse('reveal-account-password', kwargs={'pk': self.account.pk})
+        response = self.client.get(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['decrypted_password'], 'secret_password')
+    
+    def test_reveal_endpoint_isolation(self):
+        """Test that other users cannot reveal an account's password"""
+        other_user = User.objects.create_user(username='other', password='otherpass123')
+        token = RefreshToken.for_user(other_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token.access_token}')
+        
+        url = reverse('reveal-account-password', kwargs={'pk': self.account.pk})
+        response = self.client.get(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CiphertextFormatTest(TestCase):
+    """Tests for the versioned binary ciphertext format"""
+    
+    def setUp(self):
+        keyring.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.account = Account.objects.create(
+            username='john_doe',
+            password='',
+            url='https://example.com',
+            author=self.user
+        )
+    
+    def test_engines_round_trip_with_header(self):
+        """Test that each engine writes its header byte and decrypts back"""
+        for engine, version in ENGINES.items():
+            with self.settings(ENCRYPTION_ENGINE=engine):
+                self.account.set_password('engine_password')
+                self.account.save()
+            
+            self.account.refresh_from_db()
+            self.assertIsInstance(self.account.password, bytes)
+            self.assertEqual(self.account.password[0], version)
+            self.assertEqual(self.account.get_password(), 'engine_password')
+    
+    def test_legacy_base64_rows_still_decrypt(self):
+        """Test that rows written in the old base64 text format remain readable"""
+        fernet = keyring.get_cipher(self.user.id).get(ENGINES['fernet'])
+        legacy = base64.b64encode(fernet.encrypt(b'legacy_password')).decode()
+        Account.objects.filter(pk=self.account.pk).update(password=legacy)
+        
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.get_password(), 'legacy_password')
+    
+    def test_aead_ciphertext_is_smaller_than_legacy(self):
+        """Test that AES-GCM rows are smaller than base64 Fernet rows"""
+        fernet = keyring.get_cipher(self.user.id).get(ENGINES['fernet'])
+        legacy = base64.b64encode(fernet.encrypt(b'some_password'))
+        
+        with self.settings(ENCRYPTION_ENGINE='aesgcm'):
+            self.account.set_password('some_password')
+        self.assertLess(len(self.account.password), len(legacy))
+
+
+class RotateEncryptionCommandTest(TestCase):
+    """Tests for the rotate_encryption management command"""
+    
+    def setUp(self):
+        keyring.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'rotate.json')
+        self.accounts = []
+        with self.settings(ENCRYPTION_SECRET='old-secret', ENCRYPTION_ENGINE='fernet'):
+            for i in range(5):
+                account = Account.objects.create(
+                    username=f'user{i}',
+                    password='',
+                    url=f'https://site{i}.com',
+                    author=self.user
+                )
+                account.set_password(f'password{i}')
+                account.save()
+                self.accounts.append(account)
+    
+    def test_rotation_only_rewraps_data_keys(self):
+        """Test that rotating the secret rewraps keys without touching account rows"""
+        before = {a.pk: bytes(a.password) for a in Account.objects.all()}
+        with self.settings(ENCRYPTION_SECRET='new-secret'):
+            call_command('rotate_encryption', old_secret='old-secret', stdout=StringIO())
+            
+            self.assertEqual(DataKey.objects.get(user=self.user).master_key_id, master_key_id('new-secret'))
+            for i, account in enumerate(self.accounts):
+                account.refresh_from_db()
+                self.assertEqual(bytes(account.password), before[account.pk])
+                self.assertEqual(account.get_password(), f'password{i}')
+    
+    def test_reencrypt_changes_engine(self):
+        """Test that --reencrypt rewrites every row with the target engine"""
+        with self.settings(ENCRYPTION_SECRET='new-secret'):
+            call_command('rotate_encryption', old_secret='old-secret', reencrypt=True, engine='aesgcm',
+                         workers=2, chunk_size=2, checkpoint=self.checkpoint, stdout=StringIO())
+            
+            for i, account in enumerate(self.accounts):
+                account.refresh_from_db()
+                self.assertEqual(account.password[0], ENGINES['aesgcm'])
+                self.assertEqual(account.get_password(), f'password{i}')
+        
+        self.assertFalse(os.path.exists(self.checkpoint))
+    
+    def test_reencrypt_resumes_from_checkpoint(self):
+        """Test that --resume skips rows already covered by the checkpoint"""
+        first = self.accounts[0]
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'author_id': first.author_id, 'account_id': first.id}, f)
+        
+        with self.settings(ENCRYPTION_SECRET='old-secret'):
+            call_command('rotate_encryption', reencrypt=True, engine='aesgcm', workers=0,
+                         resume=True, checkpoint=self.checkpoint, stdout=StringIO())
+            
+            first.refresh_from_db()
+            self.assertEqual(first.password[0], ENGINES['fernet'])
+            self.accounts[1].refresh_from_db()
+            self.assertEqual(self.accounts[1].password[0], ENGINES['aesgcm'])
+            self.assertEqual(self.accounts[1].get_password(), 'password1')
+
+
+class EnvelopeEncryptionTest(TestCase):
+    """Tests for per-user data keys wrapped under the master secret"""
+    
+    def setUp(self):
+        keyring.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+    
+    def test_new_users_get_random_wrapped_data_key(self):
+        """Test that a new user's data key is random and stored wrapped"""
+        data_key = DataKey.objects.get_data_key(self.user.id)
+        record = DataKey.objects.get(user=self.user)
+        
+        self.assertEqual(len(data_key), 32)
+        self.assertNotEqual(data_key, derive_user_key(self.user.id, 'super-secret-encryption-key'))
+        self.assertNotIn(data_key, bytes(record.wrapped_key))
+        self.assertEqual(DataKey.objects.get_data_key(self.user.id), data_key)
+    
+    def _create_legacy_account(self, secret='super-secret-encryption-key'):
+        legacy_key = derive_user_key(self.user.id, secret)
+        return legacy_key, Account.objects.create(
+            username='legacy',
+            password=CipherSet(legacy_key).encrypt('legacy_password', 'fernet'),
+            url='https://legacy.com',
+            author=self.user
+        )
+    
+    def test_legacy_rows_adopt_flagged_derived_key(self):
+        """Test that users with pre-envelope ciphertext adopt their legacy key, flagged for replacement"""
+        legacy_key, account = self._create_legacy_account()
+        
+        self.assertEqual(account.get_password(), 'legacy_password')
+        self.assertEqual(DataKey.objects.get_data_key(self.user.id), legacy_key)
+        self.assertTrue(DataKey.objects.get(user=self.user).legacy)
+    
+    def test_rotation_replaces_legacy_key_once(self):
+        """Test that rotate_encryption gives legacy users a random key and re-encrypts their rows"""
+        legacy_key, account = self._create_legacy_account()
+        DataKey.objects.get_data_key(self.user.id)
+        
+        call_command('rotate_encryption', stdout=StringIO())
+        
+        keyring.clear()
+        record = DataKey.objects.get(user=self.user)
+        self.assertFalse(record.legacy)
+        self.assertNotEqual(DataKey.objects.get_data_key(self.user.id), legacy_key)
+        account.refresh_from_db()
+        self.assertEqual(account.password[0], ENGINES['aesgcm'])
+        self.assertEqual(account.get_password(), 'legacy_password')
+        with self.assertRaises(InvalidTag):
+            CipherSet(legacy_key).decrypt(account.password)
+        
+        with self.assertRaises(CommandError):
+            call_command('rotate_encryption', stdout=StringIO())
+    
+    def test_secret_rotation_flags_keys_derived_from_old_secret(self):
+        """Test that rewrapping detects derived keys the migration could not check"""
+        legacy_key, account = self._create_legacy_account(secret='old-secret')
+        with self.settings(ENCRYPTION_SECRET='old-secret'):
+            DataKey.objects.get_data_key(self.user.id)
+        DataKey.objects.filter(user=self.user).update(legacy=False)
+        
+        call_command('rotate_encryption', old_secret='old-secret', stdout=StringIO())
+        
+        keyring.clear()
+        self.assertFalse(DataKey.objects.get(user=self.user).legacy)
+        self.assertNotEqual(DataKey.objects.get_data_key(self.user.id), legacy_key)
+        account.refresh_from_db()
+        self.assertEqual(account.get_password(), 'legacy_password')
+
+
+class FaviconDiscoveryTest(TestCase):
+    """Tests for concurrent favicon discovery"""
+    
+    def test_priority_order_wins_over_completion_order(self):
+        """Test that the highest-priority successful candidate is returned"""
+        def check_exists(url):
+            if url.endswith('/favicon.ico'):
+                time.sleep(0.2)
+                return True
+            return url.endswith('/favicon.png')
+        
+        with patch.object(FaviconService, '_get_favicon_from_html', return_value=None), \
+                patch.object(FaviconService, '_check_favicon_exists', side_effect=check_exists):
+            favicon_url = FaviconService.get_favicon_url('https://example.com')
+        
+        self.assertEqual(favicon_url, 'https://example.com/favicon.ico')
+    
+    def test_probes_run_concurrently(self):
+        """Test that discovery costs roughly one probe timeout, not the sum"""
+        def slow_check(url):
+            time.sleep(0.2)
+            return url.endswith('/assets/favicon.ico')
+        
+        with patch.object(FaviconService, '_get_favicon_from_html', return_value=None), \
+                patch.object(FaviconService, '_check_favicon_exists', side_effect=slow_check):
+            started = time.monotonic()
+            favicon_url = FaviconService.get_favicon_url('https://example.com')
+            elapsed = time.monotonic() - started
+        
+        self.assertEqual(favicon_url, 'https://example.com/assets/favicon.ico')
+        self.assertLess(elapsed, 0.2 * len(FaviconService.FAVICON_PATHS) / 2)
+    
+    def test_overall_deadline(self):
+        """Test that discovery stops at the deadline and keeps finished candidates"""
+        def hanging_html(base_url):
+            time.sleep(1)
+            return 'https://example.com/icon.png'
+        
+        with patch.object(FaviconService, 'DISCOVERY_TIMEOUT', 0.2), \
+                patch.object(FaviconService, '_get_favicon_from_html', side_effect=hanging_html), \
+                patch.object(FaviconService, '_check_favicon_exists', return_value=True):
+            started = time.monotonic()
+            favicon_url = FaviconService.get_favicon_url('https://example.com')
+            elapsed = time.monotonic() - started
+        
+        self.assertEqual(favicon_url, 'https://example.com/favicon.ico')
+        self.assertLess(elapsed, 0.8)
+    
+    def test_deadline_with_pending_probes_is_not_a_miss(self):
+        """Test that running out of time is reported as unavailable and never negative-cached"""
+        caches['favicons'].clear()
+        def slow_check(url):
+            time.sleep(0.5)
+            return True
+        
+        with patch.object(FaviconService, 'DISCOVERY_TIMEOUT', 0.1), \
+                patch.object(FaviconService, '_get_favicon_from_html', return_value=None), \
+                patch.object(FaviconService, '_check_favicon_exists', side_effect=slow_check):
+            with self.assertRaises(FaviconUnavailable):
+                FaviconService.get_favicon_url('https://example.com')
+            with self.assertRaises(FaviconUnavailable):
+                FaviconService.fetch_and_process_favicon('https://example.com')
+        
+        self.assertIsNone(FaviconService.get_cached_favicon('https://example.com'))
+    
+    def test_probe_pool_size_is_configurable(self):
+        """Test that the shared probe pool takes its size from settings"""
+        with patch.object(FaviconService, '_executor', None), self.settings(FAVICON_PROBE_WORKERS=3):
+            executor = FaviconService._get_executor()
+            self.assertEqual(executor._max_workers, 3)
+            executor.shutdown(wait=False)
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """Minimal HTTP/1.1 handler serving a tiny body with keep-alive"""
+    protocol_version = 'HTTP/1.1'
+    
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        if self.headers.get('Connection', '').lower() == 'close':
+            # Tell the client too, so it does not pool a socket we are about to close
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(b'ok')
+    
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledHttpClientTest(TestCase):
+    """Tests for the pooled keep-alive HTTP client"""
+    
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.client = PooledHttpClient(pool_maxsize=2)
+    
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def test_connections_are_reused(self):
+        """Test that sequential requests to one host share a connection"""
+        for path in ('/', '/favicon.ico', '/favicon.png'):
+            self.client.head(self.base_url + path, timeout=5)
+        self.client.get(self.base_url + '/', timeout=5)
+        
+        stats = self.client.stats()
+        self.assertEqual(stats['requests'], 4)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 3)
+
+
+class FaviconCacheTest(TestCase):
+    """Tests for the shared, domain-keyed favicon cache"""
+    
+    def setUp(self):
+        caches['favicons'].clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+    
+    def test_cache_is_keyed_by_normalized_domain(self):
+        """Test that URLs on the same domain share one fetch"""
+        with patch.object(FaviconService, '_fetch_and_process_uncached',
+                          return_value=(b'png-bytes', 'image/png')) as fetch:
+            first = FaviconService.fetch_and_process_favicon('https://www.Example.com/login')
+            second = FaviconService.fetch_and_process_favicon('example.com')
+        
+        self.assertEqual(first, (b'png-bytes', 'image/png'))
+        self.assertEqual(second, first)
+        self.assertEqual(fetch.call_count, 1)
+    
+    def test_failures_are_negatively_cached(self):
+        """Test that a domain without a favicon is not probed again"""
+        with patch.object(FaviconService, '_fetch_and_process_uncached',
+                          return_value=(None, None)) as fetch:
+            FaviconService.fetch_and_process_favicon('https://dead.example')
+            result = FaviconService.fetch_and_process_favicon('https://dead.example/other')
+        
+        self.assertEqual(result, (None, None))
+        self.assertEqual(fetch.call_count, 1)
+    
+    def test_account_fetch_reads_cache(self):
+        """Test that Account.fetch_favicon is served from the cache"""
+        accounts = [
+            Account.objects.create(username=f'user{i}', password='', url='https://gmail.com', author=self.user)
+            for i in range(3)
+        ]
+        with patch.object(FaviconService, '_fetch_and_process_uncached',
+                          return_value=(b'png-bytes', 'image/png')) as fetch:
+            for account in accounts:
+                self.assertTrue(account.fetch_favicon())
+        
+        self.assertEqual(fetch.call_count, 1)
+        accounts[2].refresh_from_db()
+        self.assertEqual(bytes(accounts[2].favicon), b'png-bytes')
+
+
+class FaviconJobQueueTest(APITestCase):
+    """Tests for the DB-backed favicon job queue and its endpoints"""
+    
+    def setUp(self):
+        caches['favicons'].clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.access_token}')
+        
+        self.account = Account.objects.create(
+            username='john_doe',
+            password='',
+            url='https://gmail.com',
+            author=self.user
+        )
+    
+    def test_account_endpoint_returns_202_with_status_url(self):
+        """Test that fetching an account favicon is queued, not run inline"""
+        url = reverse('fetch-account-favicon', kwargs={'pk': self.account.pk})
+        response = self.client.post(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = FaviconJob.objects.get(pk=response.data['job_id'])
+        self.assertEqual(job.account, self.account)
+        
+        response = self.client.get(response.data['status_url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], FaviconJob.STATUS_PENDING)
+    
+    def test_duplicate_requests_share_one_job(self):
+        """Test that an active job is reused instead of queueing another"""
+        url = reverse('fetch-account-favicon', kwargs={'pk': self.account.pk})
+        first = self.client.post(url)
+        second = self.client.post(url)
+        
+        self.assertEqual(first.data['job_id'], second.data['job_id'])
+    
+    def test_url_endpoint_reads_favicon_fetched_by_worker(self):
+        """Test that a domain the worker fetched is served without a job even on a cold cache"""
+        FaviconSource.objects.create(
+            domain='gmail.com', icon_url='https://gmail.com/favicon.ico', content_hash='x',
+            favicon=b'png-bytes', favicon_content_type='image/png',
+        )
+        response = self.client.post(reverse('fetch-favicon'), {'url': 'https://www.gmail.com/'}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['size_bytes'], len(b'png-bytes'))
+        self.assertFalse(FaviconJob.objects.exists())
+        
+        FaviconSource.objects.update(checked_at=timezone.now() - timedelta(days=30))
+        caches['favicons'].clear()
+        response = self.client.post(reverse('fetch-favicon'), {'url': 'https://gmail.com'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+    
+    def test_creating_account_enqueues_job(self):
+        """Test that AccountSerializer.create queues a favicon fetch"""
+        url = reverse('account-list')
+        response = self.client.post(url, {
+            'username': 'jane', 'password': 'pw', 'url': 'https://github.com'
+        }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(FaviconJob.objects.filter(account_id=response.data['id']).exists())
+    
+    def test_run_job_stores_result_on_account(self):
+        """Test that a claimed job writes the favicon onto its account"""
+        job = enqueue_favicon_job(self.account.url, self.user, self.account)
+        with patch.object(FaviconService, '_fetch_and_process_uncached',
+                          return_value=(b'png-bytes', 'image/png')):
+            claimed = claim_jobs(10)
+            self.assertEqual([j.pk for j in claimed], [job.pk])
+            self.assertEqual(claim_jobs(10), [])
+            run_job(claimed[0])
+        
+        job.refresh_from_db()
+        self.account.refresh_from_db()
+        self.assertEqual(job.status, FaviconJob.STATUS_SUCCEEDED)
+        self.assertEqual(bytes(self.account.favicon), b'png-bytes')
+    
+    def test_failed_job_is_retried_with_backoff(self):
+        """Test that a failed attempt is rescheduled, then marked failed"""
+        job = enqueue_favicon_job(self.account.url, self.user, self.account)
+        with self.settings(FAVICON_JOB_MAX_ATTEMPTS=2), \
+                patch.object(FaviconService, '_fetch_and_process_uncached', return_value=(None, None)):
+            run_job(claim_jobs(10)[0])
+            job.refresh_from_db()
+            self.assertEqual(job.status, FaviconJob.STATUS_PENDING)
+            self.assertGreater(job.run_after, timezone.now())
+            self.assertEqual(claim_jobs(10), [])
+            
+            FaviconJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            run_job(claim_jobs(10)[0])
+            job.refresh_from_db()
+            self.assertEqual(job.status, FaviconJob.STATUS_FAILED)
+    
+    def test_account_deleted_while_running(self):
+        """Test that deleting the account mid-fetch drops the job instead of raising"""
+        enqueue_favicon_job(self.account.url, self.user, self.account)
+        
+        def delete_account(url):
+            Account.objects.filter(pk=self.account.pk).delete()
+            return b'png-bytes', 'image/png'
+        
+        with patch.object(FaviconService, '_fetch_and_process_uncached', side_effect=delete_account):
+            self.assertIsNone(run_job(claim_jobs(10)[0]))
+        self.assertFalse(FaviconJob.objects.exists())
+    
+    def test_prune_removes_only_old_finished_jobs(self):
+        """Test that the retention sweep keeps active and recent jobs"""
+        old = timezone.now() - timedelta(days=30)
+        for job_status in (FaviconJob.STATUS_SUCCEEDED, FaviconJob.STATUS_FAILED, FaviconJob.STATUS_PENDING):
+            job = FaviconJob.objects.create(url='https://old.com', author=self.user, status=job_status)
+            FaviconJob.objects.filter(pk=job.pk).update(updated_at=old)
+        recent = FaviconJob.objects.create(url='https://new.com', author=self.user, status=FaviconJob.STATUS_SUCCEEDED)
+        
+        self.assertEqual(prune_jobs(retention=7 * 24 * 3600, batch_size=1), 2)
+        self.assertEqual(
+            set(FaviconJob.objects.values_list('status', 'url')),
+            {(FaviconJob.STATUS_PENDING, 'https://old.com'), (recent.status, 'https://new.com')},
+        )
+
+
+class FaviconWorkerCommandTest(TransactionTestCase):
+    """Tests for the run_favicon_worker management command"""
+    
+    def setUp(self):
+        caches['favicons'].clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.account = Account.objects.create(
+            username='john_doe',
+            password='',
+            url='https://gmail.com',
+            author=self.user
+        )
+    
+    def test_worker_command_drains_queue(self):
+        """Test that run_favicon_worker --once processes queued jobs"""
+        enqueue_favicon_job(self.account.url, self.user, self.account)
+        with patch.object(FaviconService, '_fetch_and_process_uncached',
+                          return_value=(b'png-bytes', 'image/png')):
+            call_command('run_favicon_worker', once=True, concurrency=2, stdout=StringIO())
+        
+        self.assertEqual(FaviconJob.objects.get().status, FaviconJob.STATUS_SUCCEEDED)
+        self.account.refresh_from_db()
+        self.assertEqual(bytes(self.account.favicon), b'png-bytes')
+    
+    def test_crashing_job_does_not_stop_worker(self):
+        """Test that an exception escaping one job is reported and the others still run"""
+        other = Account.objects.create(username='jane', password='', url='https://github.com', author=self.user)
+        crashing = enqueue_favicon_job(self.account.url, self.user, self.account)
+        enqueue_favicon_job(other.url, self.user, other)
+        original = run_job
+        
+        def crash_one(job):
+            if job.pk == crashing.pk:
+                raise RuntimeError('boom')
+            return original(job)
+        
+        stderr = StringIO()
+        with patch('api.management.commands.run_favicon_worker.run_job', side_effect=crash_one), \
+                patch.object(FaviconService, '_fetch_and_process_uncached', return_value=(b'png-bytes', 'image/png')):
+            call_command('run_favicon_worker', once=True, concurrency=2, stdout=StringIO(), stderr=stderr)
+        
+        self.assertIn(f'Job {crashing.pk} crashed: boom', stderr.getvalue())
+        self.assertEqual(FaviconJob.objects.get(account=other).status, FaviconJob.STATUS_SUCCEEDED)
+
+    
+    def test_database_errors_back_off_instead_of_exiting(self):
+        """Test that a failed claim or prune is retried after a pause instead of ending the worker"""
+        enqueue_favicon_job(self.account.url, self.user, self.account)
+        errors = [OperationalError('server closed the connection')]
+        
+        def flaky_claim(batch_size):
+            if errors:
+                raise errors.pop()
+            return claim_jobs(batch_size)
+        
+        stderr = StringIO()
+        with patch('api.management.commands.run_favicon_worker.prune_jobs',
+                   side_effect=[OperationalError('database is locked'), 0]), \
+                patch('api.management.commands.run_favicon_worker.claim_jobs', side_effect=flaky_claim), \
+                patch('api.management.commands.run_favicon_worker.time.sleep') as sleep, \
+                patch.object(FaviconService, '_fetch_and_process_uncached', return_value=(b'png-bytes', 'image/png')):
+            call_command('run_favicon_worker', once=True, poll_interval=1, stdout=StringIO(), stderr=stderr)
+        
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [2, 4])
+        self.assertIn('database is locked', stderr.getvalue())
+        self.assertEqual(FaviconJob.objects.get().status, FaviconJob.STATUS_SUCCEEDED)
+
+class FaviconEndpointTest(APITestCase):
+    """Tests for the content-addressed, HTTP-cacheable favicon endpoint"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.access_token}')
+        
+        self.account = Account.objects.create(
+            username='john_doe',
+            password='',
+            url='https://gmail.com',
+            author=self.user
+        )
+        self.account.set_favicon(b'png-bytes', 'image/png')
+        self.account.save()
+    
+    def test_list_returns_favicon_endpoint_url(self):
+        """Test that list payloads reference the favicon instead of inlining it"""
+        response = self.client.get(reverse('account-list'))
+        
+        favicon_url = response.data[0]['favicon_url']
+        token = self.account.get_favicon_token()
+        self.assertTrue(favicon_url.endswith(f'/api/favicons/{self.account.pk}/{token}/'))
+        self.assertNotIn(self.account.favicon_hash, favicon_url)
+        self.assertNotIn('base64', favicon_url)
+    
+    def test_favicon_served_with_cache_headers(self):
+        """Test that the endpoint serves raw bytes with a strong ETag"""
+        self.client.credentials()
+        token = self.account.get_favicon_token()
+        url = reverse('favicon', kwargs={'pk': self.account.pk, 'token': token})
+        response = self.client.get(url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, b'png-bytes')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['ETag'], f'"{token}"')
+        self.assertIn('immutable', response['Cache-Control'])
+        
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_content_hash_cannot_be_probed(self):
+        """Test that knowing a favicon's bytes does not reveal other users' accounts"""
+        self.client.credentials()
+        for pk, token in (
+            (self.account.pk, self.account.favicon_hash),
+            (self.account.pk, 'f' * 32),
+            (self.account.pk + 1, self.account.get_favicon_token()),
+        ):
+            with self.subTest(pk=pk, token=token):
+                response = self.client.get(reverse('favicon', kwargs={'pk': pk, 'token': token}))
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_hidpi_variant_served_by_size(self):
+        """Test that ?size=64 serves the domain's stored variant of this very favicon"""
+        self.client.credentials()
+        token = self.account.get_favicon_token()
+        url = reverse('favicon', kwargs={'pk': self.account.pk, 'token': token})
+        FaviconSource.objects.create(
+            domain='gmail.com', icon_url='https://gmail.com/favicon.ico', content_hash='x',
+            favicon=b'png-bytes', favicon_hidpi=b'hidpi-bytes', favicon_content_type='image/png',
+        )
+        
+        response = self.client.get(url, {'size': 64})
+        self.assertEqual(response.content, b'hidpi-bytes')
+        self.assertEqual(response['ETag'], f'"{token}-64"')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(url, {'size': 128}).status_code, status.HTTP_404_NOT_FOUND)
+        
+        srcset = self.client.get(reverse('account-list'), HTTP_AUTHORIZATION=f'Bearer {self.token.access_token}').data[0]['favicon_srcset']
+        self.assertTrue(srcset.endswith(f'/api/favicons/{self.account.pk}/{token}/?size=64 2x'))
+    
+    def test_missing_hidpi_variant_falls_back_briefly(self):
+        """Test that without a matching variant the default size is served without immutable caching"""
+        self.client.credentials()
+        token = self.account.get_favicon_token()
+        FaviconSource.objects.create(
+            domain='gmail.com', icon_url='https://gmail.com/favicon.ico', content_hash='x',
+            favicon=b'newer-bytes', favicon_hidpi=b'newer-hidpi', favicon_content_type='image/png',
+        )
+        response = self.client.get(reverse('favicon', kwargs={'pk': self.account.pk, 'token': token}), {'size': 64})
+        
+        self.assertEqual(response.content, b'png-bytes')
+        self.assertEqual(response['ETag'], f'"{token}"')
+        self.assertNotIn('immutable', response['Cache-Control'])
+    
+    def test_new_favicon_gets_new_url(self):
+        """Test that replacing the favicon retires the old immutable URL"""
+        old_url = reverse('favicon', kwargs={'pk': self.account.pk, 'token': self.account.get_favicon_token()})
+        self.account.set_favicon(b'other-bytes', 'image/png')
+        self.account.save()
+        
+        self.assertEqual(self.client.get(old_url).status_code, status.HTTP_404_NOT_FOUND)
+        new_url = reverse('favicon', kwargs={'pk': self.account.pk, 'token': self.account.get_favicon_token()})
+        self.assertEqual(self.client.get(new_url).content, b'other-bytes')
+
+
+class FakeStreamingResponse:
+    """Stand-in for a streamed requests.Response that records how much was read"""
+    
+    def __init__(self, url, body, chunk_size=64):
+        self.url = url
+        self.encoding = 'utf-8'
+        self.body = body
+        self.chunk_size = chunk_size
+        self.bytes_served = 0
+    
+    def iter_content(self, chunk_size=None):
+        for start in range(0, len(self.body), self.chunk_size):
+            chunk = self.body[start:start + self.chunk_size]
+            self.bytes_served += len(chunk)
+            yield chunk
+
+
+class FaviconHtmlParsingTest(TestCase):
+    """Tests for streaming, head-only favicon discovery"""
+    
+    HEAD = (
+        b'<html><head><base href="/static/">'
+        b'<link rel="icon" href="icon-16.png" sizes="16x16" type="image/png">'
+        b'<link rel="icon" href="icon.svg" type="image/svg+xml">'
+        b'<LINK REL="Apple-Touch-Icon" HREF="/touch.png" sizes="180x180">'
+        b'<link rel="icon" href="icon-48.png" sizes="48x48">'
+        b'<link rel="manifest" href="/site.webmanifest">'
+        b'</head><body>'
+    )
+    
+    def test_parser_stops_at_end_of_head(self):
+        """Test that the body after </head> is never read"""
+        response = FakeStreamingResponse('https://example.com/', self.HEAD + b'x' * 100000)
+        parser, bytes_read = parse_icon_links(response, max_bytes=64 * 1024)
+        
+        self.assertTrue(parser.done)
+        self.assertLess(response.bytes_served, len(self.HEAD) + 128)
+        self.assertEqual(parser.manifest_url, 'https://example.com/site.webmanifest')
+        self.assertIn('https://example.com/static/icon-16.png', [c.url for c in parser.links])
+    
+    def test_byte_cap_limits_download(self):
+        """Test that pages without </head> are cut off at the byte cap"""
+        response = FakeStreamingResponse('https://example.com/', b'<html><head>' + b'<meta>' * 50000)
+        parse_icon_links(response, max_bytes=4096)
+        
+        self.assertLessEqual(response.bytes_served, 4096 + 64)
+    
+    def test_candidates_are_ranked(self):
+        """Test ranking by decodability, size and rel"""
+        response = FakeStreamingResponse('https://example.com/', self.HEAD)
+        parser, _ = parse_icon_links(response, max_bytes=64 * 1024)
+        manifest = parse_manifest_icons(
+            '{"icons": [{"src": "/android-192.png", "sizes": "192x192", "type": "image/png"}]}',
+            'https://example.com/site.webmanifest'
+        )
+        ranked = [c.url for c in rank_candidates(parser.links + manifest, 32)]
+        
+        self.assertEqual(ranked, [
+            'https://example.com/static/icon-48.png',
+            'https://example.com/touch.png',
+            'https://example.com/android-192.png',
+            'https://example.com/static/icon-16.png',
+            'https://example.com/static/icon.svg',
+        ])
+
+
+class FaviconImagePipelineTest(TestCase):
+    """Tests for the single-decode favicon image pipeline"""
+    
+    def _encode(self, image, image_format, **kwargs):
+        output = BytesIO()
+        image.save(output, format=image_format, **kwargs)
+        return output.getvalue()
+    
+    def test_ico_decodes_closest_frame(self):
+        """Test that only the smallest ICO frame covering the target is decoded"""
+        data = self._encode(Image.new('RGBA', (256, 256), 'red'), 'ICO', sizes=[(16, 16), (32, 32), (64, 64), (256, 256)])
+        
+        self.assertEqual(decode_favicon(data, 32).size, (32, 32))
+        self.assertEqual(decode_favicon(data, 64).size, (64, 64))
+        self.assertEqual(decode_favicon(data, 512).size, (256, 256))
+    
+    def test_jpeg_uses_draft_decoding(self):
+        """Test that large JPEGs are decoded at a reduced scale"""
+        data = self._encode(Image.new('RGB', (1024, 1024), 'blue'), 'JPEG')
+        image = decode_favicon(data, 64)
+        
+        self.assertLess(image.size[0], 1024)
+        self.assertGreaterEqual(image.size[0], 64)
+    
+    def test_decompression_bomb_is_rejected(self):
+        """Test that images declaring too many pixels are refused before decoding"""
+        with patch('api.favicon_images.MAX_IMAGE_PIXELS', 100 * 100):
+            data = self._encode(Image.new('RGB', (101, 100)), 'PNG')
+            with self.assertRaises(ValueError):
+                decode_favicon(data, 32)
+        self.assertGreater(MAX_IMAGE_PIXELS, 256 * 256)
+    
+    def test_palette_image_resized_from_single_decode(self):
+        """Test that a large palette PNG is decoded once and resized to the target"""
+        data = self._encode(Image.new('P', (300, 300)), 'PNG')
+        with patch('api.favicon_images.decode_favicon', wraps=decode_favicon) as decode:
+            image = Image.open(BytesIO(process_favicon(data, 64)))
+        
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual((image.format, image.size), ('PNG', (64, 64)))
+    
+    def test_variants_share_one_decode(self):
+        """Test that the default and HiDPI sizes come from a single decode"""
+        data = self._encode(Image.new('RGBA', (256, 256), 'blue'), 'PNG')
+        with patch('api.favicon_images.decode_favicon', wraps=decode_favicon) as decode:
+            variants = process_favicon_variants(data, (32, 64))
+        
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(decode.call_args[0][1], 64)
+        for size in (32, 64):
+            image = Image.open(BytesIO(variants[size]))
+            self.assertEqual((image.format, image.size), ('PNG', (size, size)))
+    
+    def test_service_returns_32px_and_hidpi_png(self):
+        """Test that FaviconService produces the 32x32 PNG it stores plus the HiDPI variant"""
+        data = self._encode(Image.new('RGB', (16, 16), 'green'), 'ICO')
+        variants = FaviconService._process_favicon(data)
+        
+        self.assertEqual(Image.open(BytesIO(variants[32])).size, (32, 32))
+        self.assertEqual(Image.open(BytesIO(variants[FaviconService.HIDPI_SIZE])).size, (64, 64))
+
+
+class RefreshFaviconsCommandTest(TestCase):
+    """Tests for the refresh_favicons management command"""
+    
+    def setUp(self):
+        caches['favicons'].clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.gmail = [
+            Account.objects.create(username=f'user{i}', password='', url=url, author=self.user)
+            for i, url in enumerate(['https://gmail.com', 'https://www.gmail.com/inbox', 'gmail.com'])
+        ]
+        self.dead = Account.objects.create(username='dead', password='', url='https://dead.example', author=self.user)
+        self.manual = Account.objects.create(
+            username='manual', password='', url='https://manual.example',
+            icon='https://manual.example/icon.png', author=self.user
+        )
+    
+    def _fake_fetch(self, url):
+        if 'gmail' in url:
+            return b'png-bytes', 'image/png'
+        return None, None
+    
+    def _count_overlap(self, per_host, addresses):
+        active, peak = [0], [0]
+        lock = threading.Lock()
+        
+        def slow_fetch(url, refresh=False):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.1)
+            with lock:
+                active[0] -= 1
+            return None, None
+        
+        with patch.object(FaviconService, 'fetch_and_process_favicon', side_effect=slow_fetch), \
+                patch('api.management.commands.refresh_favicons.host_address', side_effect=addresses.get):
+            call_command('refresh_favicons', jitter=0, concurrency=2, per_host=per_host, stdout=StringIO())
+        return peak[0]
+    
+    def test_domains_on_one_server_are_serialized(self):
+        """Test that --per-host limits fetches to distinct domains sharing an address"""
+        shared = {'gmail.com': '203.0.113.7', 'dead.example': '203.0.113.7'}
+        separate = {'gmail.com': '203.0.113.7', 'dead.example': '198.51.100.9'}
+        
+        self.assertEqual(self._count_overlap(1, shared), 1)
+        Account.objects.update(favicon_fetched_at=None)
+        self.assertEqual(self._count_overlap(1, separate), 2)
+    
+    def test_each_domain_fetched_once(self):
+        """Test that stale accounts are grouped by domain and updated in bulk"""
+        with patch.object(FaviconService, '_fetch_and_process_uncached', side_effect=self._fake_fetch) as fetch:
+            call_command('refresh_favicons', jitter=0, stdout=StringIO())
+        
+        self.assertEqual(fetch.call_count, 2)
+        for account in self.gmail:
+            account.refresh_from_db()
+            self.assertEqual(bytes(account.favicon), b'png-bytes')
+            self.assertIsNotNone(account.favicon_hash)
+            self.assertIsNotNone(account.favicon_fetched_at)
+        
+        self.dead.refresh_from_db()
+        self.assertIsNone(self.dead.favicon)
+        self.assertIsNotNone(self.dead.favicon_fetched_at)
+        self.manual.refresh_from_db()
+        self.assertIsNone(self.manual.favicon_fetched_at)
+    
+    def test_timed_out_domains_are_not_stamped(self):
+        """Test that a discovery timeout leaves accounts due for the next run"""
+        with patch.object(FaviconService, '_fetch_and_process_uncached',
+                          side_effect=FaviconUnavailable('timed out')):
+            out = StringIO()
+            call_command('refresh_favicons', jitter=0, stdout=out)
+        
+        self.assertIn('2 timed out', out.getvalue())
+        self.dead.refresh_from_db()
+        self.assertIsNone(self.dead.favicon_fetched_at)
+        self.assertIsNone(FaviconService.get_cached_favicon('https://dead.example'))
+    
+    def test_fresh_accounts_are_skipped(self):
+        """Test that only accounts older than the refresh window are fetched again"""
+        with patch.object(FaviconService, '_fetch_and_process_uncached', side_effect=self._fake_fetch):
+            call_command('refresh_favicons', jitter=0, stdout=StringIO())
+        
+        with patch.object(FaviconService, '_fetch_and_process_uncached', side_effect=self._fake_fetch) as fetch:
+            call_command('refresh_favicons', jitter=0, stdout=StringIO())
+            self.assertEqual(fetch.call_count, 0)
+            
+            call_command('refresh_favicons', jitter=0, max_age=0, stdout=StringIO())
+            self.assertEqual(fetch.call_count, 2)
+
+
+class FakeIconResponse:
+    """Stand-in for a requests.Response returned by an icon download"""
+    
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+    
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ValueError(f"HTTP {self.status_code}")
+
+
+class FaviconRevalidationTest(TestCase):
+    """Tests for conditional revalidation of stored upstream favicons"""
+    
+    ICON_URL = 'https://example.com/favicon.png'
+    
+    def setUp(self):
+        caches['favicons'].clear()
+        output = BytesIO()
+        Image.new('RGB', (48, 48), 'red').save(output, format='PNG')
+        self.icon = output.getvalue()
+        self.requests = []
+    
+    def _fetch(self, *responses):
+        responses = list(responses)
+        
+        def fake_get(url, headers=None, **kwargs):
+            self.requests.append((url, headers or {}))
+            return responses.pop(0)
+        
+        with patch.object(FaviconService, 'get_favicon_url', return_value=self.ICON_URL) as discover, \
+                patch('api.favicon_service.http_client.get', side_effect=fake_get), \
+                patch.object(FaviconService, '_process_favicon', wraps=FaviconService._process_favicon) as process:
+            result = FaviconService.fetch_and_process_favicon('https://www.example.com', refresh=True)
+        return result, discover.call_count, process.call_count
+    
+    def test_first_fetch_stores_validators(self):
+        """Test that the resolved icon URL, validators and content hash are stored"""
+        result, _, _ = self._fetch(FakeIconResponse(200, self.icon, {'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}))
+        
+        source = FaviconSource.objects.get(domain='example.com')
+        self.assertEqual(source.icon_url, self.ICON_URL)
+        self.assertEqual(source.etag, '"v1"')
+        self.assertEqual(source.last_modified, 'Mon, 01 Jan 2024 00:00:00 GMT')
+        self.assertEqual(bytes(source.favicon), result[0])
+        self.assertEqual(Image.open(BytesIO(bytes(source.favicon_hidpi))).size, (64, 64))
+    
+    def test_not_modified_skips_download_and_processing(self):
+        """Test that a 304 reuses the stored favicon without discovery or Pillow"""
+        first, _, _ = self._fetch(FakeIconResponse(200, self.icon, {'ETag': '"v1"'}))
+        result, discovered, processed = self._fetch(FakeIconResponse(304))
+        
+        self.assertEqual(result, first)
+        self.assertEqual((discovered, processed), (0, 0))
+        self.assertEqual(self.requests[-1], (self.ICON_URL, {'If-None-Match': '"v1"'}))
+    
+    def test_identical_content_skips_processing(self):
+        """Test that an unchanged body is not transcoded again"""
+        self._fetch(FakeIconResponse(200, self.icon))
+        result, discovered, processed = self._fetch(FakeIconResponse(200, self.icon, {'ETag': '"v2"'}))
+        
+        self.assertEqual((discovered, processed), (0, 0))
+        self.assertEqual(FaviconSource.objects.get().etag, '"v2"')
+        self.assertEqual(result[1], 'image/png')
+    
+    def test_missing_icon_falls_back_to_discovery(self):
+        """Test that a vanished upstream icon triggers full discovery"""
+        self._fetch(FakeIconResponse(200, self.icon))
+        result, discovered, _ = self._fetch(FakeIconResponse(404), FakeIconResponse(200, self.icon))
+        
+        self.assertEqual(discovered, 1)
+        self.assertIsNotNone(result[0])
+
+
+class FaviconCoalescingTest(TestCase):
+    """Tests for single-flight coalescing of concurrent favicon fetches"""
+    
+    def setUp(self):
+        caches['favicons'].clear()
+    
+    def _fetch_concurrently(self, urls, **kwargs):
+        results = [None] * len(urls)
+        
+        def worker(index, url):
+            results[index] = FaviconService.fetch_and_process_favicon(url, **kwargs)
+        
+        threads = [threading.Thread(target=worker, args=(i, url)) for i, url in enumerate(urls)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+    
+    def test_concurrent_fetches_share_one_request(self):
+        """Test that a burst of fetches for one domain does a single outbound fetch"""
+        def slow_fetch(url):
+            time.sleep(0.2)
+            return b'png-bytes', 'image/png'
+        
+        with patch.object(FaviconService, '_fetch_and_process_uncached', side_effect=slow_fetch) as fetch:
+            results = self._fetch_concurrently(['https://gmail.com', 'https://www.gmail.com/x', 'gmail.com'] * 4, refresh=True)
+        
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(set(results), {(b'png-bytes', 'image/png')})
+    
+    def test_waiters_give_up_after_timeout(self):
+        """Test that waiters return no favicon when the leader takes too long"""
+        def slow_fetch(url):
+            time.sleep(0.3)
+            return b'png-bytes', 'image/png'
+        
+        with self.settings(FAVICON_COALESCE_TIMEOUT=0.05), \
+                patch.object(FaviconService, '_fetch_and_process_uncached', side_effect=slow_fetch):
+            results = self._fetch_concurrently(['https://gmail.com'] * 3)
+        
+        self.assertEqual(results.count((b'png-bytes', 'image/png')), 1)
+        self.assertEqual(results.count((None, None)), 2)
+    
+    def test_errors_are_shared_with_waiters(self):
+        """Test that waiters see the leader's exception"""
+        flight = SingleFlight()
+        started = threading.Event()
+        errors = []
+        
+        def failing():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError('boom')
+        
+        def call(fn):
+            try:
+                flight.do('key', fn)
+            except ValueError as e:
+                errors.append(str(e))
+        
+        leader = threading.Thread(target=call, args=(failing,))
+        leader.start()
+        started.wait()
+        call(lambda: 'never run')
+        leader.join()
+        
+        self.assertEqual(errors, ['boom', 'boom'])
+        self.assertEqual(flight.in_flight(), 0)
+    
+    def test_advisory_lock_is_noop_without_postgres(self):
+        """Test that the cross-process lock is skipped on other databases"""
+        with advisory_lock('favicon:example.com', timeout=1) as acquired:
+            self.assertFalse(acquired)
+
+
+class FaviconBatchEndpointTest(APITestCase):
+    """Tests for the batch favicon resolution endpoint"""
+    
+    def setUp(self):
+        caches['favicons'].clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.access_token}')
+        self.url = reverse('fetch-favicons-batch')
+        
+        self.account = Account.objects.create(
+            username='john_doe',
+            password='',
+            url='https://www.github.com/login',
+            author=self.user
+        )
+        other_user = User.objects.create_user(username='other', password='testpass123')
+        self.other_account = Account.objects.create(
+            username='jane', password='', url='https://private.example', author=other_user
+        )
+    
+    def _fake_fetch(self, url):
+        if 'dead' in url:
+            return None, None
+        return b'png-bytes', 'image/png'
+    
+    def test_domains_are_deduplicated(self):
+        """Test that URLs and accounts on one domain cause a single fetch"""
+        with patch.object(FaviconService, '_fetch_and_process_uncached', side_effect=self._fake_fetch) as fetch:
+            response = self.client.post(self.url, {
+                'urls': ['https://github.com', 'github.com/explore', 'https://dead.example', 'https://'],
+                'account_ids': [self.account.pk, self.other_account.pk],
+            }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(fetch.call_count, 2)
+        favicons = response.data['favicons']
+        self.assertEqual(set(favicons), {'github.com', 'dead.example'})
+        self.assertEqual(response.data['invalid'], ['https://'])
+        self.assertTrue(favicons['github.com']['favicon_url'].startswith('data:image/png;base64,'))
+        self.assertFalse(favicons['dead.example']['success'])
+        self.assertEqual(response.data['accounts'], {str(self.account.pk): 'github.com'})
+    
+    def test_non_integer_account_ids_rejected(self):
+        """Test that malformed account ids are a 400, not a server error"""
+        for account_ids in (['abc'], [1.5], [True], [None], [[1]]):
+            with self.subTest(account_ids=account_ids):
+                response = self.client.post(self.url, {'account_ids': account_ids}, format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_deadline_reports_pending_domains(self):
+        """Test that domains not resolved before the deadline are reported as timed out"""
+        def slow_fetch(url):
+            time.sleep(0.5)
+            return b'png-bytes', 'image/png'
+        
+        with self.settings(FAVICON_BATCH_TIMEOUT=0.1), \
+                patch.object(FaviconService, '_fetch_and_process_uncached', side_effect=slow_fetch):
+            started = time.monotonic()
+            response = self.client.post(self.url, {'urls': ['https://slow.example']}, format='json')
+            elapsed = time.monotonic() - started
+            time.sleep(0.6)
+        
+        self.assertLess(elapsed, 0.4)
+        self.assertEqual(response.data['favicons']['slow.example']['error'], 'Timed out fetching favicon.')
+    
+    def test_validation(self):
+        """Test that empty, malformed and oversized batches are rejected"""
+        self.assertEqual(self.client.post(self.url, {}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(self.url, {'urls': 'github.com'}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        with self.settings(FAVICON_BATCH_MAX_ITEMS=1):
+            response = self.client.post(self.url, {'urls': ['a.com', 'b.com']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class OutboundTrafficTest(APITestCase):
+    """Tests for the DNS cache and per-host circuit breaker of the HTTP client"""
+    
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://localhost:{self.server.server_address[1]}'
+    
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def test_dns_answers_are_cached(self):
+        """Test that new connections reuse a cached lookup until its TTL passes"""
+        client = PooledHttpClient(dns_cache=DnsCache(ttl=60))
+        for _ in range(2):
+            client.get(self.base_url + '/', headers={'Connection': 'close'}, timeout=5)
+        client.close()
+        
+        stats = client.dns_cache.stats()
+        self.assertEqual((stats['misses'], stats['hits']), (1, 1))
+        self.assertEqual(stats['hosts'], ['localhost'])
+    
+    def test_failed_lookups_are_cached(self):
+        """Test that a host that does not resolve is not looked up again right away"""
+        cache = DnsCache(negative_ttl=60)
+        with patch('api.dns_cache.socket.getaddrinfo', side_effect=socket.gaierror('nope')) as lookup:
+            for _ in range(2):
+                with self.assertRaises(OSError):
+                    cache.resolve('dead.invalid', 443)
+        
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(cache.stats()['failed'], ['dead.invalid'])
+    
+    def test_breaker_opens_and_half_opens(self):
+        """Test the closed -> open -> half-open -> closed cycle"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+        breaker.record_failure('example.com')
+        breaker.before_request('example.com')
+        breaker.record_failure('example.com')
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request('example.com')
+        
+        time.sleep(0.15)
+        breaker.before_request('example.com')
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request('example.com')
+        breaker.record_success('example.com')
+        breaker.before_request('example.com')
+        self.assertNotIn('example.com', breaker.stats())
+    
+    def test_other_errors_release_half_open_trial(self):
+        """Test that a trial request failing for a non-network reason does not wedge the circuit"""
+        url = f'http://127.0.0.1:{self.server.server_address[1]}/'
+        client = PooledHttpClient(breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0))
+        client.breaker.record_failure('127.0.0.1')
+        with patch.object(client.session, 'request', side_effect=requests.TooManyRedirects('loop')):
+            with self.assertRaises(requests.TooManyRedirects):
+                client.get(url)
+        
+        self.assertEqual(client.breaker.stats()['127.0.0.1']['state'], CircuitBreaker.HALF_OPEN)
+        client.get(url, timeout=5)
+        client.close()
+        self.assertNotIn('127.0.0.1', client.breaker.stats())
+    
+    def test_breaker_tracks_bounded_number_of_hosts(self):
+        """Test that recovered hosts are forgotten and closed circuits are evicted first"""
+        breaker = CircuitBreaker(failure_threshold=2, max_entries=3)
+        breaker.record_failure('flaky.example')
+        breaker.record_success('flaky.example')
+        self.assertEqual(breaker.stats(), {})
+        
+        breaker.record_failure('down.example')
+        breaker.record_failure('down.example')
+        for host in ('a.example', 'b.example', 'c.example'):
+            breaker.record_failure(host)
+        
+        self.assertEqual(set(breaker.stats()), {'down.example', 'c.example'})
+        self.assertEqual(breaker.stats()['down.example']['state'], CircuitBreaker.OPEN)
+    
+    def test_unreachable_host_is_skipped(self):
+        """Test that a refusing host stops being contacted once its circuit opens"""
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        port = closed.getsockname()[1]
+        closed.close()
+        client = PooledHttpClient(retries=0, breaker=CircuitBreaker(failure_threshold=2))
+        
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                client.head(f'http://127.0.0.1:{port}/favicon.ico', timeout=1)
+        with patch.object(client.session, 'request') as send:
+            with self.assertRaises(CircuitOpenError):
+                client.head(f'http://127.0.0.1:{port}/favicon.png', timeout=1)
+        
+        send.assert_not_called()
+        self.assertEqual(client.status()['circuits']['127.0.0.1']['state'], CircuitBreaker.OPEN)
+    
+    def test_status_endpoint_is_admin_only(self):
+        """Test that only staff can read the outbound traffic status"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        admin = User.objects.create_user(username='admin', password='testpass123', is_staff=True)
+        url = reverse('favicon-http-status')
+        
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(admin).access_token}')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data), {'connections', 'dns', 'circuits'})
+
+
+class FaviconStageMetricsTest(APITestCase):
+    """Tests for stage-level timing of the favicon pipeline"""
+    
+    def setUp(self):
+        caches['favicons'].clear()
+        metrics.reset()
+        output = BytesIO()
+        Image.new('RGB', (64, 64), 'red').save(output, format='PNG')
+        self.icon = output.getvalue()
+    
+    def test_stage_records_duration_bytes_and_outcome(self):
+        """Test that a timed stage feeds the histogram and emits a structured log record"""
+        stage_metrics = StageMetrics()
+        with self.assertLogs('api.favicon_metrics', 'INFO') as logs:
+            with stage_metrics.stage('download', 'example.com') as record:
+                record.bytes = 512
+            with self.assertRaises(ValueError):
+                with stage_metrics.stage('download', 'example.com'):
+                    raise ValueError('boom')
+        
+        report = stage_metrics.snapshot()['download']
+        self.assertEqual(report['count'], 2)
+        self.assertEqual(report['bytes'], 512)
+        self.assertEqual(report['outcomes'], {'ok': 1, 'error': 1})
+        self.assertEqual(report['slowest_hosts'][0]['host'], 'example.com')
+        self.assertEqual(logs.records[0].stage, 'download')
+        self.assertEqual(logs.records[1].outcome, 'error')
+    
+    def test_fetch_records_every_stage(self):
+        """Test that discovery, download and Pillow stages are all timed"""
+        with patch.object(FaviconService, 'get_favicon_url', return_value='https://example.com/favicon.png'), \
+                patch('api.favicon_service.http_client.get', return_value=FakeIconResponse(200, self.icon)):
+            call_command('profile_favicons', 'https://example.com', stdout=StringIO())
+        
+        report = FaviconService.stage_stats()
+        self.assertTrue({'discovery', 'download', 'decode', 'resize', 'encode'} <= set(report))
+        self.assertEqual(report['download']['bytes'], len(self.icon))
+        self.assertEqual(report['discovery']['outcomes'], {'found': 1})
+        self.assertFalse(FaviconSource.objects.exists())
+        self.assertIsNone(FaviconService.get_cached_favicon('https://example.com'))
+    
+    def test_stats_endpoint_is_admin_only(self):
+        """Test that staff can read and reset the stage report"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        admin = User.objects.create_user(username='admin', password='testpass123', is_staff=True)
+        metrics.record('probe', 12.0, 'found', host='example.com')
+        url = reverse('favicon-stage-stats')
+        
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(admin).access_token}')
+        response = self.client.get(url)
+        self.assertEqual(response.data['probe']['p50_ms'], 25)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(url).data, {})
+
+
+class AccountProjectionTest(APITestCase):
+    """Tests for the named account projections that keep favicon bytes out of queries"""
+    
+    def setUp(self):
+        keyring.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.access_token}')
+        
+        self.account = Account.objects.create(
+            username='john_doe',
+            password='',
+            url='https://gmail.com',
+            notes='private notes',
+            author=self.user
+        )
+        self.account.set_password('secret')
+        self.account.set_favicon(b'png-bytes' * 1000, 'image/png')
+        self.account.save()
+    
+    def _account_selects(self, queries):
+        return [q['sql'] for q in queries if q['sql'].startswith('SELECT') and 'FROM "api_account"' in q['sql']]
+    
+    def test_projection_defers_columns(self):
+        """Test which columns each projection leaves unloaded"""
+        queryset = Account.objects.for_author(self.user)
+        
+        self.assertEqual(queryset.projection('detail').query.deferred_loading, ({'favicon', 'favicon_content_type'}, True))
+        deferred, _ = queryset.projection('list', fields={'id', 'username'}).query.deferred_loading
+        self.assertEqual(deferred, {'favicon', 'favicon_content_type', 'notes', 'password'})
+        with self.assertRaises(ValueError):
+            queryset.projection('everything')
+    
+    def test_list_does_not_select_favicon(self):
+        """Test that listing accounts never reads the favicon column"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('account-list'))
+        
+        self.assertEqual(response.data[0]['notes'], 'private notes')
+        self.assertEqual(response.data[0]['decrypted_password'], 'secret')
+        selects = self._account_selects(queries.captured_queries)
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn('"api_account"."favicon",', selects[0])
+    
+    def test_sparse_list_skips_notes_and_ciphertext(self):
+        """Test that a sparse fieldset also leaves notes and passwords unloaded"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('account-list'), {'fields': 'id,username', 'reveal': 'false'})
+        
+        self.assertEqual(response.data, [{'id': self.account.pk, 'username': 'john_doe'}])
+        selects = self._account_selects(queries.captured_queries)
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn('"api_account"."notes"', selects[0])
+        self.assertNotIn('"api_account"."password"', selects[0])
+    
+    def test_update_does_not_rewrite_favicon(self):
+        """Test that updating an account neither reads nor writes the favicon bytes"""
+        url = reverse('account-detail', kwargs={'pk': self.account.pk})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(url, {'username': 'jane_doe'}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for query in queries.captured_queries:
+            self.assertNotIn('"favicon" =', query['sql'])
+            self.assertNotIn('"api_account"."favicon",', query['sql'])
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.username, 'jane_doe')
+        self.assertEqual(bytes(self.account.favicon), b'png-bytes' * 1000)
+
+
+class AccountCursorPaginationTest(APITestCase):
+    """Tests for opt-in keyset pagination of the account list"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.access_token}')
+        self.url = reverse('account-list')
+        
+        # Duplicate usernames and timestamps exercise the id tiebreaker
+        created_at = timezone.now()
+        for i in range(7):
+            account = Account.objects.create(
+                username=f'user{i % 3}',
+                password='',
+                url=f'https://site{i}.example.com',
+                author=self.user
+            )
+            Account.objects.filter(pk=account.pk).update(created_at=created_at)
+    
+    def _walk(self, params):
+        ids = []
+        response = self.client.get(self.url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+    
+    def test_unpaginated_by_default(self):
+        """Test that the plain list endpoint still returns a bare list"""
+        response = self.client.get(self.url)
+        
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 7)
+    
+    def test_pages_cover_every_ordering_once(self):
+        """Test that walking the cursors returns every account exactly once in order"""
+        for ordering in ('-created_at', 'username', 'url', '-username'):
+            tiebreaker = '-id' if ordering.startswith('-') else 'id'
+            expected = list(Account.objects.order_by(ordering, tiebreaker).values_list('id', flat=True))
+            self.assertEqual(self._walk({'ordering': ordering, 'page_size': 3}), expected, ordering)
+    
+    def test_no_count_query(self):
+        """Test that a page is served without counting the vault"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'page_size': 2, 'reveal': 'false'})
+        
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries.captured_queries))
+    
+    def test_works_with_filters_and_search(self):
+        """Test that cursors respect AccountFilter and SearchFilter"""
+        self.assertEqual(len(self._walk({'username_contains': 'user1', 'page_size': 1})), 2)
+        self.assertEqual(len(self._walk({'search': 'user2', 'ordering': 'url', 'page_size': 1})), 2)
+    
+    def test_invalid_cursor_and_ordering(self):
+        """Test that garbage cursors, cursors for another ordering and bad page sizes are rejected"""
+        self.assertEqual(self.client.get(self.url, {'cursor': 'garbage'}).status_code, status.HTTP_404_NOT_FOUND)
+        
+        next_url = self.client.get(self.url, {'page_size': 2, 'ordering': 'username'}).data['next']
+        cursor = next_url.split('cursor=')[1].split('&')[0]
+        response = self.client.get(self.url, {'cursor': cursor, 'ordering': 'url'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        
+        response = self.client.get(self.url, {'page_size': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AccountSearchBackendTest(APITestCase):
+    """Tests for the indexed account search backend"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.access_token}')
+        self.url = reverse('account-list')
+        
+        self.gmail = Account.objects.create(
+            username='john_doe', password='', url='https://gmail.com',
+            notes='Personal MAILBOX', author=self.user
+        )
+        self.github = Account.objects.create(
+            username='jane_smith', password='', url='https://github.com',
+            notes='Code hosting', author=self.user
+        )
+    
+    def _search(self, term):
+        return set(search_accounts(Account.objects.all(), term).values_list('username', flat=True))
+    
+    def test_sqlite_uses_fts_index(self):
+        """Test that SQLite searches go through the FTS5 trigram table"""
+        self.assertEqual(get_search_backend().name, 'sqlite-fts5')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self._search('mailbox'), {'john_doe'})
+        self.assertIn('MATCH', queries.captured_queries[0]['sql'])
+    
+    def test_substring_semantics_match_icontains(self):
+        """Test that indexed search keeps case-insensitive substring matching"""
+        self.assertEqual(self._search('git'), {'jane_smith'})
+        self.assertEqual(self._search('OHN_D'), {'john_doe'})
+        self.assertEqual(self._search('.com'), {'john_doe', 'jane_smith'})
+        self.assertEqual(self._search('ja'), {'jane_smith'})
+        self.assertEqual(self._search('"quoted"'), set())
+    
+    def test_index_follows_saves_and_deletes(self):
+        """Test that updated and deleted accounts are reflected in search"""
+        self.github.notes = 'Source control'
+        self.github.save()
+        self.assertEqual(self._search('hosting'), set())
+        self.assertEqual(self._search('source'), {'jane_smith'})
+        
+        self.github.delete()
+        self.assertEqual(self._search('source'), set())
+    
+    def test_search_filter_terms_are_anded(self):
+        """Test that the DRF search param requires every term to match"""
+        response = self.client.get(self.url, {'search': 'john gmail'})
+        self.assertEqual([a['username'] for a in response.data], ['john_doe'])
+        
+        response = self.client.get(self.url, {'search': 'john github'})
+        self.assertEqual(response.data, [])
+
+
+class AccountDomainTest(APITestCase):
+    """Tests for the normalized, indexed domain column"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.access_token}')
+        self.url = reverse('account-list')
+        
+        self.google = Account.objects.create(
+            username='john_doe', password='', url='https://www.Google.com/login', author=self.user
+        )
+        self.mail = Account.objects.create(
+            username='jane_smith', password='', url='mail.google.com', author=self.user
+        )
+    
+    def test_normalize_domain(self):
+        """Test that scheme, www., port, path and case are stripped"""
+        self.assertEqual(normalize_domain('https://www.Example.com:8443/a?b=c'), 'example.com')
+        self.assertEqual(normalize_domain('example.com/path'), 'example.com')
+        self.assertIsNone(normalize_domain(''))
+        self.assertIsNone(normalize_domain('https://'))
+    
+    def test_domain_computed_on_save(self):
+        """Test that the domain follows the url, including update_fields saves"""
+        self.assertEqual(self.google.domain, 'google.com')
+        self.assertEqual(self.mail.domain, 'mail.google.com')
+        
+        self.mail.url = 'https://outlook.com'
+        self.mail.save(update_fields=['url'])
+        self.mail.refresh_from_db()
+        self.assertEqual(self.mail.domain, 'outlook.com')
+    
+    def test_filter_is_exact_indexed_lookup(self):
+        """Test that the domain filter matches hosts exactly through the domain column"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'domain': 'google.com'})
+        self.assertEqual([a['username'] for a in response.data], ['john_doe'])
+        sql = queries.captured_queries[-1]['sql']
+        self.assertIn('"api_account"."domain" = ', sql)
+        self.assertNotIn('LIKE', sql)
+        
+        response = self.client.get(self.url, {'domain': 'https://www.mail.google.com/inbox'})
+        self.assertEqual([a['username'] for a in response.data], ['jane_smith'])
+    
+    def test_refresh_groups_by_domain_column(self):
+        """Test that stale-favicon selection groups accounts by the stored domain"""
+        Account.objects.create(username='other', password='', url='http://google.com', author=self.user)
+        with patch.object(FaviconService, 'fetch_and_process_favicon', return_value=(None, None)) as fetch:
+            call_command('refresh_favicons', stdout=StringIO())
+        self.assertEqual(fetch.call_count, 2)
+
+
+class AccountQueryPlanTest(APITestCase):
+    """Tests that list, ordering and date-range queries are served by an index"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        other = User.objects.create_user(username='otheruser', password='testpass123')
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.access_token}')
+        self.url = reverse('account-list')
+        for author in (self.user, other):
+            for i in range(20):
+                Account.objects.create(
+                    username=f'user{i}', password='', url=f'https://site{i}.com', author=author
+                )
+    
+    def _account_query(self, params):
+        """Return the SQL the list endpoint runs against api_account for `params`"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [q['sql'] for q in queries.captured_queries if 'FROM "api_account"' in q['sql']][-1]
+    
+    def _plan_problems(self, sql):
+        """Return the scan and sort steps in the database's plan for `sql`"""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Tiny test tables would otherwise always be read sequentially
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                problems, nodes = [], [plan[0]['Plan']]
+                while nodes:
+                    node = nodes.pop()
+                    if node['Node Type'] in ('Seq Scan', 'Sort', 'Incremental Sort'):
+                        problems.append(node['Node Type'])
+                    nodes.extend(node.get('Plans', []))
+                return problems
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            details = [row[-1] for row in cursor.fetchall()]
+        return [
+            detail for detail in details
+            if 'TEMP B-TREE' in detail or (detail.startswith('SCAN') and 'USING' not in detail)
+        ]
+    
+    def assertIndexed(self, params):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest(f'No plan checks for {connection.vendor}')
+        sql = self._account_query(params)
+        self.assertEqual(self._plan_problems(sql), [], f'{params} is not served by an index:\n{sql}')
+    
+    def test_default_list(self):
+        """Test the default newest-first list"""
+        self.assertIndexed({})
+    
+    def test_orderings(self):
+        """Test every supported ordering in both directions"""
+        for field in ('created_at', 'username', 'url'):
+            for ordering in (field, f'-{field}'):
+                with self.subTest(ordering=ordering):
+                    self.assertIndexed({'ordering': ordering})
+    
+    def test_date_range(self):
+        """Test created_after/created_before combined with the default ordering"""
+        self.assertIndexed({
+            'created_after': '2000-01-01T00:00:00Z',
+            'created_before': '2100-01-01T00:00:00Z',
+        })
+    
+    def test_cursor_pages(self):
+        """Test keyset pages, whose ordering carries the id tiebreaker"""
+        for ordering in ('-created_at', 'username'):
+            with self.subTest(ordering=ordering):
+                self.assertIndexed({'ordering': ordering, 'page_size': 5})
+                next_url = self.client.get(self.url, {'ordering': ordering, 'page_size': 5}).data['next']
+                cursor = next_url.split('cursor=')[1].split('&')[0]
+                self.assertIndexed({'ordering': ordering, 'page_size': 5, 'cursor': cursor})
+
+
+class VaultETagTest(APITestCase):
+    """Tests for vault-version ETags on the account list and detail endpoints"""
+    
+    def setUp(self):
+        keyring.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.token = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.access_token}')
+        self.url = reverse('account-list')
+        
+        self.account = Account.objects.create(
+            username='john_doe', password='', url='https://gmail.com', author=self.user
+        )
+        self.account.set_password('secret123')
+        self.account.save()
+    
+    def _version(self):
+        return VaultVersion.objects.current(self.user.pk)
+    
+    def test_not_modified_skips_account_queries(self):
+        """Test that a matching If-None-Match is answered with 304 without touching accounts"""
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        with CaptureQueriesContext(connection) as queries, \
+                patch('api.serializers.decrypt_passwords') as decrypt:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(any('"api_account"' in q['sql'] for q in queries.captured_queries))
+        decrypt.assert_not_called()
+    
+    def test_etag_depends_on_query_and_resource(self):
+        """Test that different query parameters and objects get different ETags"""
+        detail_url = reverse('account-detail', kwargs={'pk': self.account.pk})
+        etags = {
+            self.client.get(self.url)['ETag'],
+            self.client.get(self.url, {'ordering': 'username'})['ETag'],
+            self.client.get(detail_url)['ETag'],
+        }
+        self.assertEqual(len(etags), 3)
+        self.assertEqual(self.client.get(self.url, {'ordering': 'username'})['ETag'],
+                         self.client.get(self.url, {'ordering': 'username'})['ETag'])
+    
+    def test_writes_invalidate_etag(self):
+        """Test that create, update and delete through the API bump the version"""
+        etag = self.client.get(self.url)['ETag']
+        
+        response = self.client.post(self.url, {
+            'username': 'jane', 'password': 'pw', 'url': 'https://github.com'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+        
+        etag = response['ETag']
+        self.client.patch(reverse('account-detail', kwargs={'pk': self.account.pk}), {'notes': 'x'}, format='json')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+        
+        etag = self.client.get(self.url)['ETag']
+        self.client.delete(reverse('delete-account', kwargs={'pk': self.account.pk}))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+    
+    def test_favicon_writes_bump_version(self):
+        """Test that favicon jobs and the bulk refresh command bump the owner's version"""
+        version = self._version()
+        job = enqueue_favicon_job(self.account.url, self.user, self.account)
+        with patch.object(FaviconService, '_fetch_and_process_uncached',
+                          return_value=(b'png-bytes', 'image/png')):
+            run_job(claim_jobs(10)[0])
+        job.refresh_from_db()
+        self.assertEqual(job.status, FaviconJob.STATUS_SUCCEEDED)
+        self.assertGreater(self._version(), version)
+        
+        version = self._version()
+        Account.objects.filter(pk=self.account.pk).update(favicon=None, favicon_fetched_at=None)
+        with patch.object(FaviconService, 'fetch_and_process_favicon', return_value=(b'new', 'image/png')):
+            call_command('refresh_favicons', stdout=StringIO())
+        self.assertEqual(self._version(), version + 1)
+    
+    def test_other_users_versions_untouched(self):
+        """Test that a write only invalidates its owner's ETags"""
+        other = User.objects.create_user(username='otheruser', password='testpass123')
+        other_version = VaultVersion.objects.current(other.pk)
+        self.account.notes = 'changed'
+        self.account.save()
+        self.assertEqual(VaultVersion.objects.current(other.pk), other_version)
@@ -6,6 +6,7 @@ urlpatterns = [
     path("accounts/", views.AccountListCreate.as_view(), name="account-list"),
     path("accounts/<int:pk>/", views.AccountRetrieveUpdate.as_view(), name="account-detail"),
     path("accounts/delete/<int:pk>/", views.AccountDelete.as_view(), name="delete-account"),
+    path("accounts/<int:pk>/reveal/", views.reveal_account_password, name="reveal-account-password"),
     path("accounts/<int:pk>/fetch-favicon/", views.fetch_account_favicon, name="fetch-account-favicon"),
     
     # Authentication endpoints
@@ -19,4 +20,9 @@ urlpatterns = [
     
     # Favicon endpoints
     path("fetch-favicon/", views.fetch_favicon, name="fetch-favicon"),
+    path("fetch-favicons/", views.fetch_favicons_batch, name="fetch-favicons-batch"),
+    path("favicons/<int:pk>/<str:token>/", views.serve_favicon, name="favicon"),
+    path("favicon-jobs/<int:pk>/", views.favicon_job_status, name="favicon-job-status"),
+    path("favicon-http-status/", views.favicon_http_status, name="favicon-http-status"),
+    path("favicon-stats/", views.favicon_stage_stats, name="favicon-stage-stats"),
 ]
@@ -1,40 +1,109 @@
+import base64
+import hashlib
+import json
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+from django.urls import reverse
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition, require_GET
 from rest_framework import generics, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework_simplejwt.tokens import RefreshToken
-from .serializers import UserSerializer, AccountSerializer
-from rest_framework.permissions import IsAuthenticated, AllowAny
-from .models import Account
-from .filters import AccountFilter
+from .serializers import UserSerializer, AccountSerializer, AccountRevealSerializer
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
+from .models import Account, FaviconJob, FaviconSource, VaultVersion, favicon_token
+from .filters import AccountFilter, AccountSearchFilter
+from .pagination import AccountCursorPagination
 from .favicon_service import FaviconService
+from .favicon_metrics import metrics
+from .favicon_jobs import enqueue_favicon_job
 
-class AccountListCreate(generics.ListCreateAPIView):
+class VaultETagMixin:
+    """
+    Conditional GET keyed on the user's vault version.
+
+    The ETag covers the user, their vault version, the path and the query
+    parameters, so a matching If-None-Match is answered with 304 after a
+    single version lookup, without loading or decrypting any account. The
+    version is read before the accounts are, so a write racing the request
+    can only make the ETag older than the body, never newer.
+    """
+
+    def get_etag(self, request):
+        version = VaultVersion.objects.current(request.user.pk)
+        key = json.dumps([
+            request.user.pk, version, request.path,
+            sorted(request.query_params.lists()), request.accepted_renderer.format,
+        ])
+        return quote_etag(hashlib.sha256(key.encode()).hexdigest()[:32])
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
+
+class AccountListCreate(VaultETagMixin, generics.ListCreateAPIView):
     serializer_class = AccountSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, AccountSearchFilter, OrderingFilter]
     filterset_class = AccountFilter
-    search_fields = ['username', 'url', 'notes']
+    search_fields = ['username', 'url', 'notes']  # Matched through api.search
     ordering_fields = ['username', 'url', 'created_at']
     ordering = ['-created_at']  # Default ordering: newest first
+    pagination_class = AccountCursorPagination  # Opt-in with ?page_size= or ?cursor=
 
     def get_queryset(self):
         user = self.request.user
-        return Account.objects.filter(author=user)
+        queryset = Account.objects.for_author(user)
+        if self.request.method == 'GET':
+            fields = self.get_requested_fields()
+            return queryset.projection('list', fields=fields)
+        return queryset.projection('write')
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request.method == 'GET':
+            fields = self.get_requested_fields()
+            if fields is not None:
+                kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+    def get_requested_fields(self):
+        """Return the sparse fieldset asked for via ?fields= and ?reveal=, if any"""
+        params = self.request.query_params
+        fields = None
+        if params.get('fields'):
+            fields = {name.strip() for name in params['fields'].split(',') if name.strip()}
+        if params.get('reveal', '').lower() in ('false', '0', 'no'):
+            if fields is None:
+                fields = set(AccountSerializer.Meta.fields)
+            fields.discard('decrypted_password')
+        return fields
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-class AccountRetrieveUpdate(generics.RetrieveUpdateAPIView):
+class AccountRetrieveUpdate(VaultETagMixin, generics.RetrieveUpdateAPIView):
     serializer_class = AccountSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
-        return Account.objects.filter(author=user)
+        projection = 'detail' if self.request.method == 'GET' else 'write'
+        return Account.objects.for_author(user).projection(projection)
 
     def perform_update(self, serializer):
         """Handle password updates with encryption"""
@@ -53,7 +122,7 @@ class AccountDelete(generics.DestroyAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        return Account.objects.filter(author=user)
+        return Account.objects.for_author(user).projection('write')
 
 
 class CreateUserView(generics.CreateAPIView):
@@ -95,10 +164,23 @@ def login_view(request):
         )
 
 
+def _favicon_job_accepted(request, job):
+    """Build the 202 response pointing the client at a queued favicon job"""
+    return Response(
+        {
+            'success': True,
+            'job_id': job.pk,
+            'status': job.status,
+            'status_url': request.build_absolute_uri(reverse('favicon-job-status', kwargs={'pk': job.pk})),
+        },
+        status=status.HTTP_202_ACCEPTED
+    )
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def fetch_favicon(request):
-    """Fetch and cache favicon for a given URL"""
+    """Return a cached favicon for a given URL, or queue a job to fetch it"""
     url = request.data.get('url')
     if not url:
         return Response(
@@ -107,9 +189,13 @@ def fetch_favicon(request):
         )
     
     try:
-        favicon_data, content_type = FaviconService.fetch_and_process_favicon(url)
+        cached = FaviconService.get_cached_favicon(url)
+        if cached is None:
+            job = enqueue_favicon_job(url, request.user)
+            return _favicon_job_accepted(request, job)
+        
+        favicon_data, content_type = cached
         if favicon_data:
-            import base64
             favicon_b64 = base64.b64encode(favicon_data).decode('utf-8')
             favicon_url = f"data:{content_type};base64,{favicon_b64}"
             
@@ -140,31 +226,85 @@ def fetch_favicon(request):
         )
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def fetch_favicons_batch(request):
+    """Resolve favicons for many URLs and/or accounts at once, one fetch per domain"""
+    urls = request.data.get('urls') or []
+    account_ids = request.data.get('account_ids') or []
+    if not isinstance(urls, list) or not isinstance(account_ids, list):
+        return Response(
+            {'error': 'urls and account_ids must be lists.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not urls and not account_ids:
+        return Response(
+            {'error': 'urls or account_ids is required.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    max_items = getattr(settings, 'FAVICON_BATCH_MAX_ITEMS', 500)
+    if len(urls) + len(account_ids) > max_items:
+        return Response(
+            {'error': f'At most {max_items} URLs and accounts per request.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    # bool is an int subclass, but true is no account id
+    if not all(
+        (isinstance(pk, int) and not isinstance(pk, bool)) or (isinstance(pk, str) and pk.isascii() and pk.isdigit())
+        for pk in account_ids
+    ):
+        return Response(
+            {'error': 'account_ids must be integers.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    accounts = {}
+    if account_ids:
+        queryset = Account.objects.for_author(request.user).filter(pk__in=account_ids).values_list('pk', 'url', 'domain')
+        for pk, url, domain in queryset:
+            accounts[str(pk)] = (url, domain)
+    
+    all_urls = [str(url) for url in urls] + [url for url, _ in accounts.values()]
+    resolved = FaviconService.fetch_many(all_urls, getattr(settings, 'FAVICON_BATCH_TIMEOUT', 15))
+    
+    favicons = {}
+    invalid = []
+    for url in all_urls:
+        domain = FaviconService.normalize_domain(url)
+        if not domain:
+            invalid.append(url)
+        elif domain not in favicons:
+            favicons[domain] = _favicon_batch_result(resolved.get(domain))
+    
+    return Response(
+        {
+            'favicons': favicons,
+            'accounts': {pk: domain or None for pk, (_, domain) in accounts.items()},
+            'invalid': invalid,
+        },
+        status=status.HTTP_200_OK
+    )
+
+
+def _favicon_batch_result(entry):
+    """Describe one domain's outcome in a batch response"""
+    if entry is None:
+        return {'success': False, 'error': 'Timed out fetching favicon.'}
+    favicon_data, content_type = entry
+    if not favicon_data:
+        return {'success': False, 'error': 'Could not fetch favicon for the given URL.'}
+    favicon_b64 = base64.b64encode(favicon_data).decode('utf-8')
+    return {'success': True, 'favicon_url': f"data:{content_type};base64,{favicon_b64}"}
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def fetch_account_favicon(request, pk):
-    """Fetch and cache favicon for a specific account"""
+    """Queue a favicon fetch for a specific account"""
     try:
-        account = Account.objects.get(pk=pk, author=request.user)
-        
-        if account.fetch_favicon():
-            favicon_url = account.get_favicon_url()
-            return Response(
-                {
-                    'success': True,
-                    'favicon_url': favicon_url,
-                    'message': 'Favicon fetched and cached successfully.'
-                },
-                status=status.HTTP_200_OK
-            )
-        else:
-            return Response(
-                {
-                    'success': False,
-                    'error': 'Could not fetch favicon for this account.'
-                },
-                status=status.HTTP_404_NOT_FOUND
-            )
+        account = Account.objects.for_author(request.user).projection('detail').get(pk=pk)
+        job = enqueue_favicon_job(account.url, request.user, account)
+        return _favicon_job_accepted(request, job)
     except Account.DoesNotExist:
         return Response(
             {'error': 'Account not found.'},
@@ -177,4 +317,108 @@ def fetch_account_favicon(request, pk):
                 'error': f'Error fetching favicon: {str(e)}'
             },
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def favicon_job_status(request, pk):
+    """Report the progress of a queued favicon job"""
+    try:
+        job = FaviconJob.objects.select_related('account').get(pk=pk, author=request.user)
+    except FaviconJob.DoesNotExist:
+        return Response(
+            {'error': 'Job not found.'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    data = {
+        'job_id': job.pk,
+        'status': job.status,
+        'attempts': job.attempts,
+        'account_id': job.account_id,
+    }
+    if job.status == FaviconJob.STATUS_SUCCEEDED:
+        data['favicon_url'] = job.get_favicon_url()
+    elif job.last_error:
+        data['error'] = job.last_error
+    return Response(data, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def reveal_account_password(request, pk):
+    """Decrypt and return the password of a single account on demand"""
+    try:
+        account = Account.objects.for_author(request.user).projection('detail').get(pk=pk)
+    except Account.DoesNotExist:
+        return Response(
+            {'error': 'Account not found.'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    serializer = AccountRevealSerializer(account)
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+def _favicon_etag(request, pk, token):
+    if request.GET.get('size') == str(FaviconService.HIDPI_SIZE):
+        return f'{token}-{FaviconService.HIDPI_SIZE}'
+    return token
+
+
+@require_GET
+@condition(etag_func=_favicon_etag)
+def serve_favicon(request, pk, token):
+    """
+    Serve stored favicon bytes by account token so browsers can cache them forever.
+    
+    `?size=64` serves the HiDPI variant kept on the domain's FaviconSource.
+    Until that exists, the default size is served under its own ETag and
+    without `immutable`, so the real variant replaces it once stored.
+    """
+    size = request.GET.get('size', str(FaviconService.FAVICON_SIZE[0]))
+    if size not in (str(FaviconService.FAVICON_SIZE[0]), str(FaviconService.HIDPI_SIZE)):
+        raise Http404('Favicon not found.')
+    
+    favicon = Account.objects.filter(pk=pk).values_list(
+        'favicon_hash', 'favicon', 'favicon_content_type', 'domain'
+    ).first()
+    if not favicon or not favicon[1] or not constant_time_compare(token, favicon_token(pk, favicon[0])):
+        raise Http404('Favicon not found.')
+    
+    _, favicon_data, content_type, domain = favicon
+    if size == str(FaviconService.HIDPI_SIZE):
+        source = FaviconSource.objects.filter(domain=domain).values_list('favicon', 'favicon_hidpi').first() if domain else None
+        # Only the variant of this very favicon will do; the domain may have moved on
+        if source and source[1] and bytes(source[0]) == bytes(favicon_data):
+            response = HttpResponse(bytes(source[1]), content_type='image/png')
+            response['Cache-Control'] = 'public, max-age=31536000, immutable'
+            return response
+        
+        response = HttpResponse(bytes(favicon_data), content_type=content_type or 'image/png')
+        response['ETag'] = quote_etag(token)
+        response['Cache-Control'] = 'public, max-age=3600'
+        return response
+    
+    response = HttpResponse(bytes(favicon_data), content_type=content_type or 'image/png')
+    # The token covers the content hash, so the bytes behind a URL can never change
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def favicon_http_status(request):
+    """Report outbound favicon traffic state: pooled connections, DNS cache and open circuits"""
+    return Response(FaviconService.outbound_status(), status=status.HTTP_200_OK)
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def favicon_stage_stats(request):
+    """Report per-stage favicon timing histograms of this process; DELETE resets them"""
+    if request.method == 'DELETE':
+        metrics.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response(FaviconService.stage_stats(), status=status.HTTP_200_OK)
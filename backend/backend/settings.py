@@ -152,6 +152,11 @@ CSRF_TRUSTED_ORIGINS = [
 ]
 
 ENCRYPTION_SECRET = "super-secret-encryption-key"
+ENCRYPTION_ENGINE = "aesgcm"  # Engine for new ciphertexts: "aesgcm", "chacha20" or "fernet"
+ENCRYPTION_KEYRING_SIZE = 1024  # Max users whose derived keys stay cached in memory
+ACCOUNT_DECRYPT_BATCH_THRESHOLD = 200  # Rows per list page before decryption goes to a pool
+ACCOUNT_DECRYPT_EXECUTOR = None  # None decrypts inline; "thread" or "process" to use a pool
+ACCOUNT_DECRYPT_WORKERS = None  # Defaults to os.cpu_count()
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -161,3 +166,58 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'noreply@yourdomain.com')
 PASSWORD_RESET_TIMEOUT = 3600
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Point this at Redis/Memcached in production so every worker shares favicons
+    "favicons": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "favicons",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
+# Favicon cache, keyed by normalized domain and shared by all users
+FAVICON_CACHE_ALIAS = "favicons"
+FAVICON_CACHE_TTL = 60 * 60 * 24  # Seconds to keep a fetched favicon
+FAVICON_NEGATIVE_CACHE_TTL = 60 * 60  # Seconds to remember a domain without a favicon
+
+# Outbound HTTP used for favicon discovery
+FAVICON_HTTP_POOL_CONNECTIONS = 32  # Distinct hosts kept in the connection pool
+FAVICON_HTTP_POOL_MAXSIZE = 8  # Open connections per host
+FAVICON_HTTP_RETRIES = 2  # Retries on connection errors
+FAVICON_HTTP_BACKOFF = 0.3  # Seconds, doubled on every retry
+
+# Background favicon jobs (run with `manage.py run_favicon_worker`)
+FAVICON_JOB_MAX_ATTEMPTS = 3
+FAVICON_JOB_RETRY_BACKOFF = 30  # Seconds before the first retry, doubled each time
+FAVICON_JOB_LEASE_SECONDS = 120  # A claimed job is reclaimed if its worker dies
+FAVICON_JOB_RETENTION = 7 * 24 * 3600  # Seconds finished jobs are kept before the worker prunes them
+
+# Bulk favicon refresh (run with `manage.py refresh_favicons`)
+FAVICON_REFRESH_MAX_AGE = 60 * 60 * 24 * 7  # Seconds before a fetched favicon is refreshed
+
+# Concurrent fetches of one domain share a single outbound request
+FAVICON_COALESCE_TIMEOUT = 30  # Seconds a caller waits for an in-flight fetch
+FAVICON_ADVISORY_LOCK = False  # Also coalesce across processes with a Postgres advisory lock
+
+# Batch favicon endpoint (POST /api/fetch-favicons/)
+FAVICON_BATCH_MAX_ITEMS = 500  # URLs plus account ids accepted per request
+FAVICON_BATCH_TIMEOUT = 15  # Seconds before unresolved domains are reported as timed out
+FAVICON_BATCH_WORKERS = 8  # Domains resolved at the same time
+FAVICON_PROBE_WORKERS = 64  # Threads shared by all discovery probes, about 7 per domain in flight
+
+# Outbound traffic protection for favicon fetches
+FAVICON_DNS_CACHE_TTL = 300  # Seconds to reuse a resolved host address
+FAVICON_DNS_NEGATIVE_TTL = 30  # Seconds to remember a host that failed to resolve
+FAVICON_BREAKER_THRESHOLD = 3  # Consecutive failures before a host's circuit opens
+FAVICON_BREAKER_RESET_TIMEOUT = 60  # Seconds before an open circuit lets a trial request through
+
+# Keyset pagination of GET /api/accounts/ (opt-in with ?page_size= or ?cursor=)
+ACCOUNT_PAGE_SIZE = 50
+ACCOUNT_MAX_PAGE_SIZE = 500
+
+# Account search: "auto" uses pg_trgm indexes on Postgres and an FTS5 table on SQLite
+ACCOUNT_SEARCH_BACKEND = "auto"  # or "icontains" to force unindexed matching
@@ -22,6 +22,7 @@ function Account({ account, onDelete }) {
                     {account.favicon_url ? (
                         <img 
                             src={account.favicon_url} 
+                            srcSet={account.favicon_srcset || undefined}
                             alt={`${account.username} icon`}
                             className="favicon"
                         />
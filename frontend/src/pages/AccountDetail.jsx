@@ -159,6 +159,7 @@ function AccountDetail() {
                         {account.favicon_url ? (
                             <img 
                                 src={account.favicon_url} 
+                                srcSet={account.favicon_srcset || undefined}
                                 alt="Account icon" 
                                 className="favicon"
                             />